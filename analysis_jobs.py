@@ -0,0 +1,221 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import logging
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from email_relationship_analyzer.metrics import to_prometheus
+
+logger = logging.getLogger(__name__)
+
+# 分析器的命令行入口，在包目录内以脚本方式运行（包内模块按扁平方式互相导入）
+ANALYZER_MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email_relationship_analyzer', 'main.py')
+# 同时运行的分析任务数量，分析占用大量CPU和内存
+DEFAULT_MAX_RUNNING = 1
+# 保留的已结束任务数量，超过时删除最早的
+DEFAULT_KEEP = 20
+# 子进程写入指标文件的间隔（秒）
+METRICS_INTERVAL = 2.0
+# 任务目录中的输出文件
+OUTPUT_FILES = {
+    'relationships': 'relationships.json',
+    'errors': 'error.json',
+}
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobError(ValueError):
+    """任务请求无效（同时运行的任务过多、任务尚未完成等）"""
+
+
+class JobNotFound(JobError):
+    """任务不存在"""
+
+
+class AnalysisJobManager:
+    """关系分析任务
+
+    每个任务在独立的子进程中运行 main.py，不占用服务进程的CPU和内存，服务重启也不会中断正在运行的分析。
+    任务目录 <root>/<job_id>/ 中保存 job.json（输入文件、参数、进程号）、metrics.json（子进程定时写入的运行指标）、
+    analyzer.log 和分析结果；任务状态由进程是否仍在运行和指标文件中的状态得出。
+    """
+
+    def __init__(self, root_dir: str, max_running: int = DEFAULT_MAX_RUNNING, keep: int = DEFAULT_KEEP):
+        """
+        Args:
+            root_dir (str): 存放任务的目录
+            max_running (int): 同时运行的任务数量上限
+            keep (int): 保留的已结束任务数量
+        """
+        self.root_dir = root_dir
+        self.max_running = max_running
+        self.keep = keep
+        os.makedirs(root_dir, exist_ok=True)
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._lock = threading.Lock()
+
+    def job_dir(self, job_id: str) -> str:
+        """任务目录，任务ID格式不正确或目录不存在时视为不存在"""
+        if not _JOB_ID_RE.match(job_id or ''):
+            raise JobNotFound(f"任务不存在: {job_id}")
+        directory = os.path.join(self.root_dir, job_id)
+        if not os.path.isdir(directory):
+            raise JobNotFound(f"任务不存在: {job_id}")
+        return directory
+
+    def _load_job(self, job_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self.job_dir(job_id), 'job.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_job(self, job: Dict[str, Any]):
+        path = os.path.join(self.root_dir, job['job_id'], 'job.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def _load_metrics(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取子进程写入的指标文件，还没有写入时返回None"""
+        try:
+            with open(os.path.join(self.job_dir(job_id), 'metrics.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_running(self, job: Dict[str, Any]) -> bool:
+        process = self._processes.get(job['job_id'])
+        if process is not None:
+            return process.poll() is None
+        # 服务重启前启动的任务：按进程号检查子进程是否还在
+        try:
+            os.kill(job['pid'], 0)
+        except (OSError, KeyError):
+            return False
+        return True
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """
+        任务状态和最新的运行指标
+
+        Returns:
+            Dict: job.json的内容，加上 state（running、succeeded、failed、cancelled）、
+                error（失败原因）和 metrics（见 AnalysisMetrics.snapshot，还没有写入时为None）
+        """
+        job = self._load_job(job_id)
+        metrics = self._load_metrics(job_id)
+        error = metrics.get('error') if metrics else None
+        if self._is_running(job):
+            state = 'running'
+        elif job.get('cancelled'):
+            state = 'cancelled'
+        elif metrics and metrics['state'] in ('succeeded', 'failed'):
+            state = metrics['state']
+        else:
+            # 进程已退出但指标文件中没有结束状态：分析进程异常退出（例如内存不足被终止）
+            state = 'failed'
+            error = error or '分析进程异常退出，详见analyzer.log'
+        return dict(job, state=state, error=error, metrics=metrics)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """全部任务的状态，最新的在前"""
+        jobs = []
+        for name in os.listdir(self.root_dir):
+            try:
+                jobs.append(self.status(name))
+            except (JobNotFound, OSError, ValueError):
+                continue
+        jobs.sort(key=lambda job: job['created_at'], reverse=True)
+        return jobs
+
+    def start(self, input_file: str, filename: str, external: bool = False) -> Dict[str, Any]:
+        """
+        在子进程中开始分析一个工作簿
+
+        Args:
+            input_file (str): 工作簿路径
+            filename (str): 上传时的文件名（只用于展示）
+            external (bool): 是否使用外部排序归并模式
+
+        Returns:
+            Dict: 任务状态，同status
+        """
+        with self._lock:
+            running = [job for job in self.list() if job['state'] == 'running']
+            if len(running) >= self.max_running:
+                raise JobError(f"已有 {len(running)} 个分析任务正在运行，请等待完成后再开始")
+            self._prune()
+
+            job_id = uuid.uuid4().hex
+            directory = os.path.join(self.root_dir, job_id)
+            os.makedirs(directory)
+            command = [
+                sys.executable, ANALYZER_MAIN, os.path.abspath(input_file),
+                '--output', OUTPUT_FILES['relationships'],
+                '--error', OUTPUT_FILES['errors'],
+                '--metrics-file', 'metrics.json',
+                '--metrics-interval', str(METRICS_INTERVAL),
+            ]
+            if external:
+                command.append('--external')
+            with open(os.path.join(directory, 'analyzer.log'), 'wb') as log:
+                process = subprocess.Popen(command, cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+            self._processes[job_id] = process
+            self._save_job({
+                'job_id': job_id,
+                'filename': filename,
+                'input_file': os.path.abspath(input_file),
+                'external': external,
+                'pid': process.pid,
+                'created_at': time.time(),
+            })
+        logger.info(f"分析任务 {job_id} 已开始: {filename}，进程号 {process.pid}")
+        return self.status(job_id)
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """终止正在运行的任务"""
+        job = self._load_job(job_id)
+        if not self._is_running(job):
+            raise JobError("任务已经结束")
+        process = self._processes.get(job_id)
+        if process is not None:
+            process.terminate()
+            process.wait()
+        else:
+            os.kill(job['pid'], signal.SIGTERM)
+        job['cancelled'] = True
+        self._save_job(job)
+        logger.info(f"分析任务 {job_id} 已取消")
+        return self.status(job_id)
+
+    def metrics_text(self, job_id: str) -> str:
+        """Prometheus文本格式的运行指标，带有job_id标签"""
+        status = self.status(job_id)
+        if status['metrics'] is None:
+            raise JobError("任务还没有写入运行指标")
+        # 以任务状态为准（进程异常退出时指标文件中仍是running）
+        snapshot = dict(status['metrics'], state=status['state'])
+        return to_prometheus(snapshot, {'job_id': job_id})
+
+    def output_path(self, job_id: str, name: str) -> str:
+        """已完成任务的输出文件路径（relationships 或 errors）"""
+        if name not in OUTPUT_FILES:
+            raise JobNotFound(f"输出文件不存在: {name}")
+        status = self.status(job_id)
+        if status['state'] != 'succeeded':
+            raise JobError("任务尚未成功完成")
+        return os.path.join(self.job_dir(job_id), OUTPUT_FILES[name])
+
+    def _prune(self):
+        """只保留最近的若干个已结束任务"""
+        finished = [job for job in self.list() if job['state'] != 'running']
+        for job in finished[self.keep:]:
+            shutil.rmtree(os.path.join(self.root_dir, job['job_id']), ignore_errors=True)
+            self._processes.pop(job['job_id'], None)
+            logger.info(f"已删除较早的分析任务: {job['job_id']}")
@@ -1,9 +1,15 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from excel_searcher import ExcelSearcher
+from query_language import QuerySyntaxError
+from search_cache import SearchCache
+from chunked_upload import ChunkedUploadStore, UploadError, UploadNotFound, DEFAULT_CHUNK_SIZE
+from result_export import EXPORT_FORMATS, iter_csv, iter_ndjson, write_xlsx
+from workbook_store import WorkbookStore
+from federated_searcher import FederatedSearcher
+from thread_index import SUBJECT_COLUMN
+from analysis_jobs import AnalysisJobManager, JobError, JobNotFound
 import os
 import tempfile
-import atexit
-import shutil
 
 app = Flask(__name__, 
            static_url_path='',  # 设置空的URL路径前缀
@@ -11,30 +17,77 @@ app = Flask(__name__,
 
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 400 * 1024 * 1024  # 400MB max-limit
+app.config['SEARCH_CACHE_BYTES'] = 64 * 1024 * 1024  # 搜索结果缓存的内存上限
+app.config['WORKBOOK_STORE_KEEP'] = 5  # 按内容哈希保留的工作簿数量
 
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# 存储当前的ExcelSearcher实例和临时目录
+# 存储当前的ExcelSearcher实例和上传时的文件名
 current_searcher = None
-temp_dir = None
+current_filename = None
+# 搜索结果缓存，键中包含工作簿哈希，重新上传同一个工作簿时仍然有效
+search_cache = SearchCache(app.config['SEARCH_CACHE_BYTES'])
+# 分片上传会话保存在上传目录下，服务重启后仍可续传
+upload_store = ChunkedUploadStore(os.path.join(app.config['UPLOAD_FOLDER'], 'chunked'), app.config['MAX_CONTENT_LENGTH'])
 
-def cleanup():
-    """清理临时文件和目录"""
-    global temp_dir
-    if temp_dir and os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
+def workbooks_in_use():
+    """当前搜索的、联合搜索中的以及正在被分析任务读取的工作簿哈希"""
+    hashes = {workbook['key'] for workbook in federation.list()}
+    if current_searcher is not None:
+        hashes.add(current_searcher.workbook_hash)
+    # 分析任务的输入文件是存放目录中的 <sha256>/workbook.xlsx
+    hashes.update(
+        os.path.basename(os.path.dirname(job['input_file']))
+        for job in analysis_jobs.list() if job['state'] == 'running'
+    )
+    return hashes
 
-# 注册程序退出时的清理函数
-atexit.register(cleanup)
+# 上传的工作簿按内容哈希存放，解析结果和全文索引也保存在其中，再次上传同一个工作簿时不再解析；
+# 正在使用的工作簿不会被淘汰
+workbook_store = WorkbookStore(os.path.join(app.config['UPLOAD_FOLDER'], 'store'), app.config['WORKBOOK_STORE_KEEP'],
+                               in_use=workbooks_in_use)
+# 联合搜索：加入的工作簿保持加载，可以在全部工作簿中同时搜索
+federation = FederatedSearcher()
+# 关系分析任务在子进程中运行，运行指标和结果保存在任务目录中
+analysis_jobs = AnalysisJobManager(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
 
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
 
+def load_workbook(file_path, workbook_hash, filename):
+    """加载存放目录中的工作簿，替换当前的搜索器
+    
+    Args:
+        file_path: 工作簿在存放目录中的路径
+        workbook_hash: 文件内容的SHA-256
+        filename: 上传时的文件名
+    """
+    global current_searcher, current_filename
+    
+    parsed = workbook_store.is_parsed(workbook_hash)
+    workbook_store.touch(workbook_hash)
+    # 创建新的搜索器实例，已解析过的工作簿直接读取列式缓存
+    current_searcher = ExcelSearcher(file_path, cache=search_cache, workbook_hash=workbook_hash,
+                                     artifact_dir=workbook_store.workbook_dir(workbook_hash))
+    current_filename = filename
+    # 预先构建会话索引，查看会话时只需按行号查表
+    if SUBJECT_COLUMN in current_searcher.get_columns():
+        current_searcher.get_thread_index()
+    # 删除其他工作簿的缓存条目（联合搜索中的工作簿除外）
+    search_cache.invalidate([workbook_hash] + [workbook['key'] for workbook in federation.list()])
+    
+    # 返回列名列表和内存占用
+    return jsonify({
+        'columns': current_searcher.get_columns(),
+        'memory': current_searcher.memory_usage(),
+        'sha256': workbook_hash,
+        'reused': parsed
+    })
+
 @app.route('/upload', methods=['POST'])
 def upload():
-    global current_searcher, temp_dir
     
     if 'file' not in request.files:
         return jsonify({'error': '没有上传文件'}), 400
@@ -47,26 +100,58 @@ def upload():
         return jsonify({'error': '只支持Excel文件'}), 400
     
     try:
-        # 清理旧的临时目录
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        
-        # 创建新的临时目录
-        temp_dir = tempfile.mkdtemp()
-        temp_file = os.path.join(temp_dir, file.filename)
-        file.save(temp_file)
-        
-        # 创建新的搜索器实例
-        current_searcher = ExcelSearcher(temp_file)
-        
-        # 返回列名列表
-        return jsonify({
-            'columns': current_searcher.get_columns()
-        })
+        # 边接收边计算哈希，同一内容的工作簿只保存一份
+        file_path, workbook_hash = workbook_store.add_stream(file.stream, os.path.splitext(file.filename)[1])
+        return load_workbook(file_path, workbook_hash, file.filename)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 分片上传：init 创建会话，按序号上传各分片（可并发、可续传），全部收到后 complete 开始解析
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    data = request.get_json()
+    filename = data.get('filename', '')
+    if not filename.endswith(('.xlsx', '.xls')):
+        return jsonify({'error': '只支持Excel文件'}), 400
+    try:
+        return jsonify(upload_store.init(filename, int(data.get('size', 0)), int(data.get('chunk_size', DEFAULT_CHUNK_SIZE))))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/upload/<upload_id>/status')
+def upload_status(upload_id):
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/upload/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """分片内容为原始请求体，X-Chunk-SHA256 请求头为分片的SHA-256（必须提供）"""
+    try:
+        return jsonify(upload_store.write_chunk(upload_id, index, request.stream, request.headers.get('X-Chunk-SHA256')))
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    try:
+        result = upload_store.complete(upload_id)
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        file_path = workbook_store.add_file(result['path'], result['sha256'])
+        upload_store.remove(upload_id)
+        return load_workbook(file_path, result['sha256'], result['filename'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/search', methods=['POST'])
 def search():
     global current_searcher
@@ -78,12 +163,25 @@ def search():
         data = request.get_json()
         column_name = data.get('column_name', '')
         search_terms = data.get('search_terms', [])
+        mode = data.get('mode', 'keyword')
         
         if not search_terms:
             return jsonify({'error': '请输入搜索内容'}), 400
         
+        # 全文检索：多个搜索项合并为一个查询，按相关度返回前top_k条
+        if mode == 'fulltext':
+            top_k = min(int(data.get('top_k', 20)), 100)
+            results = current_searcher.fulltext_search(' '.join(search_terms), column_name or None, top_k)
+            return jsonify(results)
+        
         # 执行搜索
-        if column_name:
+        if mode == 'query':
+            # 查询语句：多个搜索项之间为AND，列名由语句中的 列名:值 指定
+            try:
+                results = current_searcher.query_search(' '.join(f'({term})' for term in search_terms))
+            except QuerySyntaxError as e:
+                return jsonify({'error': f'查询语法错误：{e}'}), 400
+        elif column_name:
             results = current_searcher.column_search(column_name, search_terms)
         else:
             results = current_searcher.global_search(search_terms)
@@ -101,6 +199,214 @@ def search():
             return jsonify({'error': '文件已失效，请重新上传'}), 400
         return jsonify({'error': str(e)}), 500
 
+@app.route('/export', methods=['POST'])
+def export():
+    """按搜索条件流式导出结果（CSV / NDJSON / XLSX），只取出选中的列
+    
+    参数与 /search 相同，另外支持 format（csv、ndjson、xlsx）和 columns（导出的列，默认全部）。
+    既接受JSON，也接受表单提交（浏览器直接下载，不经过前端内存）。
+    """
+    global current_searcher
+    
+    if current_searcher is None:
+        return jsonify({'error': '请先上传文件'}), 400
+    
+    if request.is_json:
+        data = request.get_json()
+        search_terms = data.get('search_terms', [])
+        columns = data.get('columns') or None
+    else:
+        data = request.form
+        search_terms = data.getlist('search_terms')
+        columns = data.getlist('columns') or None
+    search_terms = [term for term in search_terms if term.strip()]
+    export_format = data.get('format', 'csv')
+    
+    if not search_terms:
+        return jsonify({'error': '请输入搜索内容'}), 400
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的导出格式：{export_format}'}), 400
+    
+    searcher = current_searcher
+    columns = columns or searcher.get_columns()
+    try:
+        positions = searcher.find_positions(
+            search_terms,
+            data.get('column_name', ''),
+            data.get('mode', 'keyword'),
+            int(data.get('top_k', 1000))
+        )
+        batches = searcher.iter_row_batches(positions, columns)
+    except QuerySyntaxError as e:
+        return jsonify({'error': f'查询语法错误：{e}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    headers = {'Content-Disposition': f'attachment; filename=search_results.{extension}'}
+    if export_format == 'xlsx':
+        # xlsx是zip格式，无法边生成边发送；只写模式逐行写入临时文件，发送完后删除
+        fd, output_file = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            write_xlsx(columns, batches, output_file)
+        except Exception:
+            os.remove(output_file)
+            raise
+        
+        def iter_output_file():
+            try:
+                with open(output_file, 'rb') as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+            finally:
+                os.remove(output_file)
+                
+        stream = iter_output_file()
+    elif export_format == 'csv':
+        stream = iter_csv(columns, batches)
+    else:
+        stream = iter_ndjson(columns, batches)
+        
+    return Response(stream_with_context(stream), content_type=content_type, headers=headers)
+
+@app.route('/thread/<int:row_index>')
+def thread(row_index):
+    """查看某一行所在的整个会话（原始邮件和全部回复），以及涉及该行的关系键"""
+    if current_searcher is None:
+        return jsonify({'error': '请先上传文件'}), 400
+    try:
+        return jsonify(current_searcher.conversation(row_index))
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/federation', methods=['GET'])
+def federation_list():
+    """联合搜索中的工作簿及其摘要（行数、消息标识数、域名数、发送时间范围）"""
+    return jsonify(federation.list())
+
+@app.route('/federation/add', methods=['POST'])
+def federation_add():
+    """将当前工作簿加入联合搜索"""
+    if current_searcher is None:
+        return jsonify({'error': '请先上传文件'}), 400
+    federation.add(current_searcher.workbook_hash, current_filename, current_searcher)
+    return jsonify(federation.list())
+
+@app.route('/federation/<key>', methods=['DELETE'])
+def federation_remove(key):
+    if not federation.remove(key):
+        return jsonify({'error': '工作簿不在联合搜索中'}), 404
+    return jsonify(federation.list())
+
+@app.route('/federation/search', methods=['POST'])
+def federation_search():
+    """在联合搜索的全部工作簿中搜索
+    
+    参数与 /search 相同，另外可以用 domain（域名）、start / end（发送时间范围）缩小范围，
+    摘要中不可能满足条件的工作簿整体跳过。
+    """
+    data = request.get_json()
+    search_terms = data.get('search_terms', [])
+    if not search_terms:
+        return jsonify({'error': '请输入搜索内容'}), 400
+    if not federation.list():
+        return jsonify({'error': '联合搜索中还没有工作簿'}), 400
+    
+    try:
+        results = federation.search(
+            search_terms,
+            data.get('column_name', ''),
+            data.get('mode', 'keyword'),
+            min(int(data.get('top_k', 20)), 100),
+            domain=data.get('domain'),
+            start=data.get('start'),
+            end=data.get('end')
+        )
+    except QuerySyntaxError as e:
+        return jsonify({'error': f'查询语法错误：{e}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if len(results) > 100:
+        msg = f"搜索结果过多，无法展示，数量：{len(results)}"
+        return jsonify({'error': msg}), 400
+    return jsonify(results)
+
+@app.route('/federation/message', methods=['POST'])
+def federation_message():
+    """按邮件消息标识在联合搜索的全部工作簿中精确查找"""
+    message_id = (request.get_json().get('message_id') or '').strip()
+    if not message_id:
+        return jsonify({'error': '请输入邮件消息标识'}), 400
+    return jsonify(federation.find_message(message_id))
+
+@app.route('/jobs', methods=['POST'])
+def job_start():
+    """对当前工作簿开始关系分析任务，external为true时使用外部排序归并模式"""
+    if current_searcher is None:
+        return jsonify({'error': '请先上传文件'}), 400
+    file_path = workbook_store.find(current_searcher.workbook_hash)
+    if file_path is None:
+        return jsonify({'error': '文件已失效，请重新上传'}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(analysis_jobs.start(file_path, current_filename, bool(data.get('external')))), 202
+    except JobError as e:
+        return jsonify({'error': str(e)}), 429
+
+@app.route('/jobs', methods=['GET'])
+def job_list():
+    return jsonify(analysis_jobs.list())
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """任务状态和运行指标（行/秒、数据块耗时分位数、暂存回复数、关系数、内存）"""
+    try:
+        return jsonify(analysis_jobs.status(job_id))
+    except JobNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/jobs/<job_id>/metrics')
+def job_metrics(job_id):
+    """Prometheus文本格式的运行指标"""
+    try:
+        return Response(analysis_jobs.metrics_text(job_id), content_type='text/plain; version=0.0.4; charset=utf-8')
+    except JobNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except JobError as e:
+        return jsonify({'error': str(e)}), 409
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    try:
+        return jsonify(analysis_jobs.cancel(job_id))
+    except JobNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except JobError as e:
+        return jsonify({'error': str(e)}), 409
+
+@app.route('/jobs/<job_id>/download/<name>')
+def job_download(job_id, name):
+    """下载已完成任务的结果：relationships（关系集合）或 errors（异常数据）"""
+    try:
+        path = analysis_jobs.output_path(job_id, name)
+    except JobNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except JobError as e:
+        return jsonify({'error': str(e)}), 409
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
+
+@app.route('/cache/stats')
+def cache_stats():
+    """搜索结果缓存的命中率和内存占用"""
+    return jsonify(search_cache.stats())
+
 @app.route('/download/<filename>')
 def download(filename):
     """下载搜索结果文件"""
@@ -0,0 +1,145 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app
+
+logger = logging.getLogger(__name__)
+
+# 同时执行的重请求（上传、搜索、导出、查看会话）数量，搜索是CPU密集的，默认与CPU核数相同
+DEFAULT_MAX_CONCURRENT = os.cpu_count() or 1
+# 排队等待的请求数量上限，超过时直接返回503
+DEFAULT_MAX_QUEUE = 32
+# 排队的最长时间（秒），超时返回503
+DEFAULT_QUEUE_TIMEOUT = 30.0
+# 受并发限制的请求方法：上传、分块上传（PUT，单块最大64MB）、搜索和导出
+LIMITED_METHODS = ('POST', 'PUT')
+# 受并发限制的GET路径前缀：页面、静态文件和统计接口不占用名额，但查看会话需要读取整个会话并计算关系键
+LIMITED_GET_PREFIXES = ('/thread/',)
+
+
+def is_limited(method: str, path: str) -> bool:
+    """请求是否占用并发名额"""
+    if method in LIMITED_METHODS:
+        return True
+    return method == 'GET' and path.startswith(LIMITED_GET_PREFIXES)
+
+
+class ConcurrencyLimiter:
+    """限制同时执行的重请求数量的ASGI中间件
+
+    超过max_concurrent的请求排队等待；排队数量达到max_queue或等待超过queue_timeout时
+    返回503和Retry-After，让客户端稍后重试，而不是让所有人的请求一起变慢。
+    GET /server/stats 返回当前执行中、排队中和被拒绝的请求数。
+    """
+
+    def __init__(self, app, max_concurrent: int = DEFAULT_MAX_CONCURRENT, max_queue: int = DEFAULT_MAX_QUEUE,
+                 queue_timeout: float = DEFAULT_QUEUE_TIMEOUT):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout
+        }
+
+    async def _send_json(self, send, status: int, payload: dict, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                        (b'content-length', str(len(body)).encode())] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _reject(self, send, reason: str):
+        self.rejected += 1
+        await self._send_json(send, 503, {'error': f'服务器繁忙（{reason}），请稍后重试'}, [(b'retry-after', b'5')])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if scope['method'] == 'GET' and scope['path'] == '/server/stats':
+            return await self._send_json(send, 200, self.stats())
+        if not is_limited(scope['method'], scope['path']):
+            return await self.app(scope, receive, send)
+
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            return await self._reject(send, f'排队请求已达{self.max_queue}个')
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return await self._reject(send, f'排队超过{self.queue_timeout:g}秒')
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+
+def create_app(max_concurrent: int = DEFAULT_MAX_CONCURRENT, max_queue: int = DEFAULT_MAX_QUEUE,
+               queue_timeout: float = DEFAULT_QUEUE_TIMEOUT, threads: int = None):
+    """
+    将Flask应用包装为ASGI应用
+
+    请求在事件循环中排队，Flask视图（搜索、导出等CPU密集的工作）在所有请求共享的线程池中执行，
+    事件循环本身不会被阻塞。应用状态（已加载的工作簿、缓存）保存在进程内存中，只能以单进程运行。
+
+    Args:
+        max_concurrent (int): 同时执行的重请求数量
+        max_queue (int): 排队请求数量上限
+        queue_timeout (float): 排队的最长时间（秒）
+        threads (int): 共享线程池的大小，默认比max_concurrent多4个，留给页面和统计等轻请求
+
+    Returns:
+        ASGI应用
+    """
+    threads = threads or max_concurrent + 4
+    return ConcurrencyLimiter(WSGIMiddleware(flask_app, workers=threads), max_concurrent, max_queue, queue_timeout)
+
+
+# uvicorn asgi:application 使用默认参数启动
+application = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='以ASGI方式启动邮件搜索服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=5000, help='监听端口')
+    parser.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT, help='同时执行的上传、搜索、导出、查看会话请求数量')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE, help='排队请求数量上限，超过时返回503')
+    parser.add_argument('--queue-timeout', type=float, default=DEFAULT_QUEUE_TIMEOUT, help='排队的最长时间（秒）')
+    parser.add_argument('--threads', type=int, help='共享线程池大小（默认比 --max-concurrent 多4个）')
+    args = parser.parse_args()
+
+    asgi_app = create_app(args.max_concurrent, args.max_queue, args.queue_timeout, args.threads)
+    logger.info(f"启动ASGI服务: http://{args.host}:{args.port}，并发上限 {args.max_concurrent}，排队上限 {args.max_queue}")
+    # 单进程：工作簿和缓存保存在进程内存中
+    uvicorn.run(asgi_app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, BinaryIO, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认分片大小
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# 分片大小的允许范围
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 默认的文件大小上限，与服务的 MAX_CONTENT_LENGTH 一致
+DEFAULT_MAX_SIZE = 400 * 1024 * 1024
+# 超过该时间（秒）未更新的上传会话在创建新会话时被清理
+SESSION_TTL = 24 * 3600
+# 写入分片时每次读取的字节数
+READ_SIZE = 1024 * 1024
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(ValueError):
+    """上传请求无效（分片序号、大小或校验和不正确等）"""
+
+
+class UploadNotFound(UploadError):
+    """上传会话不存在或已过期"""
+
+
+class ChunkedUploadStore:
+    """分片上传会话的存储
+
+    每个会话一个目录：meta.json 记录文件名、大小、分片大小和已收到的分片，
+    文件内容按偏移量直接写入同一个数据文件，收齐后无需再拼接。
+    会话信息保存在磁盘上，服务重启后客户端仍可查询进度并续传缺失的分片。
+    """
+
+    def __init__(self, root_dir: str, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            root_dir (str): 存放上传会话的目录
+            max_size (int): 允许上传的文件大小上限（字节），创建会话时会按该大小预分配数据文件
+        """
+        self.root_dir = root_dir
+        self.max_size = max_size
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def session_dir(self, upload_id: str) -> str:
+        """会话目录，会话ID格式不正确时视为不存在"""
+        if not _UPLOAD_ID_RE.match(upload_id or ''):
+            raise UploadNotFound(f"上传会话不存在: {upload_id}")
+        return os.path.join(self.root_dir, upload_id)
+
+    def _load_meta(self, upload_id: str) -> Dict[str, Any]:
+        meta_path = os.path.join(self.session_dir(upload_id), 'meta.json')
+        if not os.path.exists(meta_path):
+            raise UploadNotFound(f"上传会话不存在: {upload_id}")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_meta(self, meta: Dict[str, Any]):
+        """先写临时文件再替换，避免中断时留下不完整的meta.json"""
+        meta['updated_at'] = time.time()
+        session_dir = self.session_dir(meta['upload_id'])
+        tmp_path = os.path.join(session_dir, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(session_dir, 'meta.json'))
+
+    def data_path(self, upload_id: str) -> str:
+        """会话的数据文件路径（保留原文件的扩展名）"""
+        meta = self._load_meta(upload_id)
+        return os.path.join(self.session_dir(upload_id), 'workbook' + meta['extension'])
+
+    def _cleanup_expired(self):
+        now = time.time()
+        for name in os.listdir(self.root_dir):
+            meta_path = os.path.join(self.root_dir, name, 'meta.json')
+            try:
+                expired = now - os.path.getmtime(meta_path) > SESSION_TTL
+            except OSError:
+                continue
+            if expired:
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+                logger.info(f"已清理过期的上传会话: {name}")
+
+    def init(self, filename: str, size: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+        """
+        创建上传会话并预分配数据文件
+
+        Args:
+            filename (str): 原文件名
+            size (int): 文件大小（字节）
+            chunk_size (int): 分片大小（字节）
+
+        Returns:
+            Dict: 会话状态，同status
+        """
+        if size <= 0:
+            raise UploadError("文件大小必须大于0")
+        if size > self.max_size:
+            raise UploadError(f"文件大小超过上限 {self.max_size} 字节")
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError(f"分片大小必须在 {MIN_CHUNK_SIZE} 到 {MAX_CHUNK_SIZE} 字节之间")
+
+        self._cleanup_expired()
+        upload_id = uuid.uuid4().hex
+        meta = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'extension': os.path.splitext(filename)[1].lower(),
+            'size': size,
+            'chunk_size': chunk_size,
+            'total_chunks': (size + chunk_size - 1) // chunk_size,
+            'received': []
+        }
+        os.makedirs(self.session_dir(upload_id))
+        with open(os.path.join(self.session_dir(upload_id), 'workbook' + meta['extension']), 'wb') as f:
+            f.truncate(size)
+        self._save_meta(meta)
+        logger.info(f"创建上传会话 {upload_id}: {filename}, {size} 字节, {meta['total_chunks']} 个分片")
+        return self._status(meta)
+
+    @staticmethod
+    def _status(meta: Dict[str, Any]) -> Dict[str, Any]:
+        received = set(meta['received'])
+        return {
+            'upload_id': meta['upload_id'],
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'chunk_size': meta['chunk_size'],
+            'total_chunks': meta['total_chunks'],
+            'received': sorted(received),
+            'missing': [i for i in range(meta['total_chunks']) if i not in received]
+        }
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """查询已收到和缺失的分片，用于续传"""
+        return self._status(self._load_meta(upload_id))
+
+    def write_chunk(self, upload_id: str, index: int, stream: BinaryIO, checksum: Optional[str]) -> Dict[str, Any]:
+        """
+        从请求体流中读取一个分片，校验后按偏移量写入数据文件
+
+        Args:
+            upload_id (str): 会话ID
+            index (int): 分片序号（从0开始）
+            stream: 分片内容的流，边读边写，不在内存中保存整个分片
+            checksum (str): 分片内容的SHA-256（十六进制），必须提供，否则损坏的分片会被当作已收到
+
+        Returns:
+            Dict: 写入后的会话状态
+        """
+        if not checksum:
+            raise UploadError(f"分片 {index} 缺少SHA-256校验和")
+        meta = self._load_meta(upload_id)
+        if not 0 <= index < meta['total_chunks']:
+            raise UploadError(f"分片序号超出范围: {index}")
+        offset = index * meta['chunk_size']
+        expected_size = min(meta['chunk_size'], meta['size'] - offset)
+
+        # 直接按偏移量写入数据文件；校验失败时该分片标记为未收到，客户端重传时覆盖
+        digest = hashlib.sha256()
+        written = 0
+        error = None
+        with open(self.data_path(upload_id), 'r+b') as data:
+            data.seek(offset)
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > expected_size:
+                    error = UploadError(f"分片 {index} 超过应有大小 {expected_size} 字节")
+                    break
+                digest.update(block)
+                data.write(block)
+        if error is None and written != expected_size:
+            error = UploadError(f"分片 {index} 大小不正确: 收到 {written} 字节，应为 {expected_size} 字节")
+        if error is None and digest.hexdigest() != checksum.lower():
+            error = UploadError(f"分片 {index} 校验和不匹配")
+
+        # 并发上传的分片共用一个meta.json，更新时加锁并重新读取
+        with self._lock:
+            meta = self._load_meta(upload_id)
+            if error is not None:
+                if index in meta['received']:
+                    meta['received'].remove(index)
+                    self._save_meta(meta)
+                raise error
+            if index not in meta['received']:
+                meta['received'].append(index)
+            self._save_meta(meta)
+        return self._status(meta)
+
+    def complete(self, upload_id: str) -> Dict[str, Any]:
+        """
+        确认全部分片已收到，计算整个文件的SHA-256
+
+        Returns:
+            Dict: {'path': 数据文件路径, 'filename': 原文件名, 'sha256': 文件内容的SHA-256}
+        """
+        status = self.status(upload_id)
+        if status['missing']:
+            raise UploadError(f"还有 {len(status['missing'])} 个分片未上传")
+        path = self.data_path(upload_id)
+        with open(path, 'rb') as f:
+            sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+        logger.info(f"上传会话 {upload_id} 已完成: {status['filename']}, SHA-256 {sha256}")
+        return {'path': path, 'filename': status['filename'], 'sha256': sha256}
+
+    def remove(self, upload_id: str):
+        """删除会话目录"""
+        shutil.rmtree(self.session_dir(upload_id), ignore_errors=True)
@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# 一个地址项：双引号串、位于项开头的单引号串、尖括号组或除分隔符外的任意字符
+# 单引号只在项开头时视为引号，避免 O'Brien 这样的显示名吞掉后面的地址
+_ITEM_RE = re.compile(r'''(?:"[^"]*"|(?<![^\s,;])'[^']*'|<[^>]*>?|[^,;"'<]|['"])+''')
+# 尖括号中的地址，兼容Outlook导出的 <a@b.com <mailto:a@b.com> > 形式
+_ANGLE_RE = re.compile(r'<\s*(?:mailto:)?([^<>\s]+)', re.IGNORECASE)
+_QUOTED_RE = re.compile(r'"[^"]*"|^\s*\'[^\']*\'')
+
+# 地址列表在同一线程的多封邮件中会反复出现，按原始字符串缓存解析结果
+CACHE_SIZE = 1 << 16
+
+
+def _extract_address(item):
+    """从单个地址项（可能带显示名）中取出地址，统一为小写"""
+    match = _ANGLE_RE.search(item)
+    if match:
+        return match.group(1).strip('\'"').lower()
+
+    bare = _QUOTED_RE.sub(' ', item).strip()
+    for token in bare.split():
+        if '@' in token:
+            return token.strip('\'"()').lower()
+    return bare.strip('\'"').lower()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_addresses(raw):
+    addresses = []
+    for item in _ITEM_RE.findall(raw):
+        address = _extract_address(item)
+        if address:
+            addresses.append(address)
+    return tuple(addresses)
+
+
+def parse_addresses(raw):
+    """
+    解析收件人列表，支持 , 和 ; 分隔、带引号的显示名和尖括号地址
+
+    例如 "'Summer Xia' <summerxia@intco.com>; missymeng@intco.com"
+    解析为 ('summerxia@intco.com', 'missymeng@intco.com')。
+
+    Args:
+        raw: 原始收件人字符串，非字符串（如NaN）视为空
+
+    Returns:
+        tuple: 小写地址元组，保留顺序；不含@的项原样（小写）保留，由调用方判断是否有效
+    """
+    if not isinstance(raw, str):
+        return ()
+    return _parse_addresses(raw)
+
+
+def parse_address(raw):
+    """解析单个地址（如发件人），返回第一个地址，没有时返回空字符串"""
+    addresses = parse_addresses(raw)
+    return addresses[0] if addresses else ''
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_address(address):
+    """
+    将地址拆分为 (用户名, 域名)，与 email.split('@')[0] / [1] 的取法一致
+
+    Returns:
+        tuple: (username, domain)，地址不含@时两者都为None，任一部分为空时该部分为None
+    """
+    if '@' not in address:
+        return None, None
+    parts = address.split('@')
+    return parts[0] or None, parts[1] or None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_recipient_parts(raw):
+    return tuple((address,) + split_address(address) for address in _parse_addresses(raw))
+
+
+def parse_recipient_parts(raw):
+    """
+    解析收件人列表并拆分每个地址
+
+    Returns:
+        tuple: ((address, username, domain), ...)，username/domain的含义同split_address
+    """
+    if not isinstance(raw, str):
+        return ()
+    return _parse_recipient_parts(raw)
+
+
+def parse_address_series(series):
+    """
+    批量解析一列收件人，只对不同的原始字符串解析一次
+
+    Args:
+        series: 收件人列
+
+    Returns:
+        pd.Series: 与输入同索引的地址元组列
+    """
+    codes, uniques = pd.factorize(series)
+    # factorize对缺失值返回-1，对应末尾多出的空元组
+    lookup = np.empty(len(uniques) + 1, dtype=object)
+    for i, raw in enumerate(uniques):
+        lookup[i] = parse_addresses(raw)
+    lookup[-1] = ()
+    return pd.Series(lookup[codes], index=series.index, dtype=object)
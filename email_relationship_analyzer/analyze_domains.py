@@ -1,24 +1,35 @@
+import numpy as np
 import pandas as pd
 import json
 import logging
 from pathlib import Path
 from typing import Dict, List, Set
+from address_parser import parse_addresses, parse_address_series, split_address
+from xlsx_reader import read_xlsx
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 取第一个@之后、下一个@之前的部分作为域名
+DOMAIN_PATTERN = r'^[^@]*@([^@]*)'
+
 class DomainAnalyzer:
-    def __init__(self, excel_path: str, output_path: str = 'domain.json'):
+    def __init__(self, excel_path: str, output_path: str = 'domain.json',
+                 stats_path: str = 'domain_stats.json'):
         """
         初始化域名分析器
         
         Args:
             excel_path: Excel文件路径
             output_path: 输出JSON文件路径
+            stats_path: 域名频率和域名对共现统计的输出路径
         """
         self.excel_path = excel_path
         self.output_path = output_path
+        self.stats_path = stats_path
         self.multi_domain_messages: Dict[str, List[str]] = {}
+        self.domain_frequency = pd.DataFrame(columns=['messages', 'recipients'])
+        self.domain_pairs = pd.Series(dtype='int64')
 
     def extract_domains(self, recipients: str) -> Set[str]:
         """
@@ -30,48 +41,57 @@ class DomainAnalyzer:
         Returns:
             包含所有不同域名的集合
         """
-        if not isinstance(recipients, str):
-            return set()
-            
         domains = set()
-        # 分割多个收件人
-        for email in recipients.split(','):
-            email = email.strip()
-            if '@' in email:
-                try:
-                    domain = email.split('@')[1].strip()
-                    if domain:
-                        domains.add(domain)
-                except Exception as e:
-                    logger.warning(f"处理邮箱 {email} 时出错: {str(e)}")
+        # 使用共享的地址解析器拆分收件人（支持 ; 分隔和带显示名的地址）
+        for email in parse_addresses(recipients):
+            _, domain = split_address(email)
+            if domain:
+                domains.add(domain)
         return domains
 
     def analyze(self):
-        """分析Excel文件中的域名情况"""
+        """分析Excel文件中的域名情况
+
+        收件人列先由共享的地址解析器按不同的原始字符串解析一次，展开为一行一个地址，
+        再用一次向量化正则提取域名，
+        最后按邮件消息标识分组统计，避免逐行调用extract_domains。
+        """
         try:
             logger.info(f"开始读取Excel文件: {self.excel_path}")
-            df = pd.read_excel(self.excel_path)
+            df = read_xlsx(self.excel_path, usecols=lambda x: x in ('收件人', '邮件消息标识'))
             
             if '收件人' not in df.columns or '邮件消息标识' not in df.columns:
                 raise ValueError("Excel文件必须包含'收件人'和'邮件消息标识'列")
 
             total_rows = len(df)
-            processed_rows = 0
-            
-            for _, row in df.iterrows():
-                message_id = row['邮件消息标识']
-                recipients = row['收件人']
-                
-                if pd.isna(message_id) or pd.isna(recipients):
-                    continue
-                    
-                domains = self.extract_domains(str(recipients))
-                if len(domains) > 2:
-                    self.multi_domain_messages[str(message_id)] = list(domains)
-                
-                processed_rows += 1
-                if processed_rows % 1000 == 0:
-                    logger.info(f"已处理 {processed_rows}/{total_rows} 行")
+            df = df.dropna(subset=['收件人', '邮件消息标识'])
+            logger.info(f"共 {total_rows} 行，其中 {len(df)} 行包含收件人和邮件消息标识")
+
+            # 拆分收件人并展开为一行一个地址
+            addresses = pd.DataFrame({
+                'message_id': df['邮件消息标识'].astype(str),
+                'address': parse_address_series(df['收件人'].astype(str))
+            }).explode('address')
+
+            # 一次向量化正则提取域名（与 email.split('@')[1].strip() 等价）
+            addresses['domain'] = addresses['address'].str.extract(DOMAIN_PATTERN, expand=False).str.strip()
+            addresses = addresses[addresses['domain'].notna() & (addresses['domain'] != '')]
+
+            # 每封邮件内去重后的 (邮件, 域名) 对
+            message_domains = addresses[['message_id', 'domain']].drop_duplicates()
+            domain_counts = message_domains.groupby('message_id', sort=False).size()
+            multi_ids = domain_counts.index[domain_counts > 2]
+
+            multi = message_domains[message_domains['message_id'].isin(multi_ids)]
+            self.multi_domain_messages = self._group_domains(multi)
+
+            # 域名频率表: 出现该域名的邮件数和收件人数
+            self.domain_frequency = pd.DataFrame({
+                'messages': message_domains['domain'].value_counts(),
+                'recipients': addresses['domain'].value_counts()
+            }).fillna(0).astype(int).sort_values(['messages', 'recipients'], ascending=False)
+
+            self.domain_pairs = self._count_domain_pairs(message_domains)
 
             self.save_results()
             logger.info(f"分析完成。发现 {len(self.multi_domain_messages)} 条包含多个域名的记录")
@@ -80,12 +100,65 @@ class DomainAnalyzer:
             logger.error(f"分析过程中出错: {str(e)}")
             raise
 
+    @staticmethod
+    def _group_domains(message_domains: pd.DataFrame) -> Dict[str, List[str]]:
+        """
+        将 (message_id, domain) 表按邮件聚合为 {邮件消息标识: [域名, ...]}
+        
+        groupby().agg(list) 会对每个分组调用一次Python函数，这里改为
+        稳定排序后按分组边界切分，保持邮件和域名的原始出现顺序。
+        """
+        codes, message_ids = pd.factorize(message_domains['message_id'])
+        order = np.argsort(codes, kind='stable')
+        domains = message_domains['domain'].to_numpy()[order]
+        bounds = np.cumsum(np.bincount(codes, minlength=len(message_ids)))[:-1]
+        return {
+            message_id: group.tolist()
+            for message_id, group in zip(message_ids, np.split(domains, bounds))
+        }
+
+    @staticmethod
+    def _count_domain_pairs(message_domains: pd.DataFrame) -> pd.Series:
+        """
+        统计域名对的共现次数（同一封邮件中同时出现的两个域名）
+        
+        Args:
+            message_domains: 去重后的 (message_id, domain) 表
+            
+        Returns:
+            以 (domain_a, domain_b) 为索引、共现邮件数为值的Series，按次数降序
+        """
+        # 只有一个域名的邮件不会产生域名对，先过滤掉以减小自连接规模
+        sizes = message_domains.groupby('message_id', sort=False)['domain'].transform('size')
+        candidates = message_domains[sizes > 1]
+        joined = candidates.merge(candidates, on='message_id', suffixes=('_a', '_b'))
+        joined = joined[joined['domain_a'] < joined['domain_b']]
+        return joined.groupby(['domain_a', 'domain_b']).size().sort_values(ascending=False)
+
     def save_results(self):
         """保存分析结果到JSON文件"""
         try:
             with open(self.output_path, 'w', encoding='utf-8') as f:
                 json.dump(self.multi_domain_messages, f, ensure_ascii=False, indent=2)
             logger.info(f"结果已保存到: {self.output_path}")
+
+            stats = {
+                "domain_frequency": {
+                    domain: {"messages": int(messages), "recipients": int(recipients)}
+                    for domain, messages, recipients in zip(
+                        self.domain_frequency.index,
+                        self.domain_frequency['messages'],
+                        self.domain_frequency['recipients']
+                    )
+                },
+                "domain_pairs": [
+                    {"domains": [domain_a, domain_b], "messages": int(count)}
+                    for (domain_a, domain_b), count in self.domain_pairs.items()
+                ]
+            }
+            with open(self.stats_path, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2)
+            logger.info(f"域名统计已保存到: {self.stats_path}")
         except Exception as e:
             logger.error(f"保存结果时出错: {str(e)}")
             raise
@@ -2,8 +2,11 @@
 
 
 import json
+import argparse
 import pandas as pd
 import logging
+from membership import MessageIdSet, normalize_values
+from xlsx_reader import read_xlsx
 
 # 设置日志
 logging.basicConfig(
@@ -15,26 +18,15 @@ logger = logging.getLogger(__name__)
 def load_field_from_excel(file_path, field_name):
     try:
         # 读取Excel文件某个字段的全部值
-        df = pd.read_excel(file_path)
+        df = read_xlsx(file_path, dtype=object)
         
-        grouped_data = set()
         # 确保字段名存在于DataFrame中
         if field_name not in df.columns:
             logger.error(f"字段名 '{field_name}' 不存在于Excel文件中")
-            return grouped_data
+            return set()
         
-        # 遍历DataFrame中的每一行，提取指定字段的值
-        for _, row in df.iterrows():
-            value = row[field_name]
-            # 确保值不为空
-            if pd.notna(value):
-                # 如果值是数值类型，转换为字符串
-                if isinstance(value, (int, float)):
-                    value = str(int(value))
-                else:
-                    value = str(value)
-                # 将值添加到集合中
-                grouped_data.add(value)
+        # 去掉空值，数值类型按整数转换为字符串
+        grouped_data = set(normalize_values(df[field_name]))
         
         logger.info(f"从Excel文件中读取了 {len(grouped_data)} 个唯一的 {field_name} 值")
         return grouped_data
@@ -43,16 +35,36 @@ def load_field_from_excel(file_path, field_name):
         raise
 
 
-def check_not_exist(source_data: set, target_data: set):
-    """检查source_data中是否存在target_data中不存在的值"""
+def load_id_filter(file_path, field_name):
+    """加载目标数据的成员过滤器，传入 .npy 文件时直接加载已保存的过滤器"""
+    if file_path.endswith('.npy'):
+        return MessageIdSet.load(file_path)
+    return MessageIdSet.from_excel(file_path, field_name)
+
+
+def check_not_exist(source_data: set, target_data):
+    """检查source_data中是否存在target_data中不存在的值
+    
+    target_data 可以是集合，也可以是 MessageIdSet（只保存64位哈希，内存远小于字符串集合）
+    """
+    if isinstance(target_data, MessageIdSet):
+        return set(target_data.missing(list(source_data)))
     not_exist = source_data - target_data
     return not_exist
 
 
 
 def main():
-    source_data = load_field_from_excel('/Users/dingke/Downloads/emails.xlsx', '邮件消息标识')
-    target_data = load_field_from_excel('/Users/dingke/Library/Containers/com.tencent.xinWeChat/Data/Library/Application Support/com.tencent.xinWeChat/2.0b4.0.9/ef83a504a301948b449baac80d05a819/Message/MessageTemp/447b05e0a8d37b6b54692bb6a7fbf7af/File/xiaomei.xlsx', 'email_message_tag')
+    parser = argparse.ArgumentParser(description='检查源数据中有哪些值在目标数据中不存在')
+    parser.add_argument('--source', default='/Users/dingke/Downloads/emails.xlsx', help='源Excel文件路径')
+    parser.add_argument('--source-field', default='邮件消息标识', help='源数据字段名')
+    parser.add_argument('--target', default='/Users/dingke/Library/Containers/com.tencent.xinWeChat/Data/Library/Application Support/com.tencent.xinWeChat/2.0b4.0.9/ef83a504a301948b449baac80d05a819/Message/MessageTemp/447b05e0a8d37b6b54692bb6a7fbf7af/File/xiaomei.xlsx',
+                        help='目标Excel文件路径，或 membership.py build 生成的 .npy 过滤器')
+    parser.add_argument('--target-field', default='email_message_tag', help='目标数据字段名')
+    args = parser.parse_args()
+    
+    source_data = load_field_from_excel(args.source, args.source_field)
+    target_data = load_id_filter(args.target, args.target_field)
     not_exist = check_not_exist(source_data, target_data)
     # 将不存在的数据写入JSON文件
     try:
@@ -64,4 +76,5 @@ def main():
         logger.error(f"保存不存在数据时出错: {str(e)}")
     print(len(not_exist))
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -2,6 +2,7 @@ import json
 import pandas as pd
 import logging
 from collections import defaultdict
+from xlsx_reader import read_xlsx
 
 # 设置日志
 logging.basicConfig(
@@ -23,7 +24,7 @@ def process_excel_data(excel_file):
     """处理Excel文件，按topic_group_id分组并生成唯一标识"""
     try:
         # 读取Excel文件
-        df = pd.read_excel(excel_file)
+        df = read_xlsx(excel_file)
         
         # 按topic_group_id分组
         grouped_data = {}
@@ -0,0 +1,276 @@
+import json
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _encode_names(names: np.ndarray) -> np.ndarray:
+    """名称表编码为一段UTF-8的JSON字节（定长的<U数组中每个名称都按最长的地址占用空间）"""
+    return np.frombuffer(json.dumps(names.tolist(), ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_names(data: np.ndarray) -> np.ndarray:
+    """还原 _encode_names 保存的名称表，兼容以前保存的定长字符串数组"""
+    if data.dtype.kind == 'U':
+        return data.astype(object)
+    return np.array(json.loads(data.tobytes().decode('utf-8')), dtype=object)
+
+
+class CSRAdjacency:
+    """压缩稀疏行（CSR）格式的带权邻接表
+
+    第 i 个节点的邻居为 indices[indptr[i]:indptr[i + 1]]，对应的边权在 weights 的同一区间。
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def from_edges(cls, src: np.ndarray, dst: np.ndarray, weights: np.ndarray, num_nodes: int) -> 'CSRAdjacency':
+        """
+        由边列表构建CSR邻接表，每个节点的邻居按边权从大到小排列
+
+        Args:
+            src: 起点ID数组
+            dst: 终点ID数组
+            weights: 边权数组
+            num_nodes: 节点总数
+        """
+        order = np.lexsort((-weights, src))
+        counts = np.bincount(src, minlength=num_nodes)
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr, dst[order].astype(np.int32), weights[order].astype(np.int64))
+
+    def transpose(self) -> 'CSRAdjacency':
+        """返回反向邻接表（入边）"""
+        num_nodes = len(self.indptr) - 1
+        src = np.repeat(np.arange(num_nodes, dtype=np.int32), np.diff(self.indptr))
+        return CSRAdjacency.from_edges(self.indices, src, self.weights, num_nodes)
+
+    def row(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回节点的邻居ID和边权"""
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+
+class DomainGraph:
+    """发件人域名到收件人域名的通信图索引
+
+    节点为驻留（interned）后的域名和邮箱地址ID，边权为两端之间不同邮件的数量。
+    名称中包含@的查询走地址图，否则走域名图。
+    """
+
+    def __init__(self, domain_names: np.ndarray, domain_out: CSRAdjacency,
+                 address_names: np.ndarray, address_out: CSRAdjacency):
+        self.domain_names = domain_names
+        self.address_names = address_names
+        self.domain_out = domain_out
+        self.domain_in = domain_out.transpose()
+        self.address_out = address_out
+        self.address_in = address_out.transpose()
+        self._domain_ids = {name: i for i, name in enumerate(domain_names.tolist())}
+        self._address_ids = {name: i for i, name in enumerate(address_names.tolist())}
+
+    @classmethod
+    def from_analyzer_output(cls, relationships_file: str, domain_file: Optional[str] = None) -> 'DomainGraph':
+        """
+        由 relationships.json 和（可选的）domain.json 构建通信图
+
+        Args:
+            relationships_file: EmailRelationshipAnalyzer输出的关系集合文件
+            domain_file: DomainAnalyzer输出的多域名邮件文件
+        """
+        with open(relationships_file, 'r', encoding='utf-8') as f:
+            relationships = json.load(f)
+
+        # 关系键为 发件人#主题#收件人域名，主题中可能含有#，所以分别从两端切分
+        message_ids, senders, recipients = [], [], []
+        for key, value in relationships.items():
+            recipient_domain = key.rsplit('#', 1)[-1]
+            for item in value['items']:
+                senders.append(item[0])
+                recipients.append(f"{item[2]}@{recipient_domain}")
+                message_ids.append(item[3])
+
+        edges = pd.DataFrame({'message_id': message_ids, 'sender': senders, 'recipient': recipients})
+        edges['sender_domain'] = edges['sender'].str.split('@').str[-1]
+        edges['recipient_domain'] = edges['recipient'].str.split('@').str[-1]
+
+        domain_edges = edges[['message_id', 'sender_domain', 'recipient_domain']]
+        if domain_file:
+            domain_edges = pd.concat([domain_edges, cls._load_domain_edges(domain_file, edges)], ignore_index=True)
+
+        logger.info(f"从 {len(relationships)} 个关系集合中读取了 {len(edges)} 条关系")
+
+        domain_names, domain_out = cls._build_adjacency(domain_edges, 'sender_domain', 'recipient_domain')
+        address_names, address_out = cls._build_adjacency(edges, 'sender', 'recipient')
+        return cls(domain_names, domain_out, address_names, address_out)
+
+    @staticmethod
+    def _load_domain_edges(domain_file: str, edges: pd.DataFrame) -> pd.DataFrame:
+        """将domain.json中的多域名邮件展开为边，发件人域名取自同一邮件消息标识的关系"""
+        with open(domain_file, 'r', encoding='utf-8') as f:
+            multi_domain_messages = json.load(f)
+
+        message_domains = pd.DataFrame({
+            'message_id': list(multi_domain_messages.keys()),
+            'recipient_domain': list(multi_domain_messages.values())
+        }).explode('recipient_domain')
+
+        sender_domains = edges[['message_id', 'sender_domain']].drop_duplicates('message_id')
+        return message_domains.merge(sender_domains, on='message_id')[
+            ['message_id', 'sender_domain', 'recipient_domain']
+        ]
+
+    @staticmethod
+    def _build_adjacency(edges: pd.DataFrame, src_col: str, dst_col: str) -> Tuple[np.ndarray, CSRAdjacency]:
+        """对端点名称驻留编号，并按 (起点, 终点) 统计不同邮件数作为边权"""
+        edges = edges.drop_duplicates(['message_id', src_col, dst_col])
+        codes, names = pd.factorize(pd.concat([edges[src_col], edges[dst_col]], ignore_index=True))
+        src, dst = codes[:len(edges)], codes[len(edges):]
+
+        counts = pd.DataFrame({'src': src, 'dst': dst}).groupby(['src', 'dst']).size()
+        adjacency = CSRAdjacency.from_edges(
+            counts.index.get_level_values('src').to_numpy(),
+            counts.index.get_level_values('dst').to_numpy(),
+            counts.to_numpy(),
+            len(names)
+        )
+        return np.asarray(names, dtype=object), adjacency
+
+    def save(self, path: str):
+        """保存到 .npz 文件，重新加载时无需再解析JSON"""
+        np.savez(
+            path,
+            domain_names=_encode_names(self.domain_names),
+            domain_indptr=self.domain_out.indptr,
+            domain_indices=self.domain_out.indices,
+            domain_weights=self.domain_out.weights,
+            address_names=_encode_names(self.address_names),
+            address_indptr=self.address_out.indptr,
+            address_indices=self.address_out.indices,
+            address_weights=self.address_out.weights
+        )
+        logger.info(f"通信图已保存到: {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'DomainGraph':
+        """从 save 生成的 .npz 文件加载"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                _decode_names(data['domain_names']),
+                CSRAdjacency(data['domain_indptr'], data['domain_indices'], data['domain_weights']),
+                _decode_names(data['address_names']),
+                CSRAdjacency(data['address_indptr'], data['address_indices'], data['address_weights'])
+            )
+
+    def _resolve(self, name: str):
+        """根据名称返回 (节点ID, 名称表, 出边表, 入边表)"""
+        name = name.strip()
+        if '@' in name:
+            node_ids, names, out_adj, in_adj = self._address_ids, self.address_names, self.address_out, self.address_in
+        else:
+            node_ids, names, out_adj, in_adj = self._domain_ids, self.domain_names, self.domain_out, self.domain_in
+        if name not in node_ids:
+            raise KeyError(f"通信图中不存在: {name}")
+        return node_ids[name], names, out_adj, in_adj
+
+    def neighbors(self, name: str, direction: str = 'out') -> List[str]:
+        """
+        查询直接相连的域名或地址
+
+        Args:
+            name: 域名或邮箱地址
+            direction: out（发往）、in（来自）或 both
+        """
+        node, names, out_adj, in_adj = self._resolve(name)
+        ids = []
+        if direction in ('out', 'both'):
+            ids.append(out_adj.row(node)[0])
+        if direction in ('in', 'both'):
+            ids.append(in_adj.row(node)[0])
+        if not ids:
+            raise ValueError(f"不支持的方向: {direction}")
+        return names[np.unique(np.concatenate(ids))].tolist()
+
+    def top_partners(self, name: str, k: int = 10) -> List[Tuple[str, int]]:
+        """
+        按往来邮件数返回前k个通信伙伴（出边和入边合并计算）
+
+        Args:
+            name: 域名或邮箱地址
+            k: 返回数量
+        """
+        node, names, out_adj, in_adj = self._resolve(name)
+        out_ids, out_weights = out_adj.row(node)
+        in_ids, in_weights = in_adj.row(node)
+        totals = pd.Series(np.concatenate([out_weights, in_weights])).groupby(
+            np.concatenate([out_ids, in_ids])
+        ).sum()
+        totals = totals.nlargest(k)
+        return [(names[i], int(w)) for i, w in totals.items()]
+
+    def degree(self, name: str) -> Dict[str, int]:
+        """返回出度、入度以及对应的邮件总数"""
+        node, _, out_adj, in_adj = self._resolve(name)
+        out_ids, out_weights = out_adj.row(node)
+        in_ids, in_weights = in_adj.row(node)
+        return {
+            'out_degree': len(out_ids),
+            'in_degree': len(in_ids),
+            'out_messages': int(out_weights.sum()),
+            'in_messages': int(in_weights.sum())
+        }
+
+    def two_hop(self, name: str) -> List[str]:
+        """返回沿出边两跳可达、但不直接相连的域名或地址"""
+        node, names, out_adj, _ = self._resolve(name)
+        first_hop = out_adj.row(node)[0]
+        if len(first_hop) == 0:
+            return []
+        second_hop = np.concatenate([out_adj.indices[out_adj.indptr[i]:out_adj.indptr[i + 1]] for i in first_hop])
+        reach = np.setdiff1d(second_hop, np.append(first_hop, node))
+        return names[reach].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='域名通信图索引')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='由分析结果构建通信图')
+    build_parser.add_argument('--relationships', default='relationships.json', help='relationships.json文件路径')
+    build_parser.add_argument('--domains', help='domain.json文件路径（可选）')
+    build_parser.add_argument('--output', default='domain_graph.npz', help='输出文件路径')
+
+    query_parser = subparsers.add_parser('query', help='查询通信图')
+    query_parser.add_argument('graph_file', help='通信图文件路径')
+    query_parser.add_argument('name', help='域名或邮箱地址')
+    query_parser.add_argument('--top', type=int, default=10, help='返回的通信伙伴数量')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        graph = DomainGraph.from_analyzer_output(args.relationships, args.domains)
+        graph.save(args.output)
+        return
+
+    graph = DomainGraph.load(args.graph_file)
+    result = {
+        'degree': graph.degree(args.name),
+        'top_partners': graph.top_partners(args.name, args.top),
+        'two_hop': graph.two_hop(args.name)
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
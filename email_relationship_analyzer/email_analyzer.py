@@ -2,32 +2,92 @@ import json
 import logging
 import pandas as pd
 import os
+import time
+import tempfile
+from collections import Counter
 from tqdm import tqdm
 from config import REQUIRED_COLUMNS
-from utils import normalize_subject, extract_domain, extract_username, is_reply, validate_file
+from utils import normalize_subject, validate_file
+from ingest import prepare_chunk, iter_subject_groups, iter_excel_chunks, format_send_times, format_send_time
+from external_join import write_run, iter_merged_groups
+from relationship_store import RelationshipStore
+from timeline import OriginalTimeline
+from xlsx_reader import read_xlsx
+from error_store import ErrorStore
+from subject_index import SubjectIndex
 from langdetect import detect
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
+# 外部模式归并连接时，每处理这么多个主题向运行指标报告一次进展
+PROGRESS_GROUPS = 1000
+# 外部模式第一遍每个数据块（一个有序run）的行数
+EXTERNAL_CHUNKSIZE = 10000
+
 class EmailRelationshipAnalyzer:
-    def __init__(self, excel_file_path):
-        """初始化分析器"""
+    def __init__(self, excel_file_path, verbose=False, error_detail_file=None, error_sample_size=5,
+                 similarity_threshold=None, external=False, external_tmp_dir=None, metrics=None):
+        """初始化分析器
+
+        Args:
+            excel_file_path: Excel文件路径
+            verbose: 是否输出逐条关系/回复的跟踪日志（DEBUG级别，需要日志级别允许DEBUG才会显示）
+            error_detail_file: 可选的逐条异常明细文件（JSON行），error.json中只保留聚合结果
+            error_sample_size: 每条聚合异常最多保留的邮件消息标识数量
+            similarity_threshold: 分析缺失原始邮件时，相似主题的Jaccard相似度阈值（None表示只看包含关系）
+            external: 是否使用两遍外部排序归并模式（内存有界，结果与行的顺序无关）
+            external_tmp_dir: 外部模式下有序run文件的临时目录（默认系统临时目录）
+            metrics: 可选的AnalysisMetrics，每个数据块处理完后报告行数、耗时、暂存回复数和关系数
+                （开始和结束由调用方记录）
+        """
         self.excel_file_path = excel_file_path
+        # 只控制本实例是否输出逐条跟踪日志，不修改共享的模块logger的级别（由命令行入口设置）
+        self.verbose = verbose
         self.relationships = {}  # 存储关系集合
+        self.error_detail = open(error_detail_file, 'w', encoding='utf-8') if error_detail_file else None
+        self.error_sample_size = error_sample_size
         self.unknown_data = {
-            "invalid_emails": [],      # 无效的邮箱格式
+            # 无效的邮箱格式，按 (错误类型, 地址) 聚合
+            "invalid_emails": ErrorStore("invalid_emails", error_sample_size, self.error_detail),
             "empty_data": [],          # 空数据
             "multiple_senders": {},    # 相同主题不同发件人
             "invalid_recipients": [],  # 无效的收件人格式
-            "processing_errors": [],   # 处理过程中的错误
+            # 处理过程中的错误，按 (错误类型, 地址) 聚合
+            "processing_errors": ErrorStore("processing_errors", error_sample_size, self.error_detail),
+            # 无法解析的发送时间，按原始值聚合
+            "invalid_send_times": ErrorStore("invalid_send_times", error_sample_size, self.error_detail),
             "unknown_languages": [],    # 未知语言的邮件
             "processing_notes": []     # 处理过程中的备注
         }
         self.required_columns = REQUIRED_COLUMNS
         self.subject_sender_map = {}  # 用于跟踪相同主题的不同发件人
         self.pending_replies = {}  # 用于暂存找不到原始邮件的回复
-        self.original_emails = {}  # 用于存储所有原始邮件 {subject: [original_email_data]}
+        self.original_emails = {}  # 用于存储所有原始邮件 {subject: OriginalTimeline}
+        self.subject_index = SubjectIndex()  # 原始邮件主题的倒排索引，用于查找相似主题
+        self.similarity_threshold = similarity_threshold
+        self.external = external
+        self.external_tmp_dir = external_tmp_dir
+        self.stats = Counter()  # 热路径上的聚合计数，代替逐条日志
+        self.metrics = metrics
+    
+    def _add_relationship(self, key, value):
+        """添加一条关系，已存在时忽略
+
+        Returns:
+            bool: 是否为新添加的关系
+        """
+        if key not in self.relationships:
+            self.relationships[key] = []
+        
+        if value in self.relationships[key]:
+            return False
+        
+        self.relationships[key].append(value)
+        self.stats['relationships_added'] += 1
+        if self.verbose:
+            logger.debug("成功添加关系: key='%s'", key)
+        return True
     
     def validate_data(self, chunk):
         """验证数据块是否包含所有必需的列"""
@@ -38,54 +98,70 @@ class EmailRelationshipAnalyzer:
         # 只保留需要的列，忽略其他列
         return chunk[self.required_columns]
     
+    def _prepare_chunk(self, chunk):
+        """验证数据块、生成派生列并为缺少邮件消息标识的行补上行号标识
+        
+        Returns:
+            pd.DataFrame: 预处理后的数据块，没有有效数据时返回None
+        """
+        # 验证并过滤数据
+        chunk = self.validate_data(chunk)
+        
+        # 断言：验证后的数据块不应该为空
+        assert not chunk.empty, "处理后的数据块为空"
+        
+        # 一次性生成标准化主题、回复标识和规范化的地址列
+        logger.debug("开始标准化主题和识别回复")
+        chunk = prepare_chunk(chunk)
+        
+        # 过滤掉没有邮件消息标识的行
+        missing_ids = chunk[chunk['邮件消息标识'].isna()]
+        if not missing_ids.empty:
+            logger.warning(f"发现 {len(missing_ids)} 行缺少邮件消息标识，使用行号作为替代")
+            # 为缺少邮件消息标识的行添加行号作为标识
+            for idx, row in missing_ids.iterrows():
+                subject_info = row['邮件名称'] if pd.notna(row['邮件名称']) else "未知主题"
+                # 记录到unknown_data中
+                self.unknown_data["empty_data"].append({
+                    "row_index": idx,
+                    "subject": subject_info,
+                    "error": "缺少邮件消息标识，使用行号替代"
+                })
+                # 使用行号作为邮件消息标识
+                chunk.loc[idx, '邮件消息标识'] = f"ROW_{idx}"
+            
+            # 过滤保留有邮件消息标识的行
+            chunk = chunk[chunk['邮件消息标识'].notna()]
+            
+            # 如果过滤后没有数据，则返回
+            if chunk.empty:
+                logger.warning("过滤后没有有效数据")
+                return None
+        
+        # 批量记录无法解析的发送时间（这些行按缺少发送时间处理）
+        invalid = chunk['send_time_invalid']
+        if invalid.any():
+            bad = chunk.loc[invalid, ['发送时间', '邮件消息标识']]
+            logger.warning(f"发现 {len(bad)} 行发送时间无法解析，按缺少发送时间处理")
+            for raw, message_ids in bad.groupby(bad['发送时间'].astype(str), sort=False)['邮件消息标识']:
+                self.unknown_data["invalid_send_times"].add_many(f"发送时间无法解析: {raw}", message_ids.tolist())
+        
+        return chunk
+    
     def process_chunk(self, chunk):
         """处理一个数据块"""
+        stats_before = self.stats.copy()
         try:
-            # 验证并过滤数据
-            chunk = self.validate_data(chunk)
-            
-            # 断言：验证后的数据块不应该为空
-            assert not chunk.empty, "处理后的数据块为空"
-            
-            # 标准化主题和识别回复
-            logger.info(f"开始标准化主题和识别回复")
-            chunk['normalized_subject'] = chunk['邮件名称'].apply(lambda x: normalize_subject(x) if pd.notna(x) else "")
-            chunk['is_reply'] = chunk['邮件名称'].apply(lambda x: is_reply(x) if pd.notna(x) else False)
-            
-            # 过滤掉没有邮件消息标识的行
-            missing_ids = chunk[chunk['邮件消息标识'].isna()]
-            if not missing_ids.empty:
-                logger.warning(f"发现 {len(missing_ids)} 行缺少邮件消息标识，使用行号作为替代")
-                # 为缺少邮件消息标识的行添加行号作为标识
-                for idx, row in missing_ids.iterrows():
-                    subject_info = row['邮件名称'] if pd.notna(row['邮件名称']) else "未知主题"
-                    # 记录到unknown_data中
-                    self.unknown_data["empty_data"].append({
-                        "row_index": idx,
-                        "subject": subject_info,
-                        "error": "缺少邮件消息标识，使用行号替代"
-                    })
-                    # 使用行号作为邮件消息标识
-                    chunk.loc[idx, '邮件消息标识'] = f"ROW_{idx}"
-                
-                # 过滤保留有邮件消息标识的行
-                chunk = chunk[chunk['邮件消息标识'].notna()]
-                
-                # 如果过滤后没有数据，则返回
-                if chunk.empty:
-                    logger.warning("过滤后没有有效数据")
-                    return
+            chunk = self._prepare_chunk(chunk)
+            if chunk is None:
+                return
             
-            # 按标准化主题分组处理
-            logger.info(f"开始按标准化主题分组处理")
-            for subject, group in chunk.groupby('normalized_subject'):
+            # 按标准化主题分组处理（排序一次后沿连续区间遍历）
+            logger.debug("开始按标准化主题分组处理")
+            for subject, original_emails, reply_emails in iter_subject_groups(chunk):
                 if not subject:  # 跳过空主题
                     logger.warning("标准化后主题为空，使用原始主题")
                     continue
-                    
-                # 找出原始邮件（非回复）和回复邮件，并转换为字典列表
-                original_emails = group[~group['is_reply']].to_dict('records')
-                reply_emails = group[group['is_reply']].to_dict('records')
                 
                 # 断言：分组后的数据不应该为空
                 assert len(original_emails) > 0 or len(reply_emails) > 0, f"主题为'{subject}'的分组为空"
@@ -94,7 +170,8 @@ class EmailRelationshipAnalyzer:
                 if original_emails:
                     # 将原始邮件添加到缓存中
                     if subject not in self.original_emails:
-                        self.original_emails[subject] = []
+                        self.original_emails[subject] = OriginalTimeline()
+                        self.subject_index.add(subject)
                     self.original_emails[subject].extend(original_emails)
                     
                     # 处理原始邮件的收件人关系
@@ -112,100 +189,88 @@ class EmailRelationshipAnalyzer:
                         if subject not in self.pending_replies:
                             self.pending_replies[subject] = []
                         self.pending_replies[subject].append(reply)
+                        self.stats['replies_pending'] += 1
+            
+            self._log_chunk_stats(stats_before)
         
         except AssertionError as e:
             # 记录断言错误
             logger.error(f"断言错误: {str(e)}")
-            self.unknown_data["processing_errors"].append({
-                "chunk_hash": hash(str(chunk.iloc[0].to_dict())),
-                "error": f"断言错误: {str(e)}",
-                "type": "assertion_error"
-            })
+            self.unknown_data["processing_errors"].add(
+                f"断言错误: {str(e)}",
+                chunk_hash=hash(str(chunk.iloc[0].to_dict())),
+                type="assertion_error"
+            )
         
         except Exception as e:
             # 记录其他错误
             logger.error(f"处理数据块时发生错误: {str(e)}")
-            self.unknown_data["processing_errors"].append({
-                "chunk_hash": hash(str(chunk.iloc[0].to_dict())),
-                "error": str(e),
-                "type": "chunk_processing_error"
-            })
+            self.unknown_data["processing_errors"].add(
+                str(e),
+                chunk_hash=hash(str(chunk.iloc[0].to_dict())),
+                type="chunk_processing_error"
+            )
     
-    def _get_safe_send_time(self, email_data):
-        """安全获取发送时间
-        
-        Args:
-            email_data: 邮件数据字典
-            
-        Returns:
-            str: 发送时间，如果不存在则返回空字符串
-        """
-        try:
-            send_time = email_data.get('发送时间', '')
-            return str(send_time) if pd.notna(send_time) else ''
-        except (KeyError, AttributeError):
-            return ''
+    def _report_progress(self, rows=None, seconds=None):
+        """向运行指标报告进展，rows为None时只更新暂存回复数和关系数"""
+        if self.metrics is None:
+            return
+        # 暂存的回复在process_pending_replies之前不会移出，累计数即当前暂存数
+        pending = self.stats['replies_pending'] - self.stats['pending_processed']
+        if rows is None:
+            self.metrics.update(pending, len(self.relationships))
+        else:
+            self.metrics.chunk_done(rows, seconds, pending, len(self.relationships))
+    
+    def _set_phase(self, phase):
+        if self.metrics is not None:
+            self.metrics.set_phase(phase)
+    
+    def _log_chunk_stats(self, stats_before):
+        """输出本数据块的聚合计数"""
+        delta = self.stats - stats_before
+        logger.info(
+            "数据块处理完成: 新增关系 %d 条, 处理回复 %d 封, 暂存回复 %d 封, 收件人全部无效的邮件 %d 封",
+            delta['relationships_added'], delta['replies_processed'],
+            delta['replies_pending'], delta['all_recipients_invalid']
+        )
 
     def _process_original_email(self, original_email, subject):
         """处理原始邮件"""
-        sender = original_email['发件人']
-        if '收件人' in original_email and pd.notna(original_email['收件人']):
-            recipients = str(original_email['收件人']).split(',')
+        sender = original_email.sender
+        recipient_parts = original_email.recipient_parts
+        if recipient_parts:
             has_valid_recipient = False  # 标记是否有有效的收件人
             
-            for recipient in recipients:
-                recipient = recipient.strip()
-                if not isinstance(recipient, str) or '@' not in recipient:
-                    self.unknown_data["invalid_emails"].append({
-                        "message_id": original_email['邮件消息标识'],
-                        "email": recipient,
-                        "error": "收件人格式不正确",
-                        "subject": subject
-                    })
+            for recipient, username, recipient_domain in recipient_parts:
+                if '@' not in recipient:
+                    self.unknown_data["invalid_emails"].add("收件人格式不正确", email=recipient, message_id=original_email.message_id, subject=subject)
                     continue
                 
-                # 提取收件人域名
-                recipient_domain = extract_domain(recipient)
+                # 收件人域名
                 if not recipient_domain:
-                    self.unknown_data["invalid_emails"].append({
-                        "message_id": original_email['邮件消息标识'],
-                        "email": recipient,
-                        "error": "无法提取收件人域名",
-                        "subject": subject
-                    })
+                    self.unknown_data["invalid_emails"].add("无法提取收件人域名", email=recipient, message_id=original_email.message_id, subject=subject)
                     continue
                 
-                # 获取收件人用户名
-                username = extract_username(recipient)
+                # 收件人用户名
                 if not username:
-                    self.unknown_data["invalid_emails"].append({
-                        "message_id": original_email['邮件消息标识'],
-                        "email": recipient,
-                        "error": "无法提取用户名",
-                        "subject": subject
-                    })
+                    self.unknown_data["invalid_emails"].add("无法提取用户名", email=recipient, message_id=original_email.message_id, subject=subject)
                     continue
                 
                 # 构建关系键
                 key = f"{sender}#{subject}#{recipient_domain}"
                 
-                # 获取发送时间
-                send_time = self._get_safe_send_time(original_email)
-                
-                # 构建关系值
-                value = (sender, subject, username, original_email['邮件消息标识'], send_time)
+                # 构建关系值（发送时间为int64时间戳，保存时再格式化）
+                value = (sender, subject, username, original_email.message_id, original_email.send_ts)
                 
                 # 添加到关系集合
-                if key not in self.relationships:
-                    self.relationships[key] = []
-                
-                if value not in self.relationships[key]:
-                    self.relationships[key].append(value)
+                if self._add_relationship(key, value):
                     has_valid_recipient = True
-                    logger.info(f"成功添加关系: key='{key}'")
             
             if not has_valid_recipient:
-                logger.warning(f"邮件 {original_email['邮件消息标识']} 的所有收件人都无效")
+                self.stats['all_recipients_invalid'] += 1
+                if self.verbose:
+                    logger.debug("邮件 %s 的所有收件人都无效", original_email.message_id)
 
     def _analyze_missing_original_email(self, reply_subject, reply_title):
         """分析找不到原始邮件的原因
@@ -217,12 +282,8 @@ class EmailRelationshipAnalyzer:
         Returns:
             str: 分析结果
         """
-        # 检查是否存在相似主题
-        similar_subjects = []
-        for subject in self.original_emails.keys():
-            # 计算相似度（这里用简单的包含关系作为示例）
-            if reply_subject in subject or subject in reply_subject:
-                similar_subjects.append(subject)
+        # 通过主题索引查找存在包含关系（或相似度达到阈值）的主题
+        similar_subjects = self.subject_index.find_similar(reply_subject, self.similarity_threshold)
         
         if similar_subjects:
             return f"找到可能相关的主题: {', '.join(similar_subjects)}"
@@ -236,101 +297,89 @@ class EmailRelationshipAnalyzer:
 
     def _process_reply_email(self, reply, subject):
         """处理回复邮件"""
-        replier = reply['发件人']
+        replier = reply.sender
         
         # 验证回复者格式
-        if not isinstance(replier, str) or '@' not in replier:
-            self.unknown_data["invalid_emails"].append({
-                "message_id": reply['邮件消息标识'],
-                "email": replier,
-                "error": "回复者格式不正确",
-                "subject": subject
-            })
+        if '@' not in replier:
+            self.unknown_data["invalid_emails"].add("回复者格式不正确", email=replier, message_id=reply.message_id, subject=subject)
             return
         
-        # 提取回复者域名
-        reply_domain = extract_domain(replier)
+        # 回复者域名
+        reply_domain = reply.sender_domain
         if not reply_domain:
-            self.unknown_data["invalid_emails"].append({
-                "message_id": reply['邮件消息标识'],
-                "email": replier,
-                "error": "无法提取回复者域名",
-                "subject": subject
-            })
+            self.unknown_data["invalid_emails"].add("无法提取回复者域名", email=replier, message_id=reply.message_id, subject=subject)
             return
         
         # 断言：域名不应该为空
         assert reply_domain, f"提取的域名为空: {replier}"
         
-        # 获取回复者用户名
-        username = extract_username(replier)
+        # 回复者用户名
+        username = reply.sender_username
         
         # 断言：用户名不应该为空
         assert username, f"提取的用户名为空: {replier}"
         
         # 记录当前处理的回复邮件信息
-        logger.info(f"正在处理回复邮件: subject='{subject}', replier='{replier}', message_id='{reply['邮件消息标识']}'")
+        self.stats['replies_processed'] += 1
+        if self.verbose:
+            logger.debug("正在处理回复邮件: subject='%s', replier='%s', message_id='%s'",
+                         subject, replier, reply.message_id)
         
         # 检查原始邮件缓存
         if subject not in self.original_emails:
-            analysis_result = self._analyze_missing_original_email(subject, reply['邮件名称'])
-            logger.warning(f"主题 '{subject}' 在原始邮件缓存中不存在，分析结果: {analysis_result}")
-            self.unknown_data["processing_errors"].append({
-                "message_id": reply['邮件消息标识'],
-                "error": "找不到对应主题的原始邮件",
-                "subject": subject,
-                "replier": replier,
-                "send_time": self._get_safe_send_time(reply),
-                "original_title": reply['邮件名称'],
-                "analysis": analysis_result
-            })
+            analysis_result = self._analyze_missing_original_email(subject, reply.title)
+            if self.verbose:
+                logger.debug("主题 '%s' 在原始邮件缓存中不存在，分析结果: %s", subject, analysis_result)
+            self.unknown_data["processing_errors"].add(
+                "找不到对应主题的原始邮件",
+                email=replier,
+                message_id=reply.message_id,
+                subject=subject,
+                send_time=format_send_time(reply.send_ts),
+                original_title=reply.title,
+                analysis=analysis_result
+            )
             return
         
-        # 找到对应的原始邮件
-        original_email = None
-        for email in self.original_emails[subject]:
-            # 检查收件人是否包含回复者
-            if '收件人' in email and pd.notna(email['收件人']):
-                recipients = str(email['收件人']).split(',')
-                if any(replier in recipient.strip() for recipient in recipients):
-                    original_email = email
-                    logger.info(f"找到匹配的原始邮件: sender='{email['发件人']}', message_id='{email['邮件消息标识']}'")
-                    break
+        # 找到回复之前最近一封收件人包含回复者的原始邮件
+        original_email = self.original_emails[subject].find(replier, reply.send_ts)
+        if original_email:
+            if self.verbose:
+                logger.debug("找到匹配的原始邮件: sender='%s', message_id='%s'",
+                             original_email.sender, original_email.message_id)
         
         # 如果找到对应的原始邮件，创建关系
         if original_email:
-            original_sender = original_email['发件人']
+            original_sender = original_email.sender
             
             # 构建关系键
             key = f"{original_sender}#{subject}#{reply_domain}"
             
-            # 获取发送时间
-            send_time = self._get_safe_send_time(reply)
-            
-            # 构建关系值
-            value = (original_sender, subject, username, reply['邮件消息标识'], send_time)
+            # 构建关系值（发送时间为int64时间戳，保存时再格式化）
+            value = (original_sender, subject, username, reply.message_id, reply.send_ts)
             
             # 添加到关系集合
-            if key not in self.relationships:
-                self.relationships[key] = []
-            
-            if value not in self.relationships[key]:
-                self.relationships[key].append(value)
-                logger.info(f"成功添加关系: key='{key}'")
+            self._add_relationship(key, value)
         else:
             # 如果找不到对应的原始邮件，记录错误
-            logger.warning(f"在主题 '{subject}' 的 {len(self.original_emails[subject])} 个原始邮件中没有找到收件人包含 '{replier}' 的邮件")
-            self.unknown_data["processing_errors"].append({
-                "message_id": reply['邮件消息标识'],
-                "error": "找不到对应的原始邮件",
-                "subject": subject,
-                "replier": replier,
-                "send_time": self._get_safe_send_time(reply),
-                "original_emails_count": len(self.original_emails[subject])
-            })
+            self.stats['replies_unmatched'] += 1
+            if self.verbose:
+                logger.debug("在主题 '%s' 的 %d 个原始邮件中没有找到收件人包含 '%s' 的邮件",
+                             subject, len(self.original_emails[subject]), replier)
+            self.unknown_data["processing_errors"].add(
+                "找不到对应的原始邮件",
+                email=replier,
+                message_id=reply.message_id,
+                subject=subject,
+                send_time=format_send_time(reply.send_ts),
+                original_emails_count=len(self.original_emails[subject])
+            )
 
     def process_pending_replies(self):
         """处理所有暂存的回复邮件"""
+        stats_before = self.stats.copy()
+        orphan_subjects = 0
+        self._set_phase('处理暂存回复')
         for subject, replies in self.pending_replies.items():
             if subject in self.original_emails:
                 # 找到了原始邮件，处理所有暂存的回复
@@ -338,97 +387,80 @@ class EmailRelationshipAnalyzer:
                     self._process_reply_email(reply, subject)
             else:
                 # 没有找到原始邮件，将所有回复邮件作为独立的关系处理
-                logger.info(f"主题 '{subject}' 没有原始邮件，有 {len(replies)} 个回复，尝试建立独立关系")
+                orphan_subjects += 1
+                self._process_orphan_replies(subject, replies)
+            self.stats['pending_processed'] += len(replies)
+        self._report_progress()
+        
+        delta = self.stats - stats_before
+        logger.info(
+            "暂存回复处理完成: 共 %d 个主题, 其中 %d 个主题没有原始邮件, 新增关系 %d 条, 未匹配回复 %d 封",
+            len(self.pending_replies), orphan_subjects,
+            delta['relationships_added'], delta['replies_unmatched']
+        )
+
+    def _process_orphan_replies(self, subject, replies):
+        """没有原始邮件的主题：将所有回复邮件作为独立的关系处理"""
+        if self.verbose:
+            logger.debug("主题 '%s' 没有原始邮件，有 %d 个回复，尝试建立独立关系", subject, len(replies))
+        
+        # 按发送时间排序（如果有）
+        sorted_replies = sorted(replies, key=lambda reply: reply.send_ts)
+        
+        # 处理每个回复邮件
+        for reply in sorted_replies:
+            # 验证发件人
+            sender = reply.sender
+            if '@' not in sender:
+                self.unknown_data["invalid_emails"].add("发件人格式不正确", email=sender, message_id=reply.message_id, subject=subject)
+                continue
+            
+            # 获取收件人列表
+            recipient_parts = reply.recipient_parts
+            if not recipient_parts:
+                self.unknown_data["invalid_emails"].add("收件人为空", message_id=reply.message_id, subject=subject)
+                continue
+            
+            has_valid_recipient = False  # 标记是否有有效的收件人
+            # 处理收件人列表
+            for recipient, username, recipient_domain in recipient_parts:
+                if '@' not in recipient:
+                    self.unknown_data["invalid_emails"].add("收件人格式不正确", email=recipient, message_id=reply.message_id, subject=subject)
+                    continue
                 
-                # 按发送时间排序（如果有）
-                sorted_replies = sorted(
-                    replies,
-                    key=lambda x: pd.to_datetime(x.get('发送时间', '9999-12-31'), errors='coerce')
-                )
+                # 收件人域名
+                if not recipient_domain:
+                    self.unknown_data["invalid_emails"].add("无法提取收件人域名", email=recipient, message_id=reply.message_id, subject=subject)
+                    continue
                 
-                # 处理每个回复邮件
-                for reply in sorted_replies:
-                    # 验证发件人
-                    sender = reply.get('发件人', '')
-                    if not isinstance(sender, str) or '@' not in sender:
-                        self.unknown_data["invalid_emails"].append({
-                            "message_id": reply['邮件消息标识'],
-                            "email": sender,
-                            "error": "发件人格式不正确",
-                            "subject": subject
-                        })
-                        continue
-                    
-                    # 获取收件人列表
-                    recipients = str(reply.get('收件人', '')) if pd.notna(reply.get('收件人')) else ''
-                    if not recipients:
-                        self.unknown_data["invalid_emails"].append({
-                            "message_id": reply['邮件消息标识'],
-                            "error": "收件人为空",
-                            "subject": subject
-                        })
-                        continue
-                    
-                    has_valid_recipient = False  # 标记是否有有效的收件人
-                    # 处理收件人列表
-                    for recipient in recipients.split(','):
-                        recipient = recipient.strip()
-                        if not isinstance(recipient, str) or '@' not in recipient:
-                            self.unknown_data["invalid_emails"].append({
-                                "message_id": reply['邮件消息标识'],
-                                "email": recipient,
-                                "error": "收件人格式不正确",
-                                "subject": subject
-                            })
-                            continue
-                        
-                        # 提取收件人域名
-                        recipient_domain = extract_domain(recipient)
-                        if not recipient_domain:
-                            self.unknown_data["invalid_emails"].append({
-                                "message_id": reply['邮件消息标识'],
-                                "email": recipient,
-                                "error": "无法提取收件人域名",
-                                "subject": subject
-                            })
-                            continue
-                        
-                        # 获取收件人用户名
-                        username = extract_username(recipient)
-                        if not username:
-                            self.unknown_data["invalid_emails"].append({
-                                "message_id": reply['邮件消息标识'],
-                                "email": recipient,
-                                "error": "无法提取用户名",
-                                "subject": subject
-                            })
-                            continue
-                        
-                        # 构建关系键
-                        key = f"{sender}#{subject}#{recipient_domain}"
-                        
-                        # 构建关系值
-                        value = (sender, subject, username, reply['邮件消息标识'], self._get_safe_send_time(reply))
-                        
-                        # 添加到关系集合
-                        if key not in self.relationships:
-                            self.relationships[key] = []
-                        
-                        if value not in self.relationships[key]:
-                            self.relationships[key].append(value)
-                            has_valid_recipient = True
-                            logger.info(f"为独立回复邮件创建关系: key='{key}'")
-                    
-                    if not has_valid_recipient:
-                        logger.warning(f"邮件 {reply['邮件消息标识']} 的所有收件人都无效")
+                # 收件人用户名
+                if not username:
+                    self.unknown_data["invalid_emails"].add("无法提取用户名", email=recipient, message_id=reply.message_id, subject=subject)
+                    continue
                 
-                # 记录这种特殊处理
-                self.unknown_data["processing_notes"].append({
-                    "subject": subject,
-                    "note": "没有找到原始邮件，已将回复邮件作为独立关系处理",
-                    "reply_count": len(replies),
-                    "message_ids": [reply['邮件消息标识'] for reply in sorted_replies]
-                })
+                # 构建关系键
+                key = f"{sender}#{subject}#{recipient_domain}"
+                
+                # 构建关系值
+                value = (sender, subject, username, reply.message_id, reply.send_ts)
+                
+                # 添加到关系集合
+                if self._add_relationship(key, value):
+                    has_valid_recipient = True
+            
+            if not has_valid_recipient:
+                self.stats['all_recipients_invalid'] += 1
+                if self.verbose:
+                    logger.debug("邮件 %s 的所有收件人都无效", reply.message_id)
+        
+        # 记录这种特殊处理，并通过主题索引给出可能对应的原始邮件主题（主题标准化不一致等情况）
+        self.unknown_data["processing_notes"].append({
+            "subject": subject,
+            "note": "没有找到原始邮件，已将回复邮件作为独立关系处理",
+            "reply_count": len(replies),
+            "message_ids": [reply.message_id for reply in sorted_replies[:self.error_sample_size]],
+            "similar_subjects": self.subject_index.find_similar(subject, self.similarity_threshold)
+        })
 
     def analyze(self):
         """分析Excel数据"""
@@ -446,7 +478,10 @@ class EmailRelationshipAnalyzer:
                 raise ValueError(f"Excel文件缺少必需的列: {missing_columns}")
             
             # 根据文件大小决定处理方式
-            if file_size_mb > 500:  # 大文件（>500MB）
+            if self.external:
+                logger.info(f"使用外部排序归并模式处理 ({file_size_mb:.2f}MB)")
+                self._analyze_external()
+            elif file_size_mb > 500:  # 大文件（>500MB）
                 logger.info(f"文件较大 ({file_size_mb:.2f}MB)，使用分块处理方式")
                 self._analyze_large_file()
             else:
@@ -462,28 +497,22 @@ class EmailRelationshipAnalyzer:
             else:
                 logger.info(f"分析完成，找到 {len(self.relationships)} 个关系集合")
                 logger.info(f"异常数据统计:")
-                logger.info(f"- 无效邮箱: {len(self.unknown_data['invalid_emails'])}")
+                logger.info(f"- 无效邮箱: {self.unknown_data['invalid_emails'].total} 次（{len(self.unknown_data['invalid_emails'])} 个不同地址/原因）")
                 logger.info(f"- 空数据: {len(self.unknown_data['empty_data'])}")
                 logger.info(f"- 多发件人主题: {len(self.unknown_data['multiple_senders'])}")
-                logger.info(f"- 处理警告: {len(self.unknown_data['processing_errors'])}")
+                logger.info(f"- 处理警告: {self.unknown_data['processing_errors'].total} 次（{len(self.unknown_data['processing_errors'])} 类）")
                 logger.info(f"- 未知语言: {len(self.unknown_data['unknown_languages'])}")
                 
         except Exception as e:
             logger.error(f"分析过程中出错: {str(e)}")
-            self.unknown_data["processing_errors"].append({
-                "error": "分析过程错误",
-                "details": str(e)
-            })
+            self.unknown_data["processing_errors"].add("分析过程错误", details=str(e))
             raise
     
     def _analyze_regular_file(self):
         """分析常规大小的文件（一次性读取）"""
-        # 读取整个Excel文件
-        df = pd.read_excel(
-            self.excel_file_path,
-            engine='openpyxl',
-            usecols=lambda x: x in self.required_columns
-        )
+        # 读取整个Excel文件（多进程并行解析sheet XML）
+        self._set_phase('读取')
+        df = read_xlsx(self.excel_file_path, usecols=lambda x: x in self.required_columns)
         
         logger.info(f"读取了 {len(df)} 条邮件记录")
         
@@ -492,38 +521,110 @@ class EmailRelationshipAnalyzer:
         chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
         
         # 使用tqdm显示进度，处理每个数据块
+        self._set_phase('处理数据块')
         for i, chunk in enumerate(tqdm(chunks, desc="处理数据块")):
+            started = time.perf_counter()
             try:
                 self.process_chunk(chunk)
             except Exception as e:
                 logger.error(f"处理数据块 {i} 时发生错误: {str(e)}")
-                self.unknown_data["processing_errors"].append({
-                    "error": "处理数据错误",
-                    "details": str(e)
-                })
+                self.unknown_data["processing_errors"].add("处理数据错误", details=str(e))
+            self._report_progress(len(chunk), time.perf_counter() - started)
     
     def _analyze_large_file(self):
         """分析大型文件（使用分块读取）"""
-        # 分块读取文件
+        # 分块读取文件（openpyxl只读模式流式读取）
         chunksize = 10000
-        reader = pd.read_excel(
-            self.excel_file_path,
-            chunksize=chunksize,
-            engine='openpyxl',
-            usecols=lambda x: x in self.required_columns
-        )
+        reader = iter_excel_chunks(self.excel_file_path, self.required_columns, chunksize)
         
-        # 处理每个数据块
+        # 处理每个数据块（耗时从上一个数据块结束算起，包含流式读取的时间）
+        self._set_phase('处理数据块')
+        started = time.perf_counter()
         for i, chunk in enumerate(tqdm(reader, desc="处理数据块")):
             try:
                 self.process_chunk(chunk)
             except Exception as e:
                 logger.error(f"处理数据块 {i} 时发生错误: {str(e)}")
-                self.unknown_data["processing_errors"].append({
-                    "chunk": i,
-                    "error": str(e),
-                    "type": "chunk_processing_error"
-                })
+                self.unknown_data["processing_errors"].add(str(e), chunk=i, type="chunk_processing_error")
+            finished = time.perf_counter()
+            self._report_progress(len(chunk), finished - started)
+            started = finished
+    
+    def _analyze_external(self):
+        """两遍外部排序归并模式
+        
+        第一遍流式读取数据块，预处理后按 (标准化主题, 是否回复) 排序写成有序run文件；
+        第二遍对所有run做一次流式多路归并，同一主题的原始邮件总是排在回复之前，
+        因此每个主题处理完即可释放，内存只与单个主题的邮件数有关，
+        结果也不受工作簿中行的顺序影响。
+        
+        默认模式按数据块处理，主题已有原始邮件时，回复只与之前数据块中的原始邮件匹配；
+        同一主题的另一封原始邮件排在后面的数据块中时，默认模式记为找不到原始邮件，
+        外部模式则能建立这些关系，因此行的顺序打乱时两种模式的结果可能不同。
+        """
+        with tempfile.TemporaryDirectory(dir=self.external_tmp_dir) as run_dir:
+            run_paths = []
+            reader = iter_excel_chunks(self.excel_file_path, self.required_columns, EXTERNAL_CHUNKSIZE)
+            self._set_phase('写入有序run')
+            started = time.perf_counter()
+            for i, chunk in enumerate(tqdm(reader, desc="写入有序run")):
+                rows = len(chunk)
+                try:
+                    chunk = self._prepare_chunk(chunk)
+                    if chunk is not None:
+                        run_paths.append(write_run(chunk, run_dir, i))
+                        # 归并时按主题顺序处理，没有原始邮件的主题可能排在相似主题之前，
+                        # 因此在第一遍就登记全部原始邮件主题
+                        originals = chunk.loc[~chunk['is_reply'], 'normalized_subject']
+                        for subject in originals[originals != ''].unique():
+                            self.subject_index.add(subject)
+                except Exception as e:
+                    logger.error(f"处理数据块 {i} 时发生错误: {str(e)}")
+                    self.unknown_data["processing_errors"].add(str(e), chunk=i, type="chunk_processing_error")
+                finished = time.perf_counter()
+                self._report_progress(rows, finished - started)
+                started = finished
+            
+            logger.info(f"已写入 {len(run_paths)} 个有序run，开始归并连接")
+            self._set_phase('归并连接')
+            for i, (subject, original_emails, reply_emails) in enumerate(tqdm(iter_merged_groups(run_paths), desc="归并连接")):
+                self._join_subject_group(subject, original_emails, reply_emails)
+                if i % PROGRESS_GROUPS == 0:
+                    self._report_progress()
+            self._report_progress()
+    
+    def _join_subject_group(self, subject, original_emails, reply_emails):
+        """外部模式下处理一个主题的全部原始邮件和回复邮件，处理完即释放"""
+        if not original_emails:
+            self._process_orphan_replies(subject, reply_emails)
+            return
+        
+        self.original_emails[subject] = OriginalTimeline(original_emails)
+        try:
+            for original_email in original_emails:
+                self._process_original_email(original_email, subject)
+            for reply in reply_emails:
+                self._process_reply_email(reply, subject)
+        finally:
+            del self.original_emails[subject]
+    
+    def _serialized_relationships(self):
+        """关系值中的int64时间戳统一格式化为字符串，只在保存时进行"""
+        send_times = iter(format_send_times(
+            [item[4] for items in self.relationships.values() for item in items]
+        ))
+        return {
+            key: [item[:4] + (next(send_times),) for item in items]
+            for key, items in self.relationships.items()
+        }
+    
+    def _serialized_originals(self):
+        """产出写入数据库的原始邮件行，发送时间格式化为字符串"""
+        for subject, timeline in self.original_emails.items():
+            send_times = format_send_times([record.send_ts for record in timeline])
+            for record, send_time in zip(timeline, send_times):
+                recipients = ','.join(address for address, _, _ in record.recipient_parts)
+                yield (record.message_id, subject, record.title, record.sender, recipients, send_time)
     
     def save_relationships(self, output_file):
         """保存关系集合到JSON文件"""
@@ -537,7 +638,7 @@ class EmailRelationshipAnalyzer:
             formatted_relationships = {}
             
             # 1. 转换格式: 添加count字段和items字段
-            for key, items in self.relationships.items():
+            for key, items in self._serialized_relationships().items():
                 formatted_relationships[key] = {
                     "count": len(items),
                     "items": items
@@ -559,16 +660,47 @@ class EmailRelationshipAnalyzer:
             logger.info(f"关系集合已保存到: {output_file}")
         except Exception as e:
             logger.error(f"保存关系集合时出错: {str(e)}")
-            self.unknown_data["processing_errors"].append({
-                "error": "保存关系集合错误",
-                "details": str(e)
-            })
+            self.unknown_data["processing_errors"].add("保存关系集合错误", details=str(e))
+    
+    def save_to_sqlite(self, db_path):
+        """将关系集合、原始邮件和异常记录写入带索引的SQLite数据库（覆盖库中已有的结果）
+        
+        外部排序归并模式下原始邮件处理完即释放，不会写入originals表。
+        """
+        try:
+            unknown_data = {
+                category: items.to_list() if isinstance(items, ErrorStore) else items
+                for category, items in self.unknown_data.items()
+            }
+            with RelationshipStore(db_path) as store:
+                store.reset()
+                store.write_relationships(self._serialized_relationships())
+                store.write_originals(self._serialized_originals())
+                store.write_errors(unknown_data)
+                store.create_indexes()
+            logger.info(f"分析结果已写入数据库: {db_path}")
+        except Exception as e:
+            logger.error(f"写入数据库时出错: {str(e)}")
+            self.unknown_data["processing_errors"].add("写入数据库错误", details=str(e))
+    
+    def close(self):
+        """关闭异常明细文件，可以重复调用；分析结束（无论成功与否）后由调用方调用"""
+        if self.error_detail is not None and not self.error_detail.closed:
+            self.error_detail.close()
     
     def save_unknown_data(self, unknown_file='unknown.json'):
         """保存异常数据到JSON文件"""
         try:
+            unknown_data = {
+                category: items.to_list() if isinstance(items, ErrorStore) else items
+                for category, items in self.unknown_data.items()
+            }
             with open(unknown_file, 'w', encoding='utf-8') as f:
-                json.dump(self.unknown_data, f, ensure_ascii=False, indent=2)
+                json.dump(unknown_data, f, ensure_ascii=False, indent=2, default=str)
             logger.info(f"异常数据已保存到: {unknown_file}")
+            
+            if self.error_detail is not None:
+                self.error_detail.flush()
+                logger.info(f"异常明细已写入: {self.error_detail.name}")
         except Exception as e:
             logger.error(f"保存异常数据时出错: {str(e)}") 
\ No newline at end of file
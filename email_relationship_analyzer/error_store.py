@@ -0,0 +1,94 @@
+import json
+import logging
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+class ErrorStore:
+    """按 (错误类型, 地址) 聚合的异常记录
+
+    同一个无效地址在群发邮件中可能出现成千上万次，这里每个 (错误类型, 地址)
+    只保留一条记录：出现次数、第一次出现时的详细信息，以及有限数量的邮件消息标识样本。
+    如果需要逐条的完整记录，可以传入spill文件对象，每次出现都会以JSON行的形式写入。
+    """
+
+    def __init__(self, category, sample_size=5, spill=None):
+        """
+        Args:
+            category: 异常类别名称，写入spill文件时用于区分来源
+            sample_size: 每条聚合记录最多保留的邮件消息标识数量
+            spill: 可选的文本文件对象，用于写入逐条完整记录
+        """
+        self.category = category
+        self.sample_size = sample_size
+        self.spill = spill
+        self.total = 0  # 出现总次数（未去重）
+        self._entries = {}
+
+    def add(self, error, email=None, message_id=None, **details):
+        """
+        记录一次异常
+
+        Args:
+            error: 异常原因
+            email: 相关的邮箱地址（没有时为None）
+            message_id: 邮件消息标识
+            details: 其他详细信息，只保留第一次出现时的值
+        """
+        self.total += 1
+        key = (error, email)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {"error": error, "email": email, "count": 0, "message_ids": []}
+            entry.update(details)
+            self._entries[key] = entry
+
+        entry["count"] += 1
+        if message_id is not None and len(entry["message_ids"]) < self.sample_size:
+            entry["message_ids"].append(message_id)
+
+        if self.spill is not None:
+            record = {"category": self.category, "error": error, "email": email, "message_id": message_id}
+            record.update(details)
+            self.spill.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def add_many(self, error, message_ids, email=None, **details):
+        """
+        一次记录同一 (错误类型, 地址) 的多次出现，用于按列批量检测出的异常
+
+        Args:
+            error: 异常原因
+            message_ids: 各次出现对应的邮件消息标识列表
+            email: 相关的邮箱地址（没有时为None）
+            details: 其他详细信息，只保留第一次出现时的值
+        """
+        if not message_ids:
+            return
+        key = (error, email)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {"error": error, "email": email, "count": 0, "message_ids": []}
+            entry.update(details)
+            self._entries[key] = entry
+
+        self.total += len(message_ids)
+        entry["count"] += len(message_ids)
+        room = self.sample_size - len(entry["message_ids"])
+        if room > 0:
+            entry["message_ids"].extend(message_ids[:room])
+
+        if self.spill is not None:
+            for message_id in message_ids:
+                record = {"category": self.category, "error": error, "email": email, "message_id": message_id}
+                record.update(details)
+                self.spill.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def to_list(self):
+        """返回聚合后的记录列表，按出现次数从大到小排序"""
+        return sorted(self._entries.values(), key=lambda entry: entry["count"], reverse=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
@@ -0,0 +1,91 @@
+import heapq
+import json
+import logging
+import os
+from itertools import groupby
+
+from ingest import EmailRecord
+from address_parser import parse_addresses, parse_recipient_parts, split_address
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# run文件中每行的字段顺序，前两项为排序键
+RUN_FIELDS = ('normalized_subject', 'is_reply', 'sender', '收件人', '邮件消息标识', 'send_ts', '邮件名称')
+
+
+def _run_column(chunk, column):
+    """取出一列为Python对象列表，缺失值统一为None（NaT/NaN不能可靠地写入JSON）"""
+    if column not in chunk.columns:
+        return [None] * len(chunk)
+    values = chunk[column].astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def write_run(chunk, run_dir, run_index):
+    """
+    将预处理后的数据块按 (标准化主题, 是否回复) 排序后写成一个有序run文件
+
+    同一主题内原始邮件（is_reply为False）排在回复之前，归并时据此先登记原始邮件再匹配回复。
+    主题为空的行与内存模式一样直接跳过。
+
+    Args:
+        chunk: 经过prepare_chunk处理的数据块
+        run_dir: run文件所在目录
+        run_index: run编号，用于生成文件名
+
+    Returns:
+        str: run文件路径
+    """
+    chunk = chunk[chunk['normalized_subject'] != '']
+    chunk = chunk.sort_values(['normalized_subject', 'is_reply'], kind='stable')
+    columns = [_run_column(chunk, column) for column in RUN_FIELDS]
+
+    path = os.path.join(run_dir, f"run_{run_index:05d}.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in zip(*columns):
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+    logger.debug("已写入run文件 %s (%d 行)", path, len(chunk))
+    return path
+
+
+def _record_from_row(row):
+    """由run文件中的一行重建EmailRecord，地址解析结果与prepare_chunk一致"""
+    _, _, sender, recipients, message_id, send_ts, title = row
+    sender_username, sender_domain = split_address(sender) if sender else (None, None)
+    return EmailRecord(
+        message_id=message_id,
+        title=title,
+        send_ts=send_ts,
+        sender=sender,
+        sender_username=sender_username,
+        sender_domain=sender_domain,
+        recipient_parts=parse_recipient_parts(recipients),
+        recipient_set=frozenset(parse_addresses(recipients))
+    )
+
+
+def iter_merged_groups(run_paths):
+    """
+    对所有有序run做一次流式多路归并，逐个主题产出原始邮件和回复邮件
+
+    每个run只保持一行在内存中，因此内存与run的数量有关，与总行数无关。
+
+    Args:
+        run_paths: write_run生成的run文件路径列表
+
+    Yields:
+        tuple: (主题, 原始邮件EmailRecord列表, 回复邮件EmailRecord列表)
+    """
+    files = [open(path, 'r', encoding='utf-8') for path in run_paths]
+    try:
+        streams = [map(json.loads, f) for f in files]
+        merged = heapq.merge(*streams, key=lambda row: (row[0], row[1]))
+        for subject, rows in groupby(merged, key=lambda row: row[0]):
+            originals, replies = [], []
+            for row in rows:
+                (replies if row[1] else originals).append(_record_from_row(row))
+            yield subject, originals, replies
+    finally:
+        for f in files:
+            f.close()
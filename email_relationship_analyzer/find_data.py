@@ -1,23 +1,34 @@
 
 import json
+from relationship_store import RelationshipStore
 
 
-# 行号：555
-def find_title_contain_reply(filepath: str, keyword: str, count: int):
+def _iter_single_item_relationships(filepath: str):
+    """产出count为1的关系集合的items，支持relationships.json和SQLite数据库（.db）"""
+    if filepath.endswith('.db'):
+        with RelationshipStore(filepath) as store:
+            for _, items in store.iter_relationships(min_count=1, max_count=1):
+                yield items
+        return
     with open(filepath, 'r', encoding='utf-8') as f:
         data = json.load(f) 
-    cnt = 0
     for key, value in data.items():
         if 'count' in value and value['count'] == 1:
-            for item in value['items']:
-                if keyword.lower() in item[1].lower():
-                    cnt += 1
-                    print(json.dumps({
-                        "email": item[0],
-                        "subject": item[1],
-                        "username": item[2],
-                        "message_id": item[3]
-                    }, ensure_ascii=False, indent=4))
+            yield value['items']
+
+# 行号：555
+def find_title_contain_reply(filepath: str, keyword: str, count: int):
+    cnt = 0
+    for items in _iter_single_item_relationships(filepath):
+        for item in items:
+            if keyword.lower() in item[1].lower():
+                cnt += 1
+                print(json.dumps({
+                    "email": item[0],
+                    "subject": item[1],
+                    "username": item[2],
+                    "message_id": item[3]
+                }, ensure_ascii=False, indent=4))
         if cnt >= count:
             break
             
@@ -0,0 +1,255 @@
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2 没有公开导出，固定版本2.0.3中只在内部模块里
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+from openpyxl import load_workbook
+from utils import normalize_subject, is_reply
+from address_parser import parse_address, parse_addresses, parse_recipient_parts
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 发件人地址拆分为用户名和域名，与 split('@')[0] / [1] 的取法一致
+SENDER_PARTS_PATTERN = r'^([^@]*)@([^@]*)'
+
+# 发送时间缺失或无法解析时的int64时间戳，排在所有有效时间之后
+MISSING_TS = np.iinfo(np.int64).max
+
+# 分组处理时每封邮件保留的字段 -> 数据块中的列名
+RECORD_COLUMNS = {
+    'message_id': '邮件消息标识',
+    'title': '邮件名称',
+    'send_ts': 'send_ts',
+    'sender': 'sender',
+    'sender_username': 'sender_username',
+    'sender_domain': 'sender_domain',
+    'recipient_parts': 'recipient_parts',
+    'recipient_set': 'recipient_set',
+}
+
+# 一封邮件在分组处理和暂存/缓存中的轻量表示（代替 to_dict('records') 生成的整行字典）
+EmailRecord = namedtuple('EmailRecord', list(RECORD_COLUMNS))
+
+
+def _unique_lookup(series, funcs):
+    """
+    对列中每个不同的值只调用一次各个函数，再按行展开
+
+    同一主题、同一收件人列表在邮件线程中会反复出现，这样每个不同的值只解析一次。
+
+    Args:
+        series: 输入列
+        funcs: 函数列表，缺失值以None传入
+
+    Returns:
+        list: 与funcs一一对应的、和series同索引的object列
+    """
+    codes, uniques = pd.factorize(series)
+    results = []
+    for func in funcs:
+        # factorize对缺失值返回-1，对应末尾多出的一项
+        lookup = np.empty(len(uniques) + 1, dtype=object)
+        for i, value in enumerate(uniques):
+            lookup[i] = func(value)
+        lookup[-1] = func(None)
+        results.append(pd.Series(lookup[codes], index=series.index, dtype=object))
+    return results
+
+
+def _to_naive_ns(parsed):
+    """统一为不带时区的纳秒精度，带时区的时间先换算为UTC"""
+    if getattr(parsed.dt, 'tz', None) is not None:
+        parsed = parsed.dt.tz_convert(None)
+    return parsed.astype('datetime64[ns]')
+
+
+def parse_send_times(series):
+    """
+    将发送时间列整体解析为int64纳秒时间戳
+
+    已经是datetime64的列直接转换；字符串列先用第一个非空值推断一次格式，整列按该格式解析，
+    少数不符合该格式的值再统一用混合格式解析一遍。
+
+    Args:
+        series: 发送时间列
+
+    Returns:
+        tuple: (int64时间戳数组（缺失或无法解析的为MISSING_TS）, 非空但无法解析的行的布尔数组)
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        parsed = _to_naive_ns(series)
+        invalid = np.zeros(len(series), dtype=bool)
+    else:
+        present = series.notna() & series.astype(str).str.strip().ne('')
+        strings = series[present & series.map(lambda value: isinstance(value, str))]
+        fmt = guess_datetime_format(strings.iloc[0].strip()) if len(strings) else None
+
+        parsed = _to_naive_ns(pd.to_datetime(series.where(present), format=fmt, errors='coerce'))
+        leftover = present & parsed.isna()
+        if leftover.any():
+            parsed[leftover] = _to_naive_ns(pd.to_datetime(series[leftover], format='mixed', errors='coerce'))
+        invalid = (present & parsed.isna()).to_numpy()
+
+    ts = np.where(parsed.isna(), MISSING_TS, parsed.to_numpy().view(np.int64))
+    return ts, invalid
+
+
+def format_send_times(ts):
+    """
+    将int64时间戳格式化为字符串，只在序列化时调用
+
+    整秒的时间格式为 YYYY-MM-DD HH:MM:SS（与 str(pd.Timestamp) 一致），MISSING_TS 为空字符串。
+    每个不同的时间戳只格式化一次。
+
+    Args:
+        ts: int64时间戳序列
+
+    Returns:
+        np.ndarray: 与输入等长的字符串数组（object）
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    codes, uniques = pd.factorize(ts)
+    formatted = np.full(len(uniques), '', dtype=object)
+
+    valid = uniques != MISSING_TS
+    values = uniques[valid]
+    strings = pd.DatetimeIndex(values.view('datetime64[ns]')).strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object)
+    fractional = values % 1_000_000_000 != 0
+    if fractional.any():
+        strings[fractional] = [str(pd.Timestamp(value)) for value in values[fractional]]
+    formatted[valid] = strings
+
+    return formatted[codes]
+
+
+def format_send_time(ts):
+    """格式化单个int64时间戳，规则同format_send_times"""
+    return format_send_times([ts])[0]
+
+
+def prepare_chunk(chunk):
+    """
+    为数据块一次性添加规范化后的派生列，后续处理直接读取这些列而不再解析字符串
+
+    添加的列:
+        normalized_subject: 去掉回复前缀后的主题
+        is_reply: 是否为回复邮件
+        sender: 小写的发件人地址
+        sender_username / sender_domain: 发件人用户名和域名（无法提取时为None）
+        recipient_parts: 收件人 ((address, username, domain), ...)
+        recipient_set: 收件人地址集合，用于判断回复者是否在收件人中
+        send_ts: 发送时间的int64时间戳（缺失或无法解析时为MISSING_TS），下游只使用该列
+        send_time_invalid: 发送时间非空但无法解析
+
+    Args:
+        chunk: 包含 邮件名称、发件人、收件人 列的数据块
+
+    Returns:
+        pd.DataFrame: 添加了派生列的新数据块
+    """
+    normalized_subject, reply_flags = _unique_lookup(chunk['邮件名称'], [normalize_subject, is_reply])
+    senders, = _unique_lookup(chunk['发件人'], [parse_address])
+    recipient_parts, recipient_set = _unique_lookup(
+        chunk['收件人'],
+        [parse_recipient_parts, lambda raw: frozenset(parse_addresses(raw))]
+    )
+
+    sender_parts = senders.astype(str).str.extract(SENDER_PARTS_PATTERN)
+    sender_parts = sender_parts.astype(object).where(sender_parts.notna() & sender_parts.ne(''), None)
+
+    if '发送时间' in chunk.columns:
+        send_ts, send_time_invalid = parse_send_times(chunk['发送时间'])
+    else:
+        send_ts = np.full(len(chunk), MISSING_TS, dtype=np.int64)
+        send_time_invalid = np.zeros(len(chunk), dtype=bool)
+
+    return chunk.assign(
+        send_ts=send_ts,
+        send_time_invalid=send_time_invalid,
+        normalized_subject=normalized_subject.astype(str),
+        is_reply=reply_flags.astype(bool),
+        sender=senders,
+        sender_username=sender_parts[0],
+        sender_domain=sender_parts[1],
+        recipient_parts=recipient_parts,
+        recipient_set=recipient_set
+    )
+
+
+def iter_subject_groups(chunk):
+    """
+    按标准化主题排序一次，再沿连续的行区间逐个主题产出原始邮件和回复邮件
+
+    代替 chunk.groupby('normalized_subject') 加每组两次 to_dict('records')：
+    列只转换为NumPy数组一次，每行只生成一个EmailRecord。
+
+    Args:
+        chunk: 经过prepare_chunk处理的数据块
+
+    Yields:
+        tuple: (主题, 原始邮件EmailRecord列表, 回复邮件EmailRecord列表)
+    """
+    if chunk.empty:
+        return
+
+    chunk = chunk.sort_values('normalized_subject', kind='stable')
+    subjects = chunk['normalized_subject'].to_numpy()
+    reply_flags = chunk['is_reply'].to_numpy()
+    columns = [
+        chunk[column].to_numpy(dtype=object) if column in chunk.columns else np.full(len(chunk), None, dtype=object)
+        for column in RECORD_COLUMNS.values()
+    ]
+
+    # 相邻两行主题不同的位置即为分组边界
+    bounds = np.flatnonzero(subjects[1:] != subjects[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(subjects)]))
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        originals, replies = [], []
+        for i in range(start, end):
+            record = EmailRecord._make(column[i] for column in columns)
+            (replies if reply_flags[i] else originals).append(record)
+        yield subjects[start], originals, replies
+
+
+def iter_excel_chunks(excel_file_path, columns, chunksize=10000):
+    """
+    用openpyxl只读模式流式读取第一个工作表，按块产出DataFrame
+
+    pd.read_excel 不支持chunksize，这里逐行读取，内存只与块大小有关。
+
+    Args:
+        excel_file_path: Excel文件路径
+        columns: 需要保留的列名
+        chunksize: 每块的行数
+
+    Yields:
+        pd.DataFrame: 只含所需列的数据块，索引为数据行号（从0开始，与一次性读取时一致）
+    """
+    workbook = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        positions = [i for i, name in enumerate(header) if name in columns]
+        names = [header[i] for i in positions]
+
+        buffer = []
+        start = 0
+        for row in rows:
+            buffer.append([row[i] if i < len(row) else None for i in positions])
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=names, index=pd.RangeIndex(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=names, index=pd.RangeIndex(start, start + len(buffer)))
+    finally:
+        workbook.close()
@@ -1,35 +1,89 @@
 import logging
+import argparse
 from config import DEFAULT_OUTPUT_FILE, DEFAULT_ERROR_FILE, LOG_FORMAT
 from email_analyzer import EmailRelationshipAnalyzer
+from metrics import AnalysisMetrics, DEFAULT_WRITE_INTERVAL
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='邮件关系分析工具')
+    parser.add_argument('input_file', nargs='?', default="/Users/dingke/Downloads/emails.xlsx",
+                        help='Excel文件路径')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_FILE, help='关系集合输出文件路径')
+    parser.add_argument('--error', default=DEFAULT_ERROR_FILE, help='异常数据输出文件路径')
+    parser.add_argument('--db', help='同时将结果写入SQLite数据库（可选）')
+    parser.add_argument('--error-detail', help='逐条异常明细输出文件（JSON行，可选）')
+    parser.add_argument('--verbose', action='store_true', help='输出逐条关系和回复的跟踪日志')
+    parser.add_argument('--external', action='store_true',
+                        help='使用两遍外部排序归并模式（内存有界，结果与行的顺序无关）。'
+                             '默认模式中主题已有原始邮件时，回复只与已读到的原始邮件匹配，行的顺序打乱时'
+                             '可能记为找不到原始邮件，因此两种模式的结果可能不同，外部模式建立的关系更完整')
+    parser.add_argument('--tmp-dir', help='外部模式下有序run文件的临时目录')
+    parser.add_argument('--similarity-threshold', type=float,
+                        help='没有原始邮件的回复按n元组Jaccard相似度查找相似主题的阈值（0~1，默认只看包含关系）')
+    parser.add_argument('--metrics-file',
+                        help='定时写入运行指标（速度、数据块耗时分位数、暂存回复数、关系数、内存）：'
+                             '.json 为JSON，其他扩展名为Prometheus文本格式')
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_WRITE_INTERVAL,
+                        help='写入指标文件的间隔（秒）')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.verbose:
+        # 命令行进程只有一个分析器，由入口打开分析器模块的DEBUG日志
+        logging.getLogger('email_analyzer').setLevel(logging.DEBUG)
+    
     # 设置输入和输出文件路径
-    input_file = "/Users/dingke/Downloads/emails.xlsx"  # 请替换为实际的Excel文件路径
-    output_file = DEFAULT_OUTPUT_FILE
-    error_file = DEFAULT_ERROR_FILE
+    input_file = args.input_file
+    output_file = args.output
+    error_file = args.error
+    
+    # 运行指标：后台线程定时写入文件，分析卡住时文件仍会更新
+    metrics = None
+    if args.metrics_file:
+        metrics = AnalysisMetrics()
+        metrics.start()
+        metrics.start_writer(args.metrics_file, args.metrics_interval)
     
     try:
         # 初始化分析器
-        analyzer = EmailRelationshipAnalyzer(input_file)
+        analyzer = EmailRelationshipAnalyzer(input_file, verbose=args.verbose,
+                                             error_detail_file=args.error_detail,
+                                             similarity_threshold=args.similarity_threshold,
+                                             external=args.external, external_tmp_dir=args.tmp_dir,
+                                             metrics=metrics)
         
         # 执行分析
         analyzer.analyze()
         
         # 保存结果
+        if metrics:
+            metrics.set_phase('保存结果')
         analyzer.save_relationships(output_file)
         analyzer.save_unknown_data(error_file)
+        if args.db:
+            analyzer.save_to_sqlite(args.db)
         
+        if metrics:
+            metrics.finish()
         logger.info("处理完成!")
         
     except Exception as e:
         logger.error(f"处理过程中发生错误: {str(e)}")
+        if metrics:
+            metrics.finish(e)
         # 如果分析器已经初始化，尝试保存已收集的错误
         if 'analyzer' in locals():
             analyzer.save_unknown_data(error_file)
+    
+    finally:
+        # 关闭异常明细文件
+        if 'analyzer' in locals():
+            analyzer.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
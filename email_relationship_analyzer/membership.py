@@ -0,0 +1,139 @@
+import logging
+import argparse
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .xlsx_reader import read_xlsx
+except ImportError:  # 在包目录内直接运行时
+    from xlsx_reader import read_xlsx
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_value(value):
+    """与 check_not_exist.load_field_from_excel 的取法一致：数值按整数转字符串，其他值直接转字符串"""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return str(int(value))
+    return str(value)
+
+
+def normalize_values(values: Iterable) -> np.ndarray:
+    """去掉缺失值并统一为字符串数组（object）"""
+    series = pd.Series(values, dtype=object)
+    series = series[series.notna()]
+    return series.map(_normalize_value).to_numpy(dtype=object)
+
+
+def hash_values(values: np.ndarray) -> np.ndarray:
+    """计算字符串的64位哈希（pandas内置的SipHash，跨进程、跨机器稳定）"""
+    return pd.util.hash_array(np.asarray(values, dtype=object), categorize=False)
+
+
+class MessageIdSet:
+    """由64位哈希组成的有序数组，用于大规模的邮件消息标识成员判断
+
+    每个值只占8字节（Python集合中一个Outlook邮件消息标识字符串通常要上百字节），
+    查询时对整批值做一次哈希和二分查找。
+    返回False表示一定不存在；返回True时存在哈希碰撞的可能，概率约为 n / 2^64，
+    需要精确结果时再对这些值做一次真实比较即可。
+    """
+
+    def __init__(self, hashes: np.ndarray):
+        """
+        Args:
+            hashes: 已排序、去重的uint64哈希数组
+        """
+        self.hashes = hashes
+
+    @classmethod
+    def from_values(cls, values: Iterable) -> 'MessageIdSet':
+        """由任意值序列构建，缺失值会被忽略"""
+        return cls(np.unique(hash_values(normalize_values(values))))
+
+    @classmethod
+    def from_excel(cls, file_path: str, column: str) -> 'MessageIdSet':
+        """
+        由工作簿中的一列构建
+
+        Args:
+            file_path: Excel文件路径
+            column: 列名，例如 邮件消息标识 或 email_message_tag
+        """
+        df = read_xlsx(file_path, usecols=[column], dtype=object)
+        id_set = cls.from_values(df[column])
+        logger.info(f"从 {file_path} 的 {column} 列构建了 {len(id_set)} 个值的成员过滤器 ({id_set.nbytes / 1024:.1f}KB)")
+        return id_set
+
+    def save(self, path: str):
+        """保存为 .npy 文件"""
+        np.save(path, self.hashes)
+        logger.info(f"成员过滤器已保存到: {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'MessageIdSet':
+        """从 save 生成的 .npy 文件加载"""
+        return cls(np.load(path, allow_pickle=False))
+
+    def contains(self, values: Iterable) -> np.ndarray:
+        """
+        批量判断值是否（可能）存在
+
+        Args:
+            values: 待查询的值，会按与构建时相同的方式转为字符串
+
+        Returns:
+            np.ndarray: 布尔数组，False表示一定不存在
+        """
+        hashes = hash_values(normalize_values(values))
+        if len(self.hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        return self.hashes[positions] == hashes
+
+    def missing(self, values: Iterable) -> np.ndarray:
+        """返回一定不存在的值（已去掉缺失值并转为字符串）"""
+        values = normalize_values(values)
+        return values[~self.contains(values)]
+
+    def __contains__(self, value) -> bool:
+        return bool(self.contains([value])[0])
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.hashes.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='邮件消息标识成员过滤器')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='由工作簿的一列构建过滤器')
+    build_parser.add_argument('excel_file', help='Excel文件路径')
+    build_parser.add_argument('--column', default='邮件消息标识', help='列名')
+    build_parser.add_argument('--output', default='message_ids.npy', help='输出文件路径')
+
+    check_parser = subparsers.add_parser('check', help='检查值是否存在')
+    check_parser.add_argument('filter_file', help='过滤器文件路径')
+    check_parser.add_argument('values', nargs='+', help='待检查的值')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        MessageIdSet.from_excel(args.excel_file, args.column).save(args.output)
+        return
+
+    id_set = MessageIdSet.load(args.filter_file)
+    for value, present in zip(args.values, id_set.contains(args.values)):
+        print(f"{value}\t{'可能存在' if present else '不存在'}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 计算分位数时保留的最近数据块耗时数量
+LATENCY_WINDOW = 1000
+# 计算当前速度时使用的最近数据块数量
+RATE_WINDOW = 20
+# 指标文件默认的写入间隔（秒）
+DEFAULT_WRITE_INTERVAL = 5.0
+# 输出的耗时分位数
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Prometheus指标：快照中的字段 -> (指标名, 类型, 说明)
+PROMETHEUS_METRICS = {
+    'rows_processed': ('email_analysis_rows_processed_total', 'counter', '已处理的行数'),
+    'chunks_processed': ('email_analysis_chunks_processed_total', 'counter', '已处理的数据块数'),
+    'rows_per_second': ('email_analysis_rows_per_second', 'gauge', '全程平均每秒处理的行数'),
+    'recent_rows_per_second': ('email_analysis_recent_rows_per_second', 'gauge', '最近若干数据块每秒处理的行数'),
+    'pending_replies': ('email_analysis_pending_replies', 'gauge', '暂存的找不到原始邮件的回复数'),
+    'relationships': ('email_analysis_relationships', 'gauge', '关系集合数'),
+    'rss_bytes': ('email_analysis_rss_bytes', 'gauge', '进程常驻内存（字节）'),
+    'elapsed_seconds': ('email_analysis_elapsed_seconds', 'gauge', '已运行的时间（秒）'),
+    'seconds_since_progress': ('email_analysis_seconds_since_progress', 'gauge', '距离上一个数据块完成的时间（秒）'),
+}
+
+
+def current_rss():
+    """当前进程的常驻内存（字节），无法获取时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # 非Linux系统上退而使用峰值内存，macOS上单位为字节，其他系统为KB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def _quantile(sorted_values, q):
+    """已排序数据的分位数（线性插值）"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+class AnalysisMetrics:
+    """分析任务的运行指标
+
+    分析器在每个数据块处理完后调用chunk_done，记录行数、耗时、暂存回复数和关系数；
+    snapshot可以在其他线程中随时调用（例如定时写入指标文件），据此判断任务是否停滞或变慢。
+    """
+
+    def __init__(self, latency_window=LATENCY_WINDOW):
+        """
+        Args:
+            latency_window: 计算耗时分位数时保留的最近数据块数量
+        """
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self._recent = deque(maxlen=RATE_WINDOW)  # (行数, 耗时)
+        self.state = 'pending'
+        self.phase = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.last_progress_at = None
+        self.rows_processed = 0
+        self.chunks_processed = 0
+        self.chunk_seconds = 0.0
+        self.pending_replies = 0
+        self.relationships = 0
+        self._writer = None
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            self.state = 'running'
+            self.started_at = self.last_progress_at = time.time()
+
+    def set_phase(self, phase):
+        """记录当前阶段（读取、处理数据块、归并连接、处理暂存回复等）"""
+        with self._lock:
+            self.phase = phase
+            self.last_progress_at = time.time()
+
+    def chunk_done(self, rows, seconds, pending_replies=None, relationships=None):
+        """
+        记录一个数据块处理完成
+
+        Args:
+            rows: 数据块的行数
+            seconds: 处理该数据块的耗时（秒）
+            pending_replies: 当前暂存的回复数
+            relationships: 当前的关系集合数
+        """
+        with self._lock:
+            self.rows_processed += rows
+            self.chunks_processed += 1
+            self.chunk_seconds += seconds
+            self._latencies.append(seconds)
+            self._recent.append((rows, seconds))
+        self.update(pending_replies, relationships)
+
+    def update(self, pending_replies=None, relationships=None):
+        """更新暂存回复数和关系数（外部模式的归并连接等不按数据块计数的阶段也用它报告进展）"""
+        with self._lock:
+            self.last_progress_at = time.time()
+            if pending_replies is not None:
+                self.pending_replies = pending_replies
+            if relationships is not None:
+                self.relationships = relationships
+
+    def finish(self, error=None, pending_replies=None, relationships=None):
+        """记录任务结束，error不为None时状态为failed"""
+        with self._lock:
+            self.state = 'failed' if error is not None else 'succeeded'
+            self.error = str(error) if error is not None else None
+            self.finished_at = time.time()
+            if pending_replies is not None:
+                self.pending_replies = pending_replies
+            if relationships is not None:
+                self.relationships = relationships
+        self.stop_writer()
+
+    def snapshot(self):
+        """
+        当前指标的快照
+
+        Returns:
+            dict: 状态、阶段、行数和速度、数据块耗时分位数（毫秒）、暂存回复数、关系数、常驻内存等
+        """
+        with self._lock:
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            latencies = sorted(self._latencies)
+            recent_rows = sum(rows for rows, _ in self._recent)
+            recent_seconds = sum(seconds for _, seconds in self._recent)
+            snapshot = {
+                'state': self.state,
+                'phase': self.phase,
+                'error': self.error,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'elapsed_seconds': round(elapsed, 3),
+                'seconds_since_progress': round(now - self.last_progress_at, 3) if self.last_progress_at else None,
+                'rows_processed': self.rows_processed,
+                'chunks_processed': self.chunks_processed,
+                'chunk_seconds_total': round(self.chunk_seconds, 3),
+                'rows_per_second': round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0.0,
+                'recent_rows_per_second': round(recent_rows / recent_seconds, 1) if recent_seconds > 0 else 0.0,
+                'chunk_latency_ms': {
+                    f'p{int(q * 100)}': round(_quantile(latencies, q) * 1000, 2) if latencies else None
+                    for q in QUANTILES
+                },
+                'pending_replies': self.pending_replies,
+                'relationships': self.relationships,
+            }
+        snapshot['chunk_latency_ms']['max'] = round(latencies[-1] * 1000, 2) if latencies else None
+        snapshot['rss_bytes'] = current_rss()
+        return snapshot
+
+    def write(self, path):
+        """将快照写入指标文件：.json 为JSON，其他扩展名为Prometheus文本格式（可供node_exporter的textfile采集）"""
+        snapshot = self.snapshot()
+        content = json.dumps(snapshot, ensure_ascii=False, indent=2) if path.endswith('.json') else to_prometheus(snapshot)
+        # 先写临时文件再替换，读取方不会看到写了一半的文件
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def start_writer(self, path, interval=DEFAULT_WRITE_INTERVAL):
+        """
+        在后台线程中定时写入指标文件，任务结束时再写一次
+
+        数据块卡住时文件仍会更新（seconds_since_progress持续增长），据此可以发现停滞的任务。
+        """
+        def write():
+            try:
+                self.write(path)
+            except OSError as e:
+                logger.warning(f"写入指标文件 {path} 失败: {e}")
+
+        def run():
+            while not self._stop.wait(interval):
+                write()
+            write()
+
+        write()
+        self._writer = threading.Thread(target=run, name='metrics-writer', daemon=True)
+        self._writer.start()
+
+    def stop_writer(self):
+        if self._writer is not None:
+            self._stop.set()
+            self._writer.join()
+            self._writer = None
+
+
+def to_prometheus(snapshot, labels=None):
+    """
+    将快照转换为Prometheus文本格式
+
+    Args:
+        snapshot: AnalysisMetrics.snapshot() 的结果（或从JSON指标文件读取的同样内容）
+        labels: 附加在每个指标上的标签，例如 {'job': '...'}
+
+    Returns:
+        str: Prometheus文本格式
+    """
+    def format_labels(extra=None):
+        items = dict(labels or {}, **(extra or {}))
+        if not items:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in items.values())
+        return '{' + ','.join(f'{key}="{value}"' for key, value in zip(items, escaped)) + '}'
+
+    lines = []
+    for field, (name, metric_type, description) in PROMETHEUS_METRICS.items():
+        value = snapshot.get(field)
+        if value is None:
+            continue
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', f'{name}{format_labels()} {value}']
+
+    name = 'email_analysis_chunk_latency_seconds'
+    lines += [f'# HELP {name} 数据块处理耗时的分位数（最近的数据块）', f'# TYPE {name} summary']
+    for q in QUANTILES:
+        value = snapshot['chunk_latency_ms'].get(f'p{int(q * 100)}')
+        if value is not None:
+            lines.append(f'{name}{format_labels({"quantile": q})} {round(value / 1000, 6)}')
+    lines += [f'{name}_sum{format_labels()} {snapshot["chunk_seconds_total"]}',
+              f'{name}_count{format_labels()} {snapshot["chunks_processed"]}']
+
+    name = 'email_analysis_running'
+    lines += [f'# HELP {name} 任务是否仍在运行', f'# TYPE {name} gauge',
+              f'{name}{format_labels()} {int(snapshot["state"] == "running")}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,321 @@
+import json
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每批写入的行数
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS relationship_keys (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    sender TEXT,
+    sender_domain TEXT,
+    subject TEXT,
+    recipient_domain TEXT,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS relationships (
+    key_id INTEGER NOT NULL REFERENCES relationship_keys(id),
+    sender TEXT,
+    subject TEXT,
+    username TEXT,
+    message_id TEXT,
+    send_time TEXT
+);
+CREATE TABLE IF NOT EXISTS originals (
+    message_id TEXT,
+    subject TEXT,
+    title TEXT,
+    sender TEXT,
+    recipients TEXT,
+    send_time TEXT
+);
+CREATE TABLE IF NOT EXISTS errors (
+    category TEXT NOT NULL,
+    error TEXT,
+    email TEXT,
+    count INTEGER,
+    message_ids TEXT,
+    details TEXT
+);
+"""
+
+# 批量写入完成后再建索引，比边写边维护索引快得多
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_keys_sender ON relationship_keys(sender);
+CREATE INDEX IF NOT EXISTS idx_keys_sender_domain ON relationship_keys(sender_domain);
+CREATE INDEX IF NOT EXISTS idx_keys_subject ON relationship_keys(subject);
+CREATE INDEX IF NOT EXISTS idx_keys_recipient_domain ON relationship_keys(recipient_domain);
+CREATE INDEX IF NOT EXISTS idx_keys_count ON relationship_keys(count);
+CREATE INDEX IF NOT EXISTS idx_relationships_key_id ON relationships(key_id);
+CREATE INDEX IF NOT EXISTS idx_relationships_message_id ON relationships(message_id);
+CREATE INDEX IF NOT EXISTS idx_originals_message_id ON originals(message_id);
+CREATE INDEX IF NOT EXISTS idx_originals_subject ON originals(subject);
+CREATE INDEX IF NOT EXISTS idx_errors_email ON errors(email);
+"""
+
+ITEM_COLUMNS = ('sender', 'subject', 'username', 'message_id', 'send_time')
+
+
+def _batched(rows: Iterable[tuple], size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _split_key(key: str) -> Tuple[str, str, str]:
+    """关系键为 发件人#主题#收件人域名，主题中可能含有#，所以分别从两端切分"""
+    sender, _, rest = key.partition('#')
+    subject, _, recipient_domain = rest.rpartition('#')
+    return sender, subject, recipient_domain
+
+
+class RelationshipStore:
+    """基于SQLite的关系集合存储
+
+    保存 EmailRelationshipAnalyzer 的关系集合、原始邮件和异常记录，
+    按发件人、主题、域名或邮件消息标识查询时走索引，无需把整个 relationships.json 读入内存。
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite数据库文件路径，不存在时自动创建
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def reset(self):
+        """清空所有表，用于重新写入一次完整的分析结果"""
+        with self.conn:
+            for table in ('relationships', 'relationship_keys', 'originals', 'errors'):
+                self.conn.execute(f"DELETE FROM {table}")
+
+    def create_indexes(self):
+        self.conn.executescript(INDEXES)
+
+    # ---- 写入 ----
+
+    def write_relationships(self, relationships: Dict[str, List[tuple]]):
+        """
+        批量写入关系集合
+
+        Args:
+            relationships: 关系键 -> [(sender, subject, username, message_id, send_time), ...]
+        """
+        with self.conn:
+            # 追加写入时接在已有的关系键之后编号
+            offset = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM relationship_keys").fetchone()[0]
+
+            key_rows = []
+            for key_id, (key, items) in enumerate(relationships.items(), start=offset + 1):
+                sender, subject, recipient_domain = _split_key(key)
+                sender_domain = sender.split('@')[-1] if '@' in sender else None
+                key_rows.append((key_id, key, sender, sender_domain, subject, recipient_domain, len(items)))
+            self.conn.executemany("INSERT INTO relationship_keys VALUES (?, ?, ?, ?, ?, ?, ?)", key_rows)
+
+            item_rows = (
+                (key_id,) + tuple(item)
+                for key_id, items in enumerate(relationships.values(), start=offset + 1)
+                for item in items
+            )
+            for batch in _batched(item_rows):
+                self.conn.executemany("INSERT INTO relationships VALUES (?, ?, ?, ?, ?, ?)", batch)
+        logger.info(f"已写入 {len(key_rows)} 个关系集合")
+
+    def write_originals(self, originals: Iterable[tuple]):
+        """
+        批量写入原始邮件
+
+        Args:
+            originals: (message_id, subject, title, sender, recipients, send_time) 元组
+        """
+        with self.conn:
+            for batch in _batched(originals):
+                self.conn.executemany("INSERT INTO originals VALUES (?, ?, ?, ?, ?, ?)", batch)
+
+    def write_errors(self, unknown_data: Dict[str, Any]):
+        """
+        批量写入异常记录
+
+        Args:
+            unknown_data: 异常类别 -> 聚合记录列表或字典（与 error.json 的内容相同）
+        """
+        def rows():
+            for category, items in unknown_data.items():
+                entries = items.items() if isinstance(items, dict) else enumerate(items)
+                for name, entry in entries:
+                    if not isinstance(entry, dict):
+                        entry = {"email": str(name), "value": entry}
+                    details = {k: v for k, v in entry.items() if k not in ('error', 'email', 'count', 'message_ids')}
+                    yield (
+                        category,
+                        entry.get('error'),
+                        entry.get('email'),
+                        entry.get('count', 1),
+                        json.dumps(entry.get('message_ids', []), ensure_ascii=False, default=str),
+                        json.dumps(details, ensure_ascii=False, default=str)
+                    )
+
+        with self.conn:
+            for batch in _batched(rows()):
+                self.conn.executemany("INSERT INTO errors VALUES (?, ?, ?, ?, ?, ?)", batch)
+
+    # ---- 查询 ----
+
+    def _items(self, key_ids: List[int]) -> Dict[int, List[list]]:
+        items = {key_id: [] for key_id in key_ids}
+        for start in range(0, len(key_ids), 500):
+            chunk = key_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.conn.execute(
+                f"SELECT key_id, {', '.join(ITEM_COLUMNS)} FROM relationships "
+                f"WHERE key_id IN ({placeholders}) ORDER BY rowid",
+                chunk
+            ):
+                items[row[0]].append(list(row[1:]))
+        return items
+
+    def _query_keys(self, where: str, params: tuple, limit: Optional[int]) -> Dict[str, Dict[str, Any]]:
+        sql = f"SELECT id, key, count FROM relationship_keys WHERE {where} ORDER BY count DESC, id"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        rows = self.conn.execute(sql, params).fetchall()
+        items = self._items([row[0] for row in rows])
+        return {key: {"count": count, "items": items[key_id]} for key_id, key, count in rows}
+
+    def by_sender(self, sender: str, limit: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """按发件人地址查询关系集合，返回格式与 relationships.json 相同"""
+        return self._query_keys("sender = ?", (sender.strip().lower(),), limit)
+
+    def by_subject(self, subject: str, exact: bool = True, limit: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """按标准化主题查询关系集合，exact为False时按子串匹配"""
+        if exact:
+            return self._query_keys("subject = ?", (subject,), limit)
+        return self._query_keys("instr(subject, ?) > 0", (subject,), limit)
+
+    def by_domain(self, domain: str, limit: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """按域名查询关系集合，发件人域名或收件人域名匹配即可"""
+        domain = domain.strip().lower()
+        return self._query_keys(
+            "id IN (SELECT id FROM relationship_keys WHERE sender_domain = ? "
+            "UNION SELECT id FROM relationship_keys WHERE recipient_domain = ?)",
+            (domain, domain), limit
+        )
+
+    def by_message_id(self, message_id: str) -> Dict[str, Any]:
+        """按邮件消息标识查询所属的关系集合和原始邮件"""
+        key_ids = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT key_id FROM relationships WHERE message_id = ?", (message_id,)
+        )]
+        placeholders = ','.join('?' * len(key_ids)) or 'NULL'
+        originals = [
+            dict(zip(('message_id', 'subject', 'title', 'sender', 'recipients', 'send_time'), row))
+            for row in self.conn.execute("SELECT * FROM originals WHERE message_id = ?", (message_id,))
+        ]
+        return {
+            "relationships": self._query_keys(f"id IN ({placeholders})", tuple(key_ids), None),
+            "originals": originals
+        }
+
+    def iter_relationships(self, min_count: Optional[int] = None,
+                           max_count: Optional[int] = None) -> Iterator[Tuple[str, List[list]]]:
+        """
+        按count从大到小逐个产出 (关系键, items)，顺序与 relationships.json 一致
+
+        Args:
+            min_count / max_count: 可选的count范围
+        """
+        conditions, params = [], []
+        if min_count is not None:
+            conditions.append("count >= ?")
+            params.append(min_count)
+        if max_count is not None:
+            conditions.append("count <= ?")
+            params.append(max_count)
+        where = ' AND '.join(conditions) or '1'
+
+        cursor = self.conn.execute(
+            f"SELECT id, key FROM relationship_keys WHERE {where} ORDER BY count DESC, id", params
+        )
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            items = self._items([row[0] for row in rows])
+            for key_id, key in rows:
+                yield key, items[key_id]
+
+    def errors(self, email: Optional[str] = None, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查询异常记录"""
+        conditions, params = [], []
+        if email is not None:
+            conditions.append("email = ?")
+            params.append(email)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        where = ' AND '.join(conditions) or '1'
+        results = []
+        for category, error, email, count, message_ids, details in self.conn.execute(
+            f"SELECT * FROM errors WHERE {where} ORDER BY count DESC", params
+        ):
+            entry = {"category": category, "error": error, "email": email, "count": count,
+                     "message_ids": json.loads(message_ids)}
+            entry.update(json.loads(details))
+            results.append(entry)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查询关系集合数据库')
+    parser.add_argument('db_file', help='SQLite数据库文件路径')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--sender', help='按发件人地址查询')
+    group.add_argument('--subject', help='按标准化主题查询')
+    group.add_argument('--domain', help='按域名查询（发件人或收件人域名）')
+    group.add_argument('--message-id', help='按邮件消息标识查询')
+    group.add_argument('--errors', metavar='EMAIL', help='按邮箱地址查询异常记录')
+    parser.add_argument('--contains', action='store_true', help='主题按子串匹配')
+    parser.add_argument('--limit', type=int, help='最多返回的关系集合数量')
+    args = parser.parse_args()
+
+    with RelationshipStore(args.db_file) as store:
+        if args.sender:
+            result = store.by_sender(args.sender, args.limit)
+        elif args.subject:
+            result = store.by_subject(args.subject, exact=not args.contains, limit=args.limit)
+        elif args.domain:
+            result = store.by_domain(args.domain, args.limit)
+        elif args.message_id:
+            result = store.by_message_id(args.message_id)
+        else:
+            result = store.errors(email=args.errors)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
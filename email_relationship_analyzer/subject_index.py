@@ -0,0 +1,85 @@
+from collections import Counter, defaultdict
+
+class SubjectIndex:
+    """标准化主题的n元组（默认三元组）倒排索引
+
+    用于查找与给定主题存在包含关系的已知主题，避免对所有主题做双向子串扫描：
+    - 主题包含查询：查询的所有n元组都必须出现在主题中，从最短的倒排表开始求交集
+    - 查询包含主题：主题必然是查询的某个子串，直接枚举查询的子串在主题字典中查找
+    候选最终都用真实的子串判断确认，因此结果与逐个比较一致。
+    另外可以按n元组的Jaccard相似度返回不存在包含关系但足够相似的主题。
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.subjects = []            # 主题ID -> 主题
+        self._ids = {}                # 主题 -> 主题ID
+        self._gram_counts = []        # 主题ID -> 不同n元组的数量
+        self._postings = defaultdict(list)  # n元组 -> 主题ID列表
+
+    def _grams(self, text):
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, subject):
+        """添加一个主题，已存在时忽略"""
+        if subject in self._ids:
+            return
+        subject_id = len(self.subjects)
+        self._ids[subject] = subject_id
+        self.subjects.append(subject)
+
+        grams = self._grams(subject)
+        self._gram_counts.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(subject_id)
+
+    def __contains__(self, subject):
+        return subject in self._ids
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def find_similar(self, query, threshold=None):
+        """
+        查找与查询主题相关的已知主题
+
+        Args:
+            query: 标准化后的主题
+            threshold: 可选的Jaccard相似度阈值（0~1），达到阈值的主题即使没有包含关系也会返回
+
+        Returns:
+            list: 相关主题列表，按添加顺序排列
+        """
+        query_grams = self._grams(query)
+        if not query_grams:
+            # 查询过短时没有n元组可用，退化为逐个比较
+            return [s for s in self.subjects if query in s or s in query]
+
+        matched = set()
+
+        # 查询包含的主题：枚举查询的所有子串
+        for start in range(len(query)):
+            for end in range(start, len(query) + 1):
+                subject_id = self._ids.get(query[start:end])
+                if subject_id is not None:
+                    matched.add(subject_id)
+
+        # 包含查询的主题：按倒排表长度从短到长求交集
+        postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        matched.update(subject_id for subject_id in candidates if query in self.subjects[subject_id])
+
+        if threshold is not None:
+            hits = Counter()
+            for posting in postings:
+                hits.update(posting)
+            for subject_id, hit_count in hits.items():
+                union = len(query_grams) + self._gram_counts[subject_id] - hit_count
+                if hit_count / union >= threshold:
+                    matched.add(subject_id)
+
+        return [self.subjects[subject_id] for subject_id in sorted(matched)]
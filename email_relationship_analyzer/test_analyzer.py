@@ -2,12 +2,20 @@ import json
 import logging
 import os
 import sys
+from collections import Counter
 
 # 获取当前文件所在目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
+# 验证器、搜索服务等模块在上级目录中
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
 
 from email_analyzer import EmailRelationshipAnalyzer
+from error_store import ErrorStore
+from subject_index import SubjectIndex
 from test_data import generate_test_data, create_test_chunks
+from address_parser import parse_addresses, parse_recipient_parts
 from config import DEFAULT_OUTPUT_FILE, DEFAULT_ERROR_FILE, LOG_FORMAT
 
 # 设置日志
@@ -23,16 +31,27 @@ class TestEmailRelationshipAnalyzer(EmailRelationshipAnalyzer):
         self.excel_file_path = "测试数据"
         self.relationships = {}
         self.unknown_data = {
-            "invalid_emails": [],      # 无效的邮箱格式
+            "invalid_emails": ErrorStore("invalid_emails"),        # 无效的邮箱格式
             "empty_data": [],          # 空数据
             "multiple_senders": {},    # 相同主题不同发件人
-            "processing_errors": [],   # 处理过程中的错误
-            "unknown_languages": []    # 未知语言的邮件
+            "processing_errors": ErrorStore("processing_errors"),  # 处理过程中的错误
+            "invalid_send_times": ErrorStore("invalid_send_times"),  # 无法解析的发送时间
+            "unknown_languages": [],    # 未知语言的邮件
+            "processing_notes": []     # 处理过程中的备注
         }
         self.required_columns = ['邮件名称', '发件人', '收件人', '邮件消息标识']
         self.subject_sender_map = {}  # 用于跟踪相同主题的不同发件人
         self.pending_replies = {}  # 用于暂存找不到原始邮件的回复
         self.original_emails = {}  # 用于存储所有原始邮件
+        self.subject_index = SubjectIndex()
+        self.similarity_threshold = None
+        self.error_detail = None
+        self.error_sample_size = 5
+        self.external = False
+        self.external_tmp_dir = None
+        self.stats = Counter()  # 热路径上的聚合计数
+        self.metrics = None
+        self.verbose = False
     
     def run_analysis_on_test_data(self):
         """在测试数据上运行分析"""
@@ -53,11 +72,11 @@ class TestEmailRelationshipAnalyzer(EmailRelationshipAnalyzer):
                 self.process_chunk(chunk)
             except Exception as e:
                 logger.error(f"处理数据块时发生错误: {str(e)}")
-                self.unknown_data["processing_errors"].append({
-                    "chunk_hash": hash(tuple(chunk.iloc[0])),
-                    "error": str(e),
-                    "type": "chunk_processing_error"
-                })
+                self.unknown_data["processing_errors"].add(
+                    str(e),
+                    chunk_hash=hash(tuple(chunk.iloc[0])),
+                    type="chunk_processing_error"
+                )
         
         # 处理暂存的回复邮件
         self.process_pending_replies()
@@ -77,8 +96,1258 @@ class TestEmailRelationshipAnalyzer(EmailRelationshipAnalyzer):
         
         return self.relationships, self.unknown_data
 
+def check_mixed_case_addresses():
+    """大小写混合的地址：分析器按小写地址生成关系，验证器按解析后的地址集合验证通过"""
+    import pandas as pd
+    
+    assert parse_addresses("'Bob' <Bob@Client.com>; Carol@Client.COM") == ('bob@client.com', 'carol@client.com')
+    assert parse_recipient_parts('Bob@Client.com') == (('bob@client.com', 'bob', 'client.com'),)
+    
+    rows = [
+        {'邮件名称': 'Hello', '发件人': 'John@Corp.com', '收件人': 'Bob@Client.com', '邮件消息标识': '<m1@corp.com>'},
+        {'邮件名称': 'RE: Hello', '发件人': 'Bob@Client.com', '收件人': 'John@Corp.com', '邮件消息标识': '<m2@client.com>'},
+    ]
+    analyzer = TestEmailRelationshipAnalyzer()
+    analyzer.process_chunk(pd.DataFrame(rows))
+    analyzer.process_pending_replies()
+    
+    items = analyzer.relationships.get('john@corp.com#Hello#client.com')
+    assert items, f"缺少关系 john@corp.com#Hello#client.com: {list(analyzer.relationships)}"
+    assert {item[2] for item in items} == {'bob'}, items
+    
+    from relationship_validator import RelationshipValidator
+    validator = RelationshipValidator.__new__(RelationshipValidator)
+    rows_by_id = {row['邮件消息标识']: row for row in rows}
+    for sender, subject, username, message_id, send_ts in items:
+        item = [sender, subject, username, message_id, send_ts]
+        assert validator.validate_relationship_item(item, [{'data': rows_by_id[message_id]}]), f"验证失败: {item}"
+    logger.info("大小写混合地址的检查通过")
+
+def check_domain_analyzer():
+    """向量化的域名分析与逐行extract_domains的结果一致，并统计域名频率和域名对共现次数"""
+    import tempfile
+    from itertools import combinations
+    from analyze_domains import DomainAnalyzer
+
+    rows = [
+        {'收件人': 'a@x.com; b@y.com; c@z.com', '邮件消息标识': '<m1>'},
+        # 带显示名、重复域名和大小写：按解析后的小写地址去重，仍是三个域名
+        {'收件人': "'A' <A@X.com>; a2@x.com; b@Y.com; d@w.com", '邮件消息标识': '<m2>'},
+        {'收件人': 'a@x.com; b@y.com', '邮件消息标识': '<m3>'},
+        {'收件人': 'no-domain; e@; f@v.com', '邮件消息标识': '<m4>'},
+        {'收件人': None, '邮件消息标识': '<m5>'},
+        {'收件人': 'a@x.com; b@y.com; c@z.com; d@w.com', '邮件消息标识': None},
+        {'收件人': 'p@q.com; r@s.com; t@u.com; v@w.com', '邮件消息标识': '<m6>'},
+    ]
+    analyzer_rows = [row for row in rows if row['收件人'] and row['邮件消息标识']]
+    expected_domains = {row['邮件消息标识']: DomainAnalyzer.extract_domains(None, row['收件人'])
+                        for row in analyzer_rows}
+    expected_pairs = Counter(pair for domains in expected_domains.values()
+                             for pair in combinations(sorted(domains), 2))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = _write_workbook(os.path.join(tmp_dir, 'domains.xlsx'), rows)
+        analyzer = DomainAnalyzer(path, os.path.join(tmp_dir, 'domain.json'),
+                                  os.path.join(tmp_dir, 'domain_stats.json'))
+        analyzer.analyze()
+        with open(os.path.join(tmp_dir, 'domain.json'), encoding='utf-8') as f:
+            saved = json.load(f)
+        with open(os.path.join(tmp_dir, 'domain_stats.json'), encoding='utf-8') as f:
+            stats = json.load(f)
+
+    multi = {message_id: domains for message_id, domains in expected_domains.items() if len(domains) > 2}
+    assert {message_id: set(domains) for message_id, domains in saved.items()} == multi, saved
+    assert all(len(domains) == len(set(domains)) for domains in saved.values()), saved
+    assert dict(analyzer.domain_pairs) == dict(expected_pairs), analyzer.domain_pairs
+    assert {tuple(pair['domains']): pair['messages'] for pair in stats['domain_pairs']} == dict(expected_pairs)
+    assert stats['domain_frequency']['x.com'] == {'messages': 3, 'recipients': 4}, stats['domain_frequency']
+    assert stats['domain_frequency']['w.com'] == {'messages': 2, 'recipients': 2}
+    assert 'v.com' in stats['domain_frequency'] and None not in stats['domain_frequency']
+    counts = [entry['messages'] for entry in stats['domain_frequency'].values()]
+    assert counts == sorted(counts, reverse=True), counts
+    logger.info("域名分析的检查通过")
+
+def check_domain_graph():
+    """通信图的边权按不同邮件计数，保存后重新加载（名称表为UTF-8字节块）查询结果不变"""
+    import tempfile
+    import numpy as np
+    from domain_graph import DomainGraph
+
+    relationships = {
+        'a@x.com#Hi#y.com': {'items': [['a@x.com', 'Hi', 'b', '<1>', 0], ['a@x.com', 'Hi', 'b', '<1>', 0],
+                                       ['a@x.com', 'Hi', 'b', '<2>', 0], ['a@x.com', 'Hi', 'c', '<3>', 0]]},
+        # 主题中含有#
+        'a@x.com#Q#1#z.com': {'items': [['a@x.com', 'Q#1', 'd', '<4>', 0]]},
+        'b@y.com#通知#例子.中国': {'items': [['b@y.com', '通知', '张三', '<5>', 0]]},
+    }
+    # <4> 同时发往另外两个域名，发件人域名取自同一邮件的关系
+    multi_domain_messages = {'<4>': ['z.com', 'v.com', 'u.com']}
+
+    def answers(graph):
+        return {
+            'degree_x': graph.degree(' x.com '),
+            'degree_b': graph.degree('b@y.com'),
+            'top_x': graph.top_partners('x.com', 1),
+            'top_y': graph.top_partners('y.com'),
+            'neighbors_y': sorted(graph.neighbors('y.com', 'both')),
+            'neighbors_in_y': graph.neighbors('y.com', 'in'),
+            'two_hop_x': graph.two_hop('x.com'),
+            'two_hop_a': graph.two_hop('a@x.com'),
+            'two_hop_leaf': graph.two_hop('u.com'),
+        }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        relationships_file = os.path.join(tmp_dir, 'relationships.json')
+        domain_file = os.path.join(tmp_dir, 'domain.json')
+        with open(relationships_file, 'w', encoding='utf-8') as f:
+            json.dump(relationships, f, ensure_ascii=False)
+        with open(domain_file, 'w', encoding='utf-8') as f:
+            json.dump(multi_domain_messages, f, ensure_ascii=False)
+
+        graph = DomainGraph.from_analyzer_output(relationships_file, domain_file)
+        expected = {
+            'degree_x': {'out_degree': 4, 'in_degree': 0, 'out_messages': 6, 'in_messages': 0},
+            'degree_b': {'out_degree': 1, 'in_degree': 1, 'out_messages': 1, 'in_messages': 2},
+            'top_x': [('y.com', 3)],
+            'top_y': [('x.com', 3), ('例子.中国', 1)],
+            'neighbors_y': ['x.com', '例子.中国'],
+            'neighbors_in_y': ['x.com'],
+            'two_hop_x': ['例子.中国'],
+            'two_hop_a': ['张三@例子.中国'],
+            'two_hop_leaf': [],
+        }
+        assert answers(graph) == expected, answers(graph)
+        for name, error in (('nope.com', KeyError), ('nobody@x.com', KeyError)):
+            try:
+                graph.degree(name)
+                raise AssertionError(f"应当拒绝: {name}")
+            except error:
+                pass
+        try:
+            graph.neighbors('x.com', 'sideways')
+            raise AssertionError("应当拒绝不支持的方向")
+        except ValueError:
+            pass
+
+        path = os.path.join(tmp_dir, 'graph.npz')
+        graph.save(path)
+        with np.load(path, allow_pickle=False) as data:
+            assert data['domain_names'].dtype == np.uint8 and data['address_names'].dtype == np.uint8
+        loaded = DomainGraph.load(path)
+        assert loaded.domain_names.tolist() == graph.domain_names.tolist()
+        assert loaded.address_names.tolist() == graph.address_names.tolist()
+        assert answers(loaded) == expected
+
+        # 以前按定长字符串数组保存的文件仍可加载
+        legacy = os.path.join(tmp_dir, 'legacy.npz')
+        np.savez(legacy,
+                 domain_names=graph.domain_names.astype(str), domain_indptr=graph.domain_out.indptr,
+                 domain_indices=graph.domain_out.indices, domain_weights=graph.domain_out.weights,
+                 address_names=graph.address_names.astype(str), address_indptr=graph.address_out.indptr,
+                 address_indices=graph.address_out.indices, address_weights=graph.address_out.weights)
+        assert answers(DomainGraph.load(legacy)) == expected
+    logger.info("域名通信图的检查通过")
+
+def check_subject_index():
+    """主题索引的结果与逐个比较包含关系和n元组Jaccard相似度一致；找不到原始邮件的回复通过索引给出相似主题"""
+    import random
+    import pandas as pd
+
+    rnd = random.Random(3)
+    words = ['quote', 'request', 'order', '会议', '通知', 'q3', 'invoice', '报价']
+    subjects = [' '.join(rnd.sample(words, rnd.randint(1, 4))) for _ in range(200)] + ['ab', '会议']
+    index = SubjectIndex()
+    for subject in subjects + subjects[:20]:
+        index.add(subject)
+    known = list(dict.fromkeys(subjects))
+    assert len(index) == len(known) and index.subjects == known
+    assert all(subject in index for subject in known) and 'zzz' not in index
+
+    def grams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def brute_force(query, threshold=None):
+        result = []
+        for subject in known:
+            related = query in subject or subject in query
+            if threshold is not None and not related and grams(query):
+                both = grams(query) | grams(subject)
+                related = len(grams(query) & grams(subject)) / len(both) >= threshold
+            if related:
+                result.append(subject)
+        return result
+
+    queries = [' '.join(rnd.sample(words, rnd.randint(1, 3))) for _ in range(100)] + ['q', 'ab', '', '会议', 'zzz']
+    for query in queries:
+        assert index.find_similar(query) == brute_force(query), query
+        assert index.find_similar(query, 0.5) == brute_force(query, 0.5), query
+    assert index.find_similar('quote', 1.01) == brute_force('quote')
+
+    # 找不到原始邮件的回复：包含关系总会给出，阈值以下的相似主题只在设置了阈值时给出
+    rows = [
+        {'邮件名称': 'Quote request for Q3', '发件人': 'a@x.com', '收件人': 'b@y.com', '邮件消息标识': '<1>'},
+        {'邮件名称': 'RE: Quote request', '发件人': 'b@y.com', '收件人': 'a@x.com', '邮件消息标识': '<2>'},
+        {'邮件名称': 'RE: Quote requests for Q3', '发件人': 'b@y.com', '收件人': 'a@x.com', '邮件消息标识': '<3>'},
+    ]
+    for threshold, expected in ((None, []), (0.5, ['Quote request for Q3'])):
+        analyzer = TestEmailRelationshipAnalyzer()
+        analyzer.similarity_threshold = threshold
+        analyzer.process_chunk(pd.DataFrame(rows))
+        analyzer.process_pending_replies()
+        notes = {note['subject']: note['similar_subjects'] for note in analyzer.unknown_data['processing_notes']}
+        assert notes == {'Quote request': ['Quote request for Q3'], 'Quote requests for Q3': expected}, notes
+    logger.info("主题索引的检查通过")
+
+def check_original_timeline():
+    """回复归到发送时间不早于它的最后一封包含回复者的原始邮件；没有时退回到第一封匹配的原始邮件"""
+    from datetime import datetime
+    import pandas as pd
+    from config import REQUIRED_COLUMNS
+    from ingest import EmailRecord, MISSING_TS
+    from timeline import OriginalTimeline
+
+    def record(message_id, ts, recipients):
+        return EmailRecord(message_id, 'Hi', ts, 'a@x.com', 'a', 'x.com', (), frozenset(recipients))
+
+    # 乱序加入，时间相同的保持加入顺序
+    timeline = OriginalTimeline([record('<3>', 30, {'b'}), record('<1>', 10, {'b', 'c'})])
+    timeline.add(record('<2>', 20, {'c'}))
+    timeline.add(record('<2b>', 20, {'b'}))
+    timeline.add(record('<4>', MISSING_TS, {'d'}))
+    assert [item.message_id for item in timeline] == ['<1>', '<2>', '<2b>', '<3>', '<4>'] and len(timeline) == 5
+    assert timeline.times == sorted(timeline.times)
+
+    def find(replier, ts):
+        found = timeline.find(replier, ts)
+        return found.message_id if found else None
+
+    assert find('b', 25) == '<2b>'
+    assert find('b', 20) == '<2b>'
+    assert find('b', 100) == '<3>'
+    assert find('c', 100) == '<2>'
+    # 回复早于所有原始邮件或没有发送时间：按时间顺序的第一封匹配邮件
+    assert find('b', 5) == '<1>'
+    assert find('b', MISSING_TS) == '<1>'
+    assert find('d', 100) == '<4>'
+    assert find('e', 100) is None
+    assert OriginalTimeline().find('b', 10) is None
+
+    # 同一主题先后由两人发出时，回复按发送时间归到各自之前的那一封（关系键取原始邮件的发件人），与行的顺序无关
+    rows = [
+        {'邮件名称': 'RE: Weekly', '发件人': 'bob@client.com', '收件人': 'jane@corp.com',
+         '邮件消息标识': '<r2>', '发送时间': datetime(2024, 1, 6)},
+        {'邮件名称': 'Weekly', '发件人': 'jane@corp.com', '收件人': 'bob@client.com',
+         '邮件消息标识': '<o2>', '发送时间': datetime(2024, 1, 5)},
+        {'邮件名称': 'Weekly', '发件人': 'john@corp.com', '收件人': 'bob@client.com',
+         '邮件消息标识': '<o1>', '发送时间': datetime(2024, 1, 1)},
+        {'邮件名称': 'RE: Weekly', '发件人': 'bob@client.com', '收件人': 'john@corp.com',
+         '邮件消息标识': '<r1>', '发送时间': datetime(2024, 1, 3)},
+    ]
+    analyzer = TestEmailRelationshipAnalyzer()
+    analyzer.required_columns = REQUIRED_COLUMNS
+    analyzer.process_chunk(pd.DataFrame(rows))
+    analyzer.process_pending_replies()
+    serialized = analyzer._serialized_relationships()
+    assert {key: sorted(item[3] for item in items) for key, items in serialized.items()} == {
+        'john@corp.com#Weekly#client.com': ['<o1>', '<r1>'],
+        'jane@corp.com#Weekly#client.com': ['<o2>', '<r2>'],
+    }, serialized
+    assert [item.message_id for item in analyzer.original_emails['Weekly']] == ['<o1>', '<o2>']
+    logger.info("原始邮件时间线的检查通过")
+
+def check_message_id_set():
+    """哈希成员过滤器与字符串集合的判断一致（数值按整数转字符串、忽略缺失值），保存后重新加载结果不变"""
+    import random
+    import tempfile
+    import numpy as np
+    from membership import MessageIdSet, normalize_values
+    from check_not_exist import check_not_exist, load_field_from_excel, load_id_filter
+
+    rnd = random.Random(5)
+    target_ids = [f'<{rnd.getrandbits(64):x}@corp.com>' for _ in range(2000)]
+    target = target_ids + target_ids[:100] + [12345, 678.0, None, float('nan')]
+    id_set = MessageIdSet.from_values(target)
+    assert len(id_set) == 2002 and id_set.nbytes == 2002 * 8
+    assert list(normalize_values([1.0, np.int64(7), 'a', None])) == ['1', '7', 'a']
+
+    source = target_ids[::7] + [f'<missing-{i}@corp.com>' for i in range(50)] + ['12345', 678, '678.0', None]
+    expected_missing = set(normalize_values(source)) - set(normalize_values(target))
+    assert set(id_set.missing(source)) == expected_missing
+    assert '678.0' in expected_missing and '678' not in expected_missing
+    assert id_set.contains(source).tolist() == [value not in expected_missing for value in normalize_values(source)]
+    assert target_ids[0] in id_set and 12345 in id_set and '<missing-0@corp.com>' not in id_set
+    assert check_not_exist(set(normalize_values(source)), id_set) == expected_missing
+
+    empty = MessageIdSet.from_values([None])
+    assert len(empty) == 0 and empty.contains(['a', 'b']).tolist() == [False, False]
+    assert list(empty.missing(['a', None])) == ['a']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'ids.npy')
+        id_set.save(path)
+        loaded = load_id_filter(path, '邮件消息标识')
+        assert np.array_equal(loaded.hashes, id_set.hashes)
+        assert set(loaded.missing(source)) == expected_missing
+
+        # 由工作簿构建时与 load_field_from_excel 读出的字符串集合一致
+        rows = [{'email_message_tag': value} for value in target_ids[:50] + [12345, 678]]
+        workbook = _write_workbook(os.path.join(tmp_dir, 'target.xlsx'), rows + [{'email_message_tag': None}])
+        from_excel = load_id_filter(workbook, 'email_message_tag')
+        strings = load_field_from_excel(workbook, 'email_message_tag')
+        assert len(from_excel) == len(strings) == 52
+        assert check_not_exist(set(normalize_values(source)), from_excel) == \
+            check_not_exist(set(normalize_values(source)), strings)
+    logger.info("邮件消息标识成员过滤器的检查通过")
+
+def check_xlsx_reader():
+    """并行读取与 pd.read_excel 结果一致；多个线程同时读取不同工作簿时日期起点等工作簿数据不会互相覆盖"""
+    import tempfile
+    from datetime import datetime
+    from concurrent.futures import ThreadPoolExecutor
+    import pandas as pd
+    from openpyxl import Workbook
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904
+    import xlsx_reader
+    from xlsx_reader import read_xlsx
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(4):
+            workbook = Workbook()
+            if i % 2:  # 一半工作簿使用1904日期系统
+                workbook.epoch = CALENDAR_MAC_1904
+            sheet = workbook.active
+            sheet.append(['邮件名称', '发件人', '发送时间', '大小'])
+            for j in range(300):
+                sheet.append([f'主题{i}-{j % 7}', f'user{j}@dom{i}.com' if j % 11 else 'NULL',
+                              datetime(2020 + i, 1 + j % 12, 1 + j % 28, j % 24, 30), j * (i + 1)])
+            path = os.path.join(tmp_dir, f'w{i}.xlsx')
+            workbook.save(path)
+            paths.append(path)
+
+        expected = {path: pd.read_excel(path) for path in paths}
+        # 每次只解压4KB，使工作表切分为多个片段
+        read_size, xlsx_reader.READ_SIZE = xlsx_reader.READ_SIZE, 4096
+        try:
+            for path in paths:
+                for processes in (1, 2):
+                    pd.testing.assert_frame_equal(read_xlsx(path, processes=processes, block_size=4096), expected[path])
+            assert list(read_xlsx(paths[0], usecols=['发件人', '大小']).columns) == ['发件人', '大小']
+
+            # 频繁切换线程，让多个读取交错进行
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                with ThreadPoolExecutor(8) as pool:
+                    results = list(pool.map(lambda path: read_xlsx(path, processes=1, block_size=4096), paths * 4))
+            finally:
+                sys.setswitchinterval(switch_interval)
+            for path, result in zip(paths * 4, results):
+                pd.testing.assert_frame_equal(result, expected[path])
+        finally:
+            xlsx_reader.READ_SIZE = read_size
+    logger.info("并行读取工作簿的检查通过")
+
+def _write_workbook(path, rows):
+    """将行字典列表写成工作簿（第一行为列名）"""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    columns = list(rows[0])
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([row.get(column) for column in columns])
+    workbook.save(path)
+    return path
+
+def _sample_email_rows():
+    """搜索服务检查使用的邮件：两个会话，含回复、抄送多个域名和中英文正文"""
+    from datetime import datetime
+    return [
+        {'邮件名称': 'Quote request', '发件人': 'john@corp.com', '收件人': 'bob@client.com; amy@vendor.com',
+         '发送时间': datetime(2024, 1, 1, 9, 0), '邮件消息标识': '<m1@corp.com>',
+         '邮件文本正文': 'Please send the price quote for 100 units.'},
+        {'邮件名称': 'RE: Quote request', '发件人': 'bob@client.com', '收件人': 'john@corp.com',
+         '发送时间': datetime(2024, 1, 1, 10, 0), '邮件消息标识': '<m2@client.com>',
+         '邮件文本正文': 'The price quote is attached. 报价单见附件。'},
+        {'邮件名称': 'Re: quote request', '发件人': 'amy@vendor.com', '收件人': 'john@corp.com',
+         '发送时间': datetime(2024, 1, 2, 8, 0), '邮件消息标识': '<m3@vendor.com>',
+         '邮件文本正文': 'We can ship next week.'},
+        {'邮件名称': '会议通知', '发件人': 'carol@corp.com', '收件人': 'dave@partner.cn',
+         '发送时间': datetime(2024, 2, 1, 14, 30), '邮件消息标识': '<m4@corp.com>',
+         '邮件文本正文': '明天下午三点开会，讨论报价。'},
+        {'邮件名称': '回复: 会议通知', '发件人': 'dave@partner.cn', '收件人': 'carol@corp.com',
+         '发送时间': datetime(2024, 2, 1, 15, 0), '邮件消息标识': '<m5@partner.cn>',
+         '邮件文本正文': '收到，准时参加。'},
+    ]
+
+def check_relationship_store():
+    """写入SQLite后逐个读出的关系集合与 relationships.json 相同，按发件人、主题、域名和邮件消息标识的查询走同一份数据"""
+    import tempfile
+    import pandas as pd
+    from config import REQUIRED_COLUMNS
+    from relationship_store import RelationshipStore
+
+    rows = _sample_email_rows() + [
+        {'邮件名称': 'Bad', '发件人': 'x@corp.com', '收件人': 'not-an-address', '邮件消息标识': '<m6@corp.com>'},
+    ]
+    analyzer = TestEmailRelationshipAnalyzer()
+    analyzer.required_columns = REQUIRED_COLUMNS
+    analyzer.process_chunk(pd.DataFrame(rows))
+    analyzer.process_pending_replies()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, 'relationships.json')
+        db_path = os.path.join(tmp_dir, 'relationships.db')
+        analyzer.save_relationships(json_path)
+        # 第二次写入覆盖而不是追加
+        analyzer.save_to_sqlite(db_path)
+        analyzer.save_to_sqlite(db_path)
+        with open(json_path, encoding='utf-8') as f:
+            saved = json.load(f)
+
+        with RelationshipStore(db_path) as store:
+            assert list(store.iter_relationships()) == [(key, value['items']) for key, value in saved.items()]
+            assert [key for key, _ in store.iter_relationships(min_count=2)] == \
+                [key for key, value in saved.items() if value['count'] >= 2]
+            assert [key for key, _ in store.iter_relationships(max_count=1)] == \
+                [key for key, value in saved.items() if value['count'] <= 1]
+
+            by_sender = store.by_sender(' John@Corp.com ')
+            assert by_sender == {key: value for key, value in saved.items() if key.startswith('john@corp.com#')}
+            assert list(store.by_sender('john@corp.com', limit=1)) == ['john@corp.com#Quote request#client.com']
+            assert list(store.by_subject('Quote request')) == \
+                ['john@corp.com#Quote request#client.com', 'john@corp.com#Quote request#vendor.com']
+            assert store.by_subject('quote') == {}
+            assert list(store.by_subject('uote', exact=False)) == list(store.by_subject('Quote request')) + \
+                ['amy@vendor.com#quote request#corp.com']
+            # 发件人域名或收件人域名匹配
+            assert set(store.by_domain('VENDOR.com')) == \
+                {'john@corp.com#Quote request#vendor.com', 'amy@vendor.com#quote request#corp.com'}
+
+            found = store.by_message_id('<m1@corp.com>')
+            assert set(found['relationships']) == \
+                {'john@corp.com#Quote request#client.com', 'john@corp.com#Quote request#vendor.com'}
+            assert found['originals'] == [{
+                'message_id': '<m1@corp.com>', 'subject': 'Quote request', 'title': 'Quote request',
+                'sender': 'john@corp.com', 'recipients': 'bob@client.com,amy@vendor.com',
+                'send_time': '2024-01-01 09:00:00'
+            }]
+            assert store.by_message_id('<m5@partner.cn>')['originals'] == []
+            assert store.by_message_id('<missing>') == {'relationships': {}, 'originals': []}
+
+            errors = store.errors(email='not-an-address')
+            assert [(error['category'], error['count'], error['message_ids'], error['subject']) for error in errors] == \
+                [('invalid_emails', 1, ['<m6@corp.com>'], 'Bad')], errors
+            notes = store.errors(category='processing_notes')
+            assert len(notes) == 1 and notes[0]['subject'] == 'quote request', notes
+    logger.info("关系集合数据库的检查通过")
+
+def check_searcher_columns():
+    """搜索器的紧凑列：取值与 astype(str) 相同；按列搜索按正则表达式匹配，全局搜索按字面子串匹配"""
+    import re
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from excel_searcher import ExcelSearcher
+
+    rows = _sample_email_rows() * 4
+    rows[1] = dict(rows[1], 邮件文本正文=None)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = _write_workbook(os.path.join(tmp_dir, 'a.xlsx'), rows)
+        searcher = ExcelSearcher(path)
+        # 重复值多的列为category，其他列为字符串；取值与整表 astype(str) 一致，缺失值为'nan'
+        assert isinstance(searcher.df['发件人'].dtype, pd.CategoricalDtype)
+        expected = pd.read_excel(path).astype(object).map(str)
+        assert searcher.df.astype(object).map(str).values.tolist() == expected.values.tolist()
+        assert searcher.get_row(1)['邮件文本正文'] == 'nan'
+        assert searcher.memory_usage()['rows'] == len(rows)
+
+        # 按列搜索：正则表达式、不区分大小写，category列和字符串列结果一致；行号为工作表中的行号
+        results = searcher.column_search('邮件名称', ['^RE:', '通知$'])
+        assert [(r['row_index'], r['matched_term']) for r in results][:3] == [(3, '^re:'), (4, '^re:'), (8, '^re:')]
+        assert {r['row_index'] for r in results if r['matched_term'] == '通知$'} == {5, 6, 10, 11, 15, 16, 20, 21}
+        assert [r['row_index'] for r in searcher.column_search('发件人', ['^(bob|amy)@'])] == [3, 4, 8, 9, 13, 14, 18, 19]
+        bodies = [row['邮件文本正文'] or '' for row in rows]
+        assert [r['row_index'] for r in searcher.column_search('邮件文本正文', ['PRICE|准时'])] == \
+            [i + 2 for i, body in enumerate(bodies) if re.search('price|准时', body)]
+        # 导出按位置取行，顺序与按列搜索相同
+        positions = searcher.find_positions(['^RE:', '通知$'], '邮件名称')
+        assert (np.asarray(positions) + 2).tolist() == [r['row_index'] for r in results]
+        try:
+            searcher.column_search('邮件名称', ['('])
+            raise AssertionError("无效的正则表达式应当报错")
+        except ValueError:
+            pass
+
+        # 全局搜索按字面子串匹配，'.'不是通配符
+        assert [r['row_index'] for r in searcher.global_search(['units.'])] == [2, 7, 12, 17]
+        assert searcher.global_search(['u.its']) == []
+    logger.info("搜索器紧凑列的检查通过")
+
+def check_fulltext_index():
+    """倒排索引的BM25得分和排序与逐个文档直接计算一致；短语按原文验证连续性，子串候选是真实结果的超集"""
+    import math
+    import random
+    import tempfile
+    from fulltext_index import FullTextIndex, tokenize, parse_query, K1, B
+    from workbook_store import save_fulltext_index, load_fulltext_index
+
+    assert tokenize('Ｎｉｔｒｉｌｅ Gloves, 丁腈手套!') == ['nitrile', 'gloves', '丁腈', '腈手', '手套']
+    assert tokenize('報 a1_b') == ['報', 'a1_b']
+    assert parse_query('"price quote" 报价 ""') == (['price', 'quote', '报价'], [['price', 'quote']])
+
+    rnd = random.Random(11)
+    words = ['price', 'quote', 'units', 'ship', 'week', '报价单', '附件', '会议', 'Price']
+    texts = [' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 12))) for _ in range(300)]
+    texts += [None, '', 'quote price', 'price, quote', 'PRICE QUOTE now']
+    index = FullTextIndex.build(texts)
+    docs = [tokenize(text) if isinstance(text, str) else [] for text in texts]
+    avg_length = sum(map(len, docs)) / len(docs)
+
+    def bm25(query):
+        scores = []
+        for tokens in docs:
+            score = 0.0
+            for token in set(tokenize(query)):
+                df = sum(token in other for other in docs)
+                tf = tokens.count(token)
+                if tf:
+                    idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                    score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(tokens) / avg_length))
+            scores.append(score)
+        return scores
+
+    for query in ('price', 'quote 报价', '会议 附件 week', 'missing'):
+        scores = bm25(query)
+        expected = sorted((doc for doc, score in enumerate(scores) if score > 0), key=lambda doc: (-scores[doc], doc))
+        hits = index.search(query, top_k=10)
+        assert [doc for doc, _ in hits] == expected[:10], (query, hits, expected[:10])
+        assert all(math.isclose(score, scores[doc], rel_tol=1e-5) for doc, score in hits), query
+
+    # 短语：词元必须连续出现，可以隔着标点，不区分大小写
+    phrase_docs = [doc for doc, tokens in enumerate(docs)
+                   if any(tokens[i:i + 2] == ['price', 'quote'] for i in range(len(tokens) - 1))]
+    hits = index.search('"price quote"', top_k=len(texts), texts=texts)
+    assert sorted(doc for doc, _ in hits) == phrase_docs and len(texts) - 1 in phrase_docs
+    assert len(texts) - 3 not in phrase_docs
+    assert [doc for doc, _ in index.search('"price quote"', top_k=2, texts=texts)] == [doc for doc, _ in hits[:2]]
+    # 不传原文时只要求短语的词元都出现
+    loose = index.search('"price quote"', top_k=len(texts))
+    assert set(phrase_docs) < {doc for doc, _ in loose}
+    cjk_hits = index.search('"报价单"', top_k=len(texts), texts=texts)
+    assert sorted(doc for doc, _ in cjk_hits) == [doc for doc, text in enumerate(texts) if text and '报价单' in text]
+    # 短语之外的普通词只影响得分
+    assert {doc for doc, _ in index.search('"报价单" missing', top_k=len(texts), texts=texts)} == \
+        {doc for doc, _ in cjk_hits}
+
+    for text in ('price quo', 'e qu', '报价', '价单 附', 'units', 'ＰＲＩＣＥ'):
+        candidates = index.substring_candidates(text)
+        actual = [doc for doc, value in enumerate(texts) if isinstance(value, str) and text.casefold() in value.casefold()]
+        assert candidates is None or set(actual) <= set(candidates.tolist()), text
+    assert index.substring_candidates('ｅ') is None and index.substring_candidates('price') is None
+
+    assert index.search('', top_k=5) == [] and index.search('!!!', top_k=5) == []
+    empty = FullTextIndex.build([])
+    assert empty.search('price') == [] and empty.num_docs == 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_fulltext_index(index, tmp_dir, '邮件文本正文')
+        loaded = load_fulltext_index(tmp_dir, '邮件文本正文')
+        assert load_fulltext_index(tmp_dir, '其他列') is None
+        for query in ('price', '"price quote"', '报价 会议'):
+            assert loaded.search(query, top_k=20, texts=texts) == index.search(query, top_k=20, texts=texts)
+    logger.info("全文索引的检查通过")
+
+def check_search_cache():
+    """结果缓存按字节上限做LRU淘汰、按工作簿失效；缓存键区分短语内的空白、正则与字面匹配和不同内容的工作簿"""
+    import shutil
+    import tempfile
+    import numpy as np
+    from excel_searcher import ExcelSearcher
+    from search_cache import SearchCache
+
+    values = {name: np.arange(10, dtype=np.int64) + i for i, name in enumerate('abcd')}
+    cache = SearchCache(budget_bytes=200)
+    cache.put(('w1', 'a'), values['a'])
+    cache.put(('w1', 'b'), values['b'])
+    assert cache.get(('w1', 'a')) is values['a']
+    cache.put(('w2', 'c'), (values['c'][:5], values['c'][5:]))
+    # b最久未使用，被淘汰
+    assert cache.get(('w1', 'b')) is None and cache.get(('w1', 'a')) is values['a']
+    # 替换已有的键时按新值计算字节数
+    cache.put(('w1', 'a'), values['a'][:2])
+    cache.put(('w1', 'd'), values['d'])
+    cache.put(('w1', 'big'), np.zeros(100))
+    assert cache.get(('w1', 'big')) is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'hit_rate': 0.5, 'evictions': 1, 'entries': 3,
+                             'bytes': 16 + 80 + 80, 'budget_bytes': 200}, cache.stats()
+    assert cache.get_or_compute(('w1', 'd'), lambda: 1 / 0) is values['d']
+    assert cache.invalidate(keep_workbooks=['w2']) == 2 and cache.stats()['entries'] == 1
+    assert cache.invalidate() == 1 and cache.stats()['bytes'] == 0
+
+    rows = _sample_email_rows() + [
+        {'邮件名称': 'spacing', '发件人': 'x@corp.com', '收件人': 'y@corp.com', '邮件文本正文': 'foo  bar'},
+        {'邮件名称': 'spacing', '发件人': 'x@corp.com', '收件人': 'y@corp.com', '邮件文本正文': 'foo bar'},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = _write_workbook(os.path.join(tmp_dir, 'a.xlsx'), rows)
+        cache = SearchCache()
+        searcher = ExcelSearcher(path, cache=cache)
+
+        def rows_of(results):
+            return [result['row_index'] for result in results]
+
+        assert rows_of(searcher.query_search('"foo  bar"')) == [7]
+        assert rows_of(searcher.query_search('"foo bar"')) == [8]
+        # 词之间多余的空白不影响结果，命中同一条缓存
+        hits = cache.hits
+        assert rows_of(searcher.query_search('  "foo bar"   ')) == [8] and cache.hits == hits + 1
+
+        # 按列搜索（正则）和全局搜索（字面）的同一搜索内容分别缓存
+        assert rows_of(searcher.column_search('邮件名称', ['^re.'])) == [3, 4]
+        assert searcher.find_positions(['^re.']).tolist() == []
+        assert rows_of(searcher.column_search('邮件名称', ['^re.'])) == [3, 4]
+
+        # 同一内容的另一个搜索器共享缓存，内容不同的工作簿不会命中
+        copy = shutil.copy(path, os.path.join(tmp_dir, 'copy.xlsx'))
+        same = ExcelSearcher(copy, cache=cache)
+        assert same.workbook_hash == searcher.workbook_hash
+        hits = cache.hits
+        assert rows_of(same.query_search('"foo bar"')) == [8] and cache.hits == hits + 1
+        other = ExcelSearcher(_write_workbook(os.path.join(tmp_dir, 'b.xlsx'), rows[:5]), cache=cache)
+        assert other.workbook_hash != searcher.workbook_hash
+        assert rows_of(other.query_search('"foo bar"')) == []
+        cache.invalidate(keep_workbooks=[other.workbook_hash])
+        assert all(key[0] == other.workbook_hash for key in cache._entries)
+    logger.info("搜索结果缓存的检查通过")
+
+def check_result_export():
+    """分批导出的CSV、NDJSON和xlsx读回后与按位置取出的行一致：只含选中的列、第一列为Excel行号；xlsx去掉非法控制字符"""
+    import csv
+    import io
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from excel_searcher import ExcelSearcher
+    from result_export import iter_csv, iter_ndjson, write_xlsx, ROW_INDEX_COLUMN
+    from xlsx_reader import read_xlsx
+
+    rows = _sample_email_rows() + [
+        {'邮件名称': 'Odd, "quoted"\nsubject', '发件人': 'x@corp.com', '收件人': 'y@corp.com',
+         '邮件文本正文': 'tab\t and 中文'},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        searcher = ExcelSearcher(_write_workbook(os.path.join(tmp_dir, 'a.xlsx'), rows))
+        columns = ['邮件文本正文', '邮件名称']
+        positions = np.array([5, 0, 3, 2])
+        expected = [
+            [position + 2] + [searcher.get_rows([position])[0][column] for column in columns]
+            for position in positions.tolist()
+        ]
+
+        def batches():
+            # 每批2行，跨批次拼接
+            return searcher.iter_row_batches(positions, columns, batch_size=2)
+
+        assert [batch.index.tolist() for batch in batches()] == [[7, 2], [5, 4]]
+        assert [list(batch.columns) for batch in batches()] == [columns, columns]
+        assert list(searcher.iter_row_batches(np.empty(0, dtype=np.int64), columns)) == []
+        try:
+            searcher.iter_row_batches(positions, ['邮件名称', '不存在的列'])
+            raise AssertionError("应当拒绝不存在的列")
+        except ValueError:
+            pass
+
+        text = ''.join(iter_csv(columns, batches()))
+        assert text.startswith('\ufeff')
+        parsed = list(csv.reader(io.StringIO(text[1:])))
+        assert parsed[0] == [ROW_INDEX_COLUMN] + columns
+        assert parsed[1:] == [[str(value) for value in row] for row in expected]
+
+        lines = ''.join(iter_ndjson(columns, batches())).splitlines()
+        assert [json.loads(line) for line in lines] == [dict(zip([ROW_INDEX_COLUMN] + columns, row)) for row in expected]
+
+        output_file = os.path.join(tmp_dir, 'export.xlsx')
+        assert write_xlsx(columns, batches(), output_file) == len(positions)
+        exported = read_xlsx(output_file)
+        assert list(exported.columns) == [ROW_INDEX_COLUMN] + columns
+        assert exported.astype(object).values.tolist() == expected, exported.values.tolist()
+
+        # openpyxl不允许写入的控制字符被去掉
+        write_xlsx(['邮件文本正文'], [pd.DataFrame({'邮件文本正文': ['bell\x07 ok']}, index=[9])], output_file)
+        assert read_xlsx(output_file).astype(object).values.tolist() == [[9, 'bell ok']]
+    logger.info("结果导出的检查通过")
+
+def check_federated_searcher():
+    """联合搜索的结果等于逐个工作簿搜索的合并；摘要保存后重新加载不变，按摘要跳过的工作簿确实没有匹配行"""
+    import tempfile
+    from datetime import datetime
+    import pandas as pd
+    from excel_searcher import ExcelSearcher
+    from federated_searcher import FederatedSearcher, WorkbookSummary
+
+    march = [
+        {'邮件名称': 'Quote request', '发件人': 'eve@a.com.cn', '收件人': 'john@corp.com',
+         '发送时间': datetime(2024, 3, 1, 9, 0), '邮件消息标识': '<m6@a.com.cn>'},
+        {'邮件名称': 'RE: Quote request', '发件人': 'john@corp.com', '收件人': "'Eve' <Eve@A.com.cn>; x@a.co",
+         '发送时间': datetime(2024, 3, 2, 9, 0), '邮件消息标识': '<m7@corp.com>'},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        first = _write_workbook(os.path.join(tmp_dir, 'jan.xlsx'), _sample_email_rows())
+        # 三月的导出没有正文列
+        second = _write_workbook(os.path.join(tmp_dir, 'mar.xlsx'), march)
+        artifact_dir = os.path.join(tmp_dir, 'artifacts')
+        os.makedirs(artifact_dir)
+        federation = FederatedSearcher(max_workers=2)
+        jan = federation.add_file(first, workbook_hash='jan', artifact_dir=artifact_dir)
+        mar = federation.add_file(second, name='三月')
+        assert mar == os.path.abspath(second)
+        assert federation.list() == [
+            {'key': 'jan', 'name': 'jan.xlsx', 'rows': 5, 'message_ids': 5, 'domains': 4,
+             'min_time': '2024-01-01 09:00:00', 'max_time': '2024-02-01 15:00:00'},
+            {'key': mar, 'name': '三月', 'rows': 2, 'message_ids': 2, 'domains': 3,
+             'min_time': '2024-03-01 09:00:00', 'max_time': '2024-03-02 09:00:00'},
+        ], federation.list()
+
+        # 摘要保存在解析结果目录中，重新加入时直接读取
+        loaded = WorkbookSummary.load(artifact_dir)
+        assert loaded.to_dict() == federation.workbooks['jan']['summary'].to_dict()
+        assert '<m1@corp.com>' in loaded.message_ids and 'client.com' in loaded.domains
+        assert WorkbookSummary.load(tmp_dir) is None
+        assert not loaded.may_match(message_id='<m6@a.com.cn>') and not loaded.may_match(domain='a.com.cn')
+        assert not loaded.may_match(start=pd.Timestamp('2024-03-01')) and loaded.may_match(end=pd.Timestamp('2024-01-01 09:00'))
+        assert not loaded.may_match(end=pd.Timestamp('2024-01-01'))
+
+        def found(results):
+            return sorted((result['source'], result['row_index']) for result in results)
+
+        def separately(*args, **kwargs):
+            return sorted(
+                (name, position + 2)
+                for name, path in (('jan.xlsx', first), ('三月', second))
+                for position in ExcelSearcher(path).find_positions(*args, **kwargs).tolist()
+            )
+
+        for terms, column in ((['quote'], ''), (['^re:'], '邮件名称'), (['发件人:john*'], '')):
+            mode = 'query' if ':' in terms[0] and not column else 'keyword'
+            assert found(federation.search(terms, column, mode)) == separately(terms, column, mode), terms
+        results = federation.search(['<m6@a.com.cn>'])
+        assert [(result['workbook'], result['row_index']) for result in results] == [(mar, 2)]
+
+        # 域名按解析后的地址精确比较
+        assert found(federation.search(['quote'], domain='@A.com.cn')) == [('三月', 2), ('三月', 3)]
+        assert found(federation.search(['quote'], domain='a.com')) == []
+        assert found(federation.search(['quote'], domain='a.co')) == [('三月', 3)]
+        assert found(federation.search(['quote'], domain='client.com')) == [('jan.xlsx', 2), ('jan.xlsx', 3)]
+        # 时间范围：不在范围内的工作簿整体跳过，范围内的按行过滤
+        assert found(federation.search(['quote'], start='2024-01-01 10:00', end='2024-03-01 12:00')) == \
+            [('jan.xlsx', 3), ('jan.xlsx', 4), ('三月', 2)]
+        assert found(federation.search(['quote'], start='2025-01-01')) == []
+
+        # 全文检索只在有正文列的工作簿中进行，域名过滤后仍返回top_k个
+        hits = federation.search(['报价'], mode='fulltext', top_k=5)
+        assert [hit['row_index'] for hit in hits] == [3, 5] and all(hit['workbook'] == 'jan' for hit in hits)
+        assert [hit['score'] for hit in hits] == sorted((hit['score'] for hit in hits), reverse=True)
+        assert [hit['row_index'] for hit in federation.search(['quote', '报价'], mode='fulltext', top_k=1,
+                                                            domain='vendor.com')] == [2]
+
+        assert [(result['source'], result['row_index']) for result in federation.find_message('<m7@corp.com>')] == \
+            [('三月', 3)]
+        assert federation.find_message('<missing@corp.com>') == []
+        assert federation.remove(mar) and not federation.remove(mar)
+        assert found(federation.search(['quote'])) == [hit for hit in separately(['quote']) if hit[0] == 'jan.xlsx']
+    logger.info("联合搜索的检查通过")
+
+def check_thread_index():
+    """会话索引按标准化主题分组与逐行标准化一致；每行参与的关系键与分析器生成的关系集合一致；保存后重新加载不变"""
+    import tempfile
+    from datetime import datetime
+    import pandas as pd
+    from collections import defaultdict
+    from config import REQUIRED_COLUMNS
+    from excel_searcher import ExcelSearcher
+    from thread_index import ThreadIndex
+    from utils import normalize_subject, is_reply
+    from workbook_store import save_thread_index, load_thread_index
+
+    rows = _sample_email_rows() + [
+        {'邮件名称': 'Weekly', '发件人': 'john@corp.com', '收件人': 'bob@client.com; not-an-address',
+         '发送时间': datetime(2024, 3, 1), '邮件消息标识': '<w1@corp.com>'},
+        {'邮件名称': 'RE: Weekly', '发件人': 'bob@client.com', '收件人': 'jane@corp.com',
+         '发送时间': datetime(2024, 3, 9), '邮件消息标识': '<w4@client.com>'},
+        {'邮件名称': 'Weekly', '发件人': 'jane@corp.com', '收件人': 'bob@client.com',
+         '发送时间': datetime(2024, 3, 8), '邮件消息标识': '<w3@corp.com>'},
+        {'邮件名称': 'RE: Weekly', '发件人': 'bob@client.com', '收件人': 'john@corp.com',
+         '发送时间': datetime(2024, 3, 2), '邮件消息标识': '<w2@client.com>'},
+        # 没有原始邮件的回复按独立关系处理
+        {'邮件名称': 'RE: Lost thread', '发件人': 'amy@vendor.com', '收件人': 'carol@corp.com; dave@partner.cn',
+         '发送时间': datetime(2024, 4, 1), '邮件消息标识': '<l1@vendor.com>'},
+        {'邮件名称': None, '发件人': 'x@corp.com', '收件人': 'y@corp.com', '邮件消息标识': '<n1@corp.com>'},
+    ]
+    titles = [row['邮件名称'] for row in rows]
+
+    analyzer = TestEmailRelationshipAnalyzer()
+    analyzer.required_columns = REQUIRED_COLUMNS
+    analyzer.process_chunk(pd.DataFrame([row for row in rows if row['邮件名称']]))
+    analyzer.process_pending_replies()
+    expected_keys = defaultdict(set)
+    for key, items in analyzer.relationships.items():
+        for item in items:
+            expected_keys[item[3]].add(key)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        searcher = ExcelSearcher(_write_workbook(os.path.join(tmp_dir, 'a.xlsx'), rows))
+        index = searcher.get_thread_index()
+        subjects = [normalize_subject(title) if title else None for title in titles]
+        for position, subject in enumerate(subjects):
+            assert index.subject_of(position) == subject, position
+            expected = [other for other, value in enumerate(subjects) if subject and value == subject] or [position]
+            assert index.thread_positions(position).tolist() == expected, position
+            assert bool(index.reply_flags[position]) == bool(titles[position] and is_reply(titles[position]))
+        assert index.subject_positions('Weekly').tolist() == [5, 6, 7, 8]
+        assert index.subject_positions('missing').tolist() == []
+
+        for position, row in enumerate(rows):
+            conversation = searcher.conversation(position + 2)
+            assert set(conversation['relationship_keys']) == expected_keys[row['邮件消息标识']], \
+                (row['邮件消息标识'], conversation['relationship_keys'])
+            assert [item['row_index'] for item in conversation['rows']] == \
+                [other + 2 for other in index.thread_positions(position).tolist()]
+        weekly = searcher.conversation(7)
+        assert weekly['subject'] == 'Weekly' and weekly['relationship_keys'] == ['john@corp.com#Weekly#client.com']
+        assert [item['is_reply'] for item in weekly['rows']] == [False, True, False, True]
+        for row_index in (1, len(rows) + 2):
+            try:
+                searcher.conversation(row_index)
+                raise AssertionError(f"行号 {row_index} 应当超出范围")
+            except IndexError:
+                pass
+
+        save_thread_index(index, tmp_dir)
+        loaded = load_thread_index(tmp_dir)
+        assert loaded.subjects == index.subjects
+        assert loaded.positions.tolist() == index.positions.tolist() and loaded.indptr.tolist() == index.indptr.tolist()
+        assert load_thread_index(os.path.join(tmp_dir, 'missing')) is None
+
+    # 标准化后为空的主题不属于任何会话
+    empty = ThreadIndex.build(pd.Series(['  ', 'nan', 'A', 'RE: A']))
+    assert empty.subjects == ['A'] and empty.codes.tolist() == [-1, -1, 0, 0]
+    assert empty.thread_positions(0).tolist() == [0] and empty.thread_positions(3).tolist() == [2, 3]
+    logger.info("会话索引的检查通过")
+
+def check_query_language():
+    """查询语句：解析的优先级和字段限定、语法错误、按代价排序的执行计划与查询结果"""
+    import tempfile
+    from excel_searcher import ExcelSearcher
+    from query_language import parse_query, QueryPlanner, QuerySyntaxError, Term, And, Or, Not
+
+    fields = ['邮件名称', '发件人', '收件人', '邮件文本正文']
+    a, b, c = (Term(None, value, False) for value in 'abc')
+    assert parse_query('a b OR c', fields) == Or((And((a, b)), c))
+    assert parse_query('NOT a AND (b OR c)', fields) == And((Not(a), Or((b, c))))
+    assert parse_query('发件人:"Bob  Smith" 收件人:@Client*', fields) == \
+        And((Term('发件人', 'bob  smith', False), Term('收件人', '@client', True)))
+    # 短语中的关键字是搜索内容；冒号前不是列名时冒号是搜索内容的一部分
+    assert parse_query('"AND OR"', fields) == Term(None, 'and or', False)
+    assert parse_query('http://example.com', fields) == Term(None, 'http://example.com', False)
+    for query in ['', '   ', '(a', 'a)', 'AND a', 'a OR', '""', '发件人:""']:
+        try:
+            parse_query(query, fields)
+            raise AssertionError(f"应当报语法错误: {query!r}")
+        except QuerySyntaxError:
+            pass
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        searcher = ExcelSearcher(_write_workbook(os.path.join(tmp_dir, 'a.xlsx'), _sample_email_rows()))
+
+        def rows(query):
+            return [result['row_index'] for result in searcher.query_search(query)]
+
+        assert rows('发件人:@corp.com') == [2, 5]
+        assert rows('发件人:@corp.com AND 报价') == [5]
+        assert rows('报价 OR ship') == [3, 4, 5]
+        assert rows('quote NOT 邮件名称:"RE:"') == [2]
+        assert rows('发件人:bob*') == [3]
+        assert rows('"price quote" attached') == [3]
+        assert rows('(报价 OR ship) AND NOT 发件人:dave*') == [3, 4, 5]
+        assert rows('nothing-matches') == []
+
+        # AND、OR的子条件按估算代价从小到大执行
+        planner = QueryPlanner(searcher)
+        plan = planner.compile(parse_query('邮件文本正文:price AND 发件人:bob AND quote', searcher.get_columns()))
+        costs = [child.cost for child in plan.children]
+        assert costs == sorted(costs), costs
+
+        # 没有开启DEBUG日志时不生成计划的文本表示
+        def explain(*args, **kwargs):
+            raise AssertionError("不应生成查询计划文本")
+
+        planner.explain = explain
+        try:
+            assert planner.run('发件人:@corp.com').tolist() == [0, 3]
+        finally:
+            del planner.explain
+    logger.info("查询语句的检查通过")
+
+def check_workbook_store():
+    """按内容哈希存放：重复内容只保存一份，解析结果可以重新加载，淘汰时跳过正在使用的工作簿"""
+    import io
+    import tempfile
+    import pandas as pd
+    from excel_searcher import ExcelSearcher
+    from workbook_store import WorkbookStore, load_columns
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_use = set()
+        store = WorkbookStore(os.path.join(tmp_dir, 'store'), keep=2, in_use=lambda: in_use)
+        workbook = _write_workbook(os.path.join(tmp_dir, 'a.xlsx'), _sample_email_rows())
+        with open(workbook, 'rb') as f:
+            content = f.read()
+
+        path, sha256 = store.add_stream(io.BytesIO(content), '.XLSX')
+        assert path.endswith('.xlsx') and store.find(sha256) == path
+        assert store.add_stream(io.BytesIO(content), '.xlsx') == (path, sha256)
+        assert os.listdir(store.root_dir) == [sha256], "同一内容只保存一份"
+
+        # 第一次加载时解析并写入列式缓存、全文索引和会话索引，再次加载时直接读取
+        searcher = ExcelSearcher(path, workbook_hash=sha256, artifact_dir=store.workbook_dir(sha256))
+        assert store.is_parsed(sha256)
+        expected_hits = searcher.fulltext_search('price quote')
+        expected_thread = searcher.conversation(2)
+        reloaded = ExcelSearcher(path, workbook_hash=sha256, artifact_dir=store.workbook_dir(sha256))
+        pd.testing.assert_frame_equal(load_columns(store.workbook_dir(sha256)), searcher.df)
+        assert reloaded.fulltext_search('price quote') == expected_hits
+        assert reloaded.conversation(2) == expected_thread
+
+        # 当前工作簿正在使用：之后加入的工作簿再多也不删除它
+        in_use.add(sha256)
+        added = []
+        for i in range(4):
+            added.append(store.add_stream(io.BytesIO(content + bytes([i])), '.xlsx')[1])
+            os.utime(store.workbook_dir(added[-1]), (1000 + i, 1000 + i))
+        assert store.find(sha256) == path
+        assert sorted(os.listdir(store.root_dir)) == sorted([sha256, added[-1]]), os.listdir(store.root_dir)
+
+        # 不再使用后按最近使用时间淘汰
+        in_use.clear()
+        store.touch(added[-1])
+        store.add_stream(io.BytesIO(content + b'new'), '.xlsx')
+        assert store.find(sha256) is None and store.find(added[-1]) is not None
+    logger.info("工作簿存放的检查通过")
+
+def _shuffled_thread_rows(subjects=300, seed=7):
+    """同一主题先后发给两个收件人，各自回复；行的顺序随机打乱，部分原始邮件排在其回复之后的数据块中"""
+    import random
+    from datetime import datetime, timedelta
+    rows = []
+    for i in range(subjects):
+        sender = f'user{i % 40}@corp{i % 5}.com'
+        for batch in range(2):
+            recipient = f'peer{(i * 7 + batch) % 60}@client{(i + batch) % 9}.com'
+            sent = datetime(2024, 1, 1) + timedelta(hours=i, minutes=30 * batch)
+            rows.append({'邮件名称': f'Order {i}', '发件人': sender, '收件人': recipient,
+                         '邮件消息标识': f'<o{i}-{batch}@corp.com>', '发送时间': sent})
+            rows.append({'邮件名称': f'RE: Order {i}', '发件人': recipient, '收件人': sender,
+                         '邮件消息标识': f'<r{i}-{batch}@client.com>', '发送时间': sent + timedelta(minutes=10)})
+    random.Random(seed).shuffle(rows)
+    return rows
+
+def check_external_mode():
+    """外部排序归并模式的结果与行的顺序无关；打乱顺序的工作簿上默认模式会漏掉部分关系（两种模式可以不同）"""
+    import tempfile
+    import email_analyzer
+
+    rows = _shuffled_thread_rows()
+    # 每封原始邮件与其收件人的回复构成一个关系：发件人#主题#收件人域名
+    expected = {}
+    originals = {row['邮件消息标识']: row for row in rows if not row['邮件名称'].startswith('RE:')}
+    for row in rows:
+        original = originals[row['邮件消息标识'].replace('<r', '<o').replace('@client', '@corp')]
+        recipient = original['收件人']
+        key = f"{original['发件人']}#{original['邮件名称']}#{recipient.split('@')[1]}"
+        expected.setdefault(key, set()).add(
+            (original['发件人'], original['邮件名称'], recipient.split('@')[0], row['邮件消息标识']))
+
+    def relationships(path, external):
+        analyzer = email_analyzer.EmailRelationshipAnalyzer(path, external=external)
+        analyzer.analyze()
+        return analyzer, {key: {item[:4] for item in items} for key, items in analyzer.relationships.items()}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shuffled = _write_workbook(os.path.join(tmp_dir, 'shuffled.xlsx'), rows)
+        in_order = _write_workbook(os.path.join(tmp_dir, 'sorted.xlsx'),
+                                   sorted(rows, key=lambda row: row['发送时间']))
+        # 每个有序run只有几百行，归并时需要跨多个run
+        chunksize, email_analyzer.EXTERNAL_CHUNKSIZE = email_analyzer.EXTERNAL_CHUNKSIZE, 250
+        try:
+            _, external_shuffled = relationships(shuffled, True)
+            _, external_sorted = relationships(in_order, True)
+        finally:
+            email_analyzer.EXTERNAL_CHUNKSIZE = chunksize
+        assert external_shuffled == expected
+        assert external_sorted == expected
+
+        # 默认模式按1000行的数据块处理：按时间排序时结果相同，打乱后漏掉的回复记为找不到原始邮件
+        _, regular_sorted = relationships(in_order, False)
+        assert regular_sorted == expected
+        analyzer, regular_shuffled = relationships(shuffled, False)
+        missing = sum(len(items - regular_shuffled.get(key, set())) for key, items in expected.items())
+        unmatched = sum(error['count'] for error in analyzer.unknown_data['processing_errors'].to_list()
+                        if error['error'] == '找不到对应的原始邮件')
+        assert missing > 0 and missing == unmatched == analyzer.stats['replies_unmatched'], (missing, unmatched)
+        assert all(items <= expected[key] for key, items in regular_shuffled.items())
+    logger.info("外部排序归并模式的检查通过")
+
+def check_concurrency_limiter():
+    """上传、搜索和查看会话占用并发名额，超出的请求排队，队列满或排队超时返回503；页面和统计接口不受限制"""
+    import asyncio
+    import tempfile
+
+    # 导入服务模块时会在当前目录下创建上传目录
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            from asgi import ConcurrencyLimiter, is_limited
+        finally:
+            os.chdir(cwd)
+
+    assert is_limited('POST', '/search') and is_limited('PUT', '/upload/chunk/abc/0')
+    assert is_limited('GET', '/thread/12')
+    assert not is_limited('GET', '/') and not is_limited('GET', '/threads') and not is_limited('GET', '/cache/stats')
+
+    async def run():
+        release = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            if scope['path'] != '/':
+                await release.wait()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+        async def request(limiter, method, path):
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            await limiter({'type': 'http', 'method': method, 'path': path}, receive, send)
+            body = b''.join(message.get('body', b'') for message in messages[1:])
+            return messages[0]['status'], dict(messages[0]['headers']), body
+
+        limiter = ConcurrencyLimiter(slow_app, max_concurrent=1, max_queue=1, queue_timeout=5)
+        running = asyncio.create_task(request(limiter, 'PUT', '/upload/chunk/abc/0'))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(request(limiter, 'POST', '/search'))
+        await asyncio.sleep(0.01)
+        assert (limiter.active, limiter.waiting) == (1, 1)
+
+        # 队列已满：查看会话直接被拒绝，页面请求不占名额
+        status, headers, body = await request(limiter, 'GET', '/thread/3')
+        assert status == 503 and headers[b'retry-after'] == b'5', (status, body)
+        assert (await request(limiter, 'GET', '/'))[0] == 200
+        status, _, body = await request(limiter, 'GET', '/server/stats')
+        assert status == 200 and json.loads(body) == {
+            'active': 1, 'waiting': 1, 'rejected': 1, 'max_concurrent': 1, 'max_queue': 1, 'queue_timeout': 5
+        }, body
+
+        release.set()
+        assert (await running)[0] == 200 and (await queued)[0] == 200
+        assert (limiter.active, limiter.waiting) == (0, 0)
+
+        # 排队超时
+        release.clear()
+        limiter = ConcurrencyLimiter(slow_app, max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        running = asyncio.create_task(request(limiter, 'POST', '/export'))
+        await asyncio.sleep(0.01)
+        status, _, body = await request(limiter, 'POST', '/search')
+        assert status == 503 and '排队超过' in body.decode('utf-8') and limiter.rejected == 1
+        release.set()
+        assert (await running)[0] == 200 and limiter.waiting == 0
+
+    asyncio.run(run())
+    logger.info("并发限制的检查通过")
+
+def check_analysis_metrics():
+    """运行指标：计数、耗时分位数和速度，JSON与Prometheus文本格式输出"""
+    import tempfile
+    from metrics import AnalysisMetrics, to_prometheus
+
+    metrics = AnalysisMetrics(latency_window=4)
+    assert metrics.snapshot()['state'] == 'pending' and metrics.snapshot()['chunk_latency_ms']['p50'] is None
+    metrics.start()
+    metrics.set_phase('处理数据块')
+    for seconds in (0.5, 0.1, 0.2, 0.3, 0.4):
+        metrics.chunk_done(100, seconds, pending_replies=3)
+    metrics.update(relationships=7)
+    snapshot = metrics.snapshot()
+    assert snapshot['rows_processed'] == 500 and snapshot['chunks_processed'] == 5
+    assert snapshot['chunk_seconds_total'] == 1.5 and snapshot['recent_rows_per_second'] == round(500 / 1.5, 1)
+    # 分位数只看最近4个数据块
+    assert snapshot['chunk_latency_ms'] == {'p50': 250.0, 'p90': 370.0, 'p99': 397.0, 'max': 400.0}, snapshot
+    assert (snapshot['phase'], snapshot['pending_replies'], snapshot['relationships']) == ('处理数据块', 3, 7)
+    metrics.finish(ValueError('坏数据'), pending_replies=0)
+    snapshot = metrics.snapshot()
+    assert (snapshot['state'], snapshot['error'], snapshot['pending_replies']) == ('failed', '坏数据', 0)
+
+    text = to_prometheus(snapshot, {'job_id': 'a"b\nc'})
+    assert 'email_analysis_rows_processed_total{job_id="a\\"b\\nc"} 500' in text, text
+    assert 'email_analysis_chunk_latency_seconds{job_id="a\\"b\\nc",quantile="0.5"} 0.25' in text
+    assert 'email_analysis_chunk_latency_seconds_count{job_id="a\\"b\\nc"} 5' in text
+    assert 'email_analysis_running{job_id="a\\"b\\nc"} 0' in text
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metrics.write(os.path.join(tmp_dir, 'metrics.json'))
+        metrics.write(os.path.join(tmp_dir, 'metrics.prom'))
+        with open(os.path.join(tmp_dir, 'metrics.json'), encoding='utf-8') as f:
+            saved = json.load(f)
+        assert {key: value for key, value in saved.items() if key != 'rss_bytes'} == \
+            {key: value for key, value in snapshot.items() if key != 'rss_bytes'}
+        with open(os.path.join(tmp_dir, 'metrics.prom'), encoding='utf-8') as f:
+            assert f.read().startswith('# HELP email_analysis_rows_processed_total')
+        assert sorted(os.listdir(tmp_dir)) == ['metrics.json', 'metrics.prom']
+    logger.info("运行指标的检查通过")
+
+def check_analysis_jobs():
+    """分析任务在子进程中运行：成功、失败、取消的状态，同时运行数量上限，重启后仍能查询，只保留最近的已结束任务"""
+    import time
+    import tempfile
+    from analysis_jobs import AnalysisJobManager, JobError, JobNotFound
+
+    def expect_error(error, func, *args):
+        try:
+            func(*args)
+        except error as e:
+            return e
+        raise AssertionError(f"{func.__name__}{args} 应当失败")
+
+    def wait(manager, job_id, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = manager.status(job_id)
+            if status['state'] != 'running':
+                return status
+            time.sleep(0.2)
+        raise AssertionError(f"任务 {job_id} 没有在 {timeout} 秒内结束")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workbook = _write_workbook(os.path.join(tmp_dir, 'a.xlsx'), _sample_email_rows())
+        manager = AnalysisJobManager(os.path.join(tmp_dir, 'jobs'), max_running=1, keep=2)
+
+        job = manager.start(workbook, 'a.xlsx')
+        assert job['state'] == 'running' and job['filename'] == 'a.xlsx'
+        # 已有任务在运行
+        expect_error(JobError, manager.start, workbook, 'b.xlsx')
+        expect_error(JobError, manager.output_path, job['job_id'], 'relationships')
+        status = wait(manager, job['job_id'])
+        assert status['state'] == 'succeeded' and status['error'] is None, status
+        assert status['metrics']['rows_processed'] == 5 and status['metrics']['relationships'] == 4, status['metrics']
+        with open(manager.output_path(job['job_id'], 'relationships'), encoding='utf-8') as f:
+            assert sorted(json.load(f)) == sorted([
+                'john@corp.com#Quote request#client.com', 'john@corp.com#Quote request#vendor.com',
+                'carol@corp.com#会议通知#partner.cn', 'amy@vendor.com#quote request#corp.com'
+            ])
+        assert os.path.exists(manager.output_path(job['job_id'], 'errors'))
+        assert f'email_analysis_running{{job_id="{job["job_id"]}"}} 0' in manager.metrics_text(job['job_id'])
+        expect_error(JobNotFound, manager.output_path, job['job_id'], 'analyzer.log')
+        for job_id in ('x', '../' + job['job_id'], '0' * 32):
+            expect_error(JobNotFound, manager.status, job_id)
+
+        # 输入文件不存在：分析失败
+        failed = wait(manager, manager.start(os.path.join(tmp_dir, 'missing.xlsx'), 'missing.xlsx')['job_id'])
+        assert failed['state'] == 'failed' and failed['error'], failed
+        expect_error(JobError, manager.output_path, failed['job_id'], 'relationships')
+
+        cancelled = manager.start(workbook, 'a.xlsx', external=True)
+        assert manager.cancel(cancelled['job_id'])['state'] == 'cancelled'
+        expect_error(JobError, manager.cancel, cancelled['job_id'])
+
+        # 服务重启后由任务目录恢复；只保留最近的2个已结束任务（开始新任务时清理）
+        restarted = AnalysisJobManager(manager.root_dir, max_running=1, keep=2)
+        assert [item['job_id'] for item in restarted.list()] == \
+            [cancelled['job_id'], failed['job_id'], job['job_id']]
+        assert restarted.status(job['job_id'])['state'] == 'succeeded'
+        latest = restarted.start(workbook, 'a.xlsx')
+        assert wait(restarted, latest['job_id'])['state'] == 'succeeded'
+        assert [item['job_id'] for item in restarted.list()] == \
+            [latest['job_id'], cancelled['job_id'], failed['job_id']]
+    logger.info("分析任务的检查通过")
+
+def check_chunked_upload():
+    """分片上传：大小上限、必须带校验和、损坏的分片不算收到、乱序上传后整个文件的哈希正确"""
+    import io
+    import hashlib
+    import tempfile
+    from chunked_upload import ChunkedUploadStore, UploadError, UploadNotFound, MIN_CHUNK_SIZE
+
+    content = os.urandom(MIN_CHUNK_SIZE * 2 + 1000)
+    chunks = [content[i:i + MIN_CHUNK_SIZE] for i in range(0, len(content), MIN_CHUNK_SIZE)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = ChunkedUploadStore(tmp_dir, max_size=len(content))
+
+        def expect_error(func, *args):
+            try:
+                func(*args)
+            except UploadError as e:
+                return e
+            raise AssertionError(f"{func.__name__}{args[:2]} 应当失败")
+
+        expect_error(store.init, 'big.xlsx', len(content) + 1, MIN_CHUNK_SIZE)
+        assert not os.listdir(tmp_dir), "超过上限的会话不应创建数据文件"
+        session = store.init('a.xlsx', len(content), MIN_CHUNK_SIZE)
+        upload_id = session['upload_id']
+        assert session['missing'] == [0, 1, 2]
+
+        # 缺少校验和、校验和不匹配、大小不正确的分片都不算收到
+        expect_error(store.write_chunk, upload_id, 0, io.BytesIO(chunks[0]), None)
+        expect_error(store.write_chunk, upload_id, 0, io.BytesIO(chunks[0][::-1]), hashlib.sha256(chunks[0]).hexdigest())
+        expect_error(store.write_chunk, upload_id, 2, io.BytesIO(chunks[2] + b'x'), hashlib.sha256(chunks[2] + b'x').hexdigest())
+        expect_error(store.write_chunk, upload_id, 3, io.BytesIO(b''), hashlib.sha256(b'').hexdigest())
+        assert store.status(upload_id)['missing'] == [0, 1, 2]
+        assert isinstance(expect_error(store.status, 'x' * 32), UploadNotFound)
+
+        for index in (2, 0):
+            store.write_chunk(upload_id, index, io.BytesIO(chunks[index]), hashlib.sha256(chunks[index]).hexdigest().upper())
+        expect_error(store.complete, upload_id)
+        # 续传：用新的存储对象（相当于服务重启）查询缺失的分片
+        resumed = ChunkedUploadStore(tmp_dir, max_size=len(content))
+        assert resumed.status(upload_id)['missing'] == [1]
+        resumed.write_chunk(upload_id, 1, io.BytesIO(chunks[1]), hashlib.sha256(chunks[1]).hexdigest())
+
+        result = resumed.complete(upload_id)
+        assert result['sha256'] == hashlib.sha256(content).hexdigest()
+        with open(result['path'], 'rb') as f:
+            assert f.read() == content
+    logger.info("分片上传的检查通过")
+
 def main():
     """运行测试"""
+    check_mixed_case_addresses()
+    check_domain_analyzer()
+    check_domain_graph()
+    check_subject_index()
+    check_relationship_store()
+    check_original_timeline()
+    check_message_id_set()
+    check_xlsx_reader()
+    check_external_mode()
+    check_chunked_upload()
+    check_concurrency_limiter()
+    check_analysis_metrics()
+    check_analysis_jobs()
+    check_searcher_columns()
+    check_fulltext_index()
+    check_search_cache()
+    check_result_export()
+    check_federated_searcher()
+    check_thread_index()
+    check_query_language()
+    check_workbook_store()
+    
     try:
         # 初始化测试分析器
         analyzer = TestEmailRelationshipAnalyzer()
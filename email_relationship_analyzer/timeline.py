@@ -0,0 +1,60 @@
+from bisect import bisect_right
+
+from ingest import MISSING_TS
+
+
+class OriginalTimeline:
+    """同一主题的原始邮件，按发送时间（int64时间戳）保持有序
+
+    times 与 records 一一对应，回复邮件用二分查找定位到自己发送时间之前的最后一封原始邮件，
+    从那里向前找收件人包含回复者的原始邮件，这样多次重发的群发邮件会归到最近的一次。
+    """
+
+    def __init__(self, records=()):
+        self.times = []
+        self.records = []
+        self.extend(records)
+
+    def add(self, record):
+        """按发送时间插入一封原始邮件，时间相同的保持加入顺序"""
+        ts = record.send_ts
+        if not self.times or ts >= self.times[-1]:
+            self.times.append(ts)
+            self.records.append(record)
+            return
+        i = bisect_right(self.times, ts)
+        self.times.insert(i, ts)
+        self.records.insert(i, record)
+
+    def extend(self, records):
+        for record in sorted(records, key=lambda record: record.send_ts):
+            self.add(record)
+
+    def find(self, replier, send_ts):
+        """
+        查找回复者所回复的原始邮件
+
+        优先取发送时间不晚于回复的最后一封收件人包含回复者的原始邮件；
+        没有时（时间缺失或数据中回复早于原始邮件）退回到按时间顺序的第一封匹配邮件。
+
+        Args:
+            replier: 回复者地址
+            send_ts: 回复邮件的int64时间戳
+
+        Returns:
+            EmailRecord: 匹配的原始邮件，找不到时返回None
+        """
+        end = bisect_right(self.times, send_ts) if send_ts != MISSING_TS else 0
+        for i in range(end - 1, -1, -1):
+            if replier in self.records[i].recipient_set:
+                return self.records[i]
+        for i in range(end, len(self.records)):
+            if replier in self.records[i].recipient_set:
+                return self.records[i]
+        return None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
@@ -24,7 +24,7 @@ def normalize_subject(subject):
     
     # 如果标准化后的主题为空，使用原始主题
     if not cleaned_subject:
-        logger.warning(f"标准化后主题为空，使用原始主题: {subject}")
+        logger.debug("标准化后主题为空，使用原始主题: %s", subject)
         return subject.strip()
         
     return cleaned_subject
@@ -51,11 +51,9 @@ def is_reply(subject):
     """判断是否为回复邮件"""
     if not isinstance(subject, str):
         return False
-        
-    for pattern in PREFIX_PATTERNS:
-        if pattern.match(subject.strip()):
-            return True
-    return False
+    
+    # 通用复合前缀模式包含了所有单个前缀和复合前缀，匹配它即等价于逐个尝试全部前缀
+    return PREFIX_PATTERNS[-1].match(subject.strip()) is not None
 
 def validate_file(file_path):
     """验证文件是否存在并获取文件信息"""
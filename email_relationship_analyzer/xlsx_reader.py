@@ -0,0 +1,346 @@
+import io
+import os
+import re
+import logging
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+try:
+    from lxml.etree import iterparse
+except ImportError:  # lxml是可选依赖，没有时使用标准库的解析器
+    from xml.etree.ElementTree import iterparse
+
+logger = logging.getLogger(__name__)
+
+# 每个解析任务的解压后XML大小
+BLOCK_SIZE = 8 << 20
+# 从压缩包中读取sheet XML时每次解压的大小
+READ_SIZE = 1 << 20
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# 内置的日期/时间数字格式ID（含中日韩区域设置下的日期格式）
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+# 自定义格式中去掉引号内文字、方括号（颜色、区域、经过时间等）和转义字符后再判断是否含日期时间占位符
+_FORMAT_NOISE_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.|_.|\*.')
+_DATE_TOKEN_RE = re.compile(r'[dmyhs]', re.IGNORECASE)
+_CELL_COLUMN_RE = re.compile(r'[A-Z]+')
+
+# 与 pd.read_excel 默认视为缺失值的字符串保持一致
+NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+# 解析单元格需要的工作簿级数据：共享字符串表、日期样式下标、日期序列号的起点
+WorkbookTables = namedtuple('WorkbookTables', ['shared_strings', 'date_styles', 'epoch'])
+
+# 只在进程池的工作进程中使用，由初始化函数设置一次；主进程中解析时显式传入，
+# 并发读取多个工作簿（服务的线程池、联合搜索添加工作簿）时不会互相覆盖
+_worker_tables: Optional[WorkbookTables] = None
+
+
+def _init_worker(tables: WorkbookTables):
+    global _worker_tables
+    _worker_tables = tables
+
+
+def _parse_block_in_worker(xml: bytes, wanted: Optional[frozenset]) -> Tuple[List[int], Dict[int, List]]:
+    """工作进程中的解析任务，使用初始化时传入的工作簿数据"""
+    return _parse_block(xml, wanted, _worker_tables)
+
+
+def _column_index(cell_ref: str) -> int:
+    """A -> 0, B -> 1, ..., AA -> 26"""
+    index = 0
+    for char in _CELL_COLUMN_RE.match(cell_ref).group():
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _text(elem) -> str:
+    """取出 <si> 或 <is> 中所有 <t> 的文字，忽略注音（rPh）"""
+    parts = []
+    for child in elem:
+        tag = child.tag.rsplit('}', 1)[-1]
+        if tag == 't':
+            parts.append(child.text or '')
+        elif tag == 'r':
+            for run_child in child:
+                if run_child.tag.rsplit('}', 1)[-1] == 't':
+                    parts.append(run_child.text or '')
+    return ''.join(parts)
+
+
+def _cell_value(cell, tables: WorkbookTables):
+    """按单元格类型转换为Python值"""
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        for child in cell:
+            if child.tag.rsplit('}', 1)[-1] == 'is':
+                return _text(child)
+        return None
+
+    raw = None
+    for child in cell:
+        if child.tag.rsplit('}', 1)[-1] == 'v':
+            raw = child.text
+            break
+    if raw is None:
+        return None
+
+    if cell_type == 's':
+        return tables.shared_strings[int(raw)]
+    if cell_type == 'str':
+        return raw
+    if cell_type == 'b':
+        return raw == '1'
+    if cell_type == 'e':
+        return None
+    if cell_type == 'd':
+        return datetime.fromisoformat(raw)
+
+    style = cell.get('s')
+    if style is not None and int(style) in tables.date_styles:
+        # 与openpyxl一致：整数部分为天数，小数部分四舍五入到毫秒
+        day, fraction = divmod(float(raw), 1)
+        return tables.epoch + timedelta(days=day, milliseconds=round(fraction * 86400000))
+    if '.' in raw or 'E' in raw or 'e' in raw:
+        value = float(raw)
+        return int(value) if value.is_integer() and abs(value) < 2 ** 53 else value
+    return int(raw)
+
+
+def _parse_block(xml: bytes, wanted: Optional[frozenset],
+                 tables: WorkbookTables) -> Tuple[List[int], Dict[int, List]]:
+    """
+    解析一段包含若干 <row> 的XML
+
+    Args:
+        xml: 补齐了 worksheet/sheetData 首尾标签的XML片段
+        wanted: 需要保留的列下标，None表示全部
+        tables: 共享字符串表、日期样式等工作簿级数据
+
+    Returns:
+        tuple: (行号列表, 列下标 -> 与行号对齐的值列表)
+    """
+    row_numbers: List[int] = []
+    columns: Dict[int, List] = {}
+    row_count = 0
+    values: Dict[int, object] = {}
+    next_column = 0
+    for _, elem in iterparse(io.BytesIO(xml), events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'c':
+            ref = elem.get('r')
+            column = _column_index(ref) if ref else next_column
+            next_column = column + 1
+            if wanted is None or column in wanted:
+                value = _cell_value(elem, tables)
+                if value is not None and not (isinstance(value, str) and value in NA_VALUES):
+                    values[column] = value
+        elif tag == 'row':
+            # 空行与 pd.read_excel 一样跳过
+            if values:
+                for column, value in values.items():
+                    if column not in columns:
+                        columns[column] = [None] * row_count
+                    columns[column].append(value)
+                row_count += 1
+                for column_values in columns.values():
+                    if len(column_values) < row_count:
+                        column_values.append(None)
+                number = elem.get('r')
+                row_numbers.append(int(number) if number else -1)
+                values = {}
+            next_column = 0
+            elem.clear()
+    return row_numbers, columns
+
+
+def _load_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, elem in iterparse(f, events=('end',)):
+            if elem.tag == MAIN_NS + 'si':
+                strings.append(_text(elem))
+                elem.clear()
+    return strings
+
+
+def _is_date_format(format_code: str) -> bool:
+    code = _FORMAT_NOISE_RE.sub('', format_code.split(';')[0])
+    return code.lower() != 'general' and bool(_DATE_TOKEN_RE.search(code))
+
+
+def _load_date_styles(archive: zipfile.ZipFile) -> frozenset:
+    """返回数字格式为日期/时间的单元格样式下标"""
+    if 'xl/styles.xml' not in archive.namelist():
+        return frozenset()
+    custom_formats = {}
+    date_styles = set()
+    with archive.open('xl/styles.xml') as f:
+        in_cell_xfs = False
+        style_index = 0
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if elem.tag == MAIN_NS + 'numFmt' and event == 'end':
+                custom_formats[int(elem.get('numFmtId'))] = elem.get('formatCode', '')
+            elif elem.tag == MAIN_NS + 'cellXfs':
+                in_cell_xfs = event == 'start'
+            elif elem.tag == MAIN_NS + 'xf' and event == 'end' and in_cell_xfs:
+                format_id = int(elem.get('numFmtId', 0))
+                if format_id in custom_formats:
+                    if _is_date_format(custom_formats[format_id]):
+                        date_styles.add(style_index)
+                elif format_id in BUILTIN_DATE_FORMATS:
+                    date_styles.add(style_index)
+                style_index += 1
+    return frozenset(date_styles)
+
+
+def _first_sheet(archive: zipfile.ZipFile) -> Tuple[str, datetime]:
+    """返回第一个工作表在压缩包中的路径，以及日期序列号的起点（1900或1904日期系统）"""
+    from xml.etree.ElementTree import fromstring
+
+    workbook = fromstring(archive.read('xl/workbook.xml'))
+    properties = workbook.find(MAIN_NS + 'workbookPr')
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+
+    sheet = workbook.find(f'{MAIN_NS}sheets/{MAIN_NS}sheet')
+    relationships = fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relationship in relationships.iter(PKG_REL_NS + 'Relationship'):
+        if sheet is not None and relationship.get('Id') == sheet.get(REL_NS + 'id'):
+            target = relationship.get('Target')
+            if target.startswith('/'):
+                return target.lstrip('/'), epoch
+            return posixpath.normpath(posixpath.join('xl', target)), epoch
+    return 'xl/worksheets/sheet1.xml', epoch
+
+
+def _iter_row_blocks(stream, block_size: int):
+    """
+    流式解压sheet XML，按 </row> 边界切分为若干块
+
+    Yields:
+        bytes: 第一项为补齐用的文档头（到 <sheetData> 为止），之后为只含完整 <row> 的XML片段
+    """
+    buffer = b''
+    header = None
+    end_tag = b'</row>'
+    while True:
+        data = stream.read(READ_SIZE)
+        buffer += data
+        if header is None:
+            match = re.search(rb'<(\w+:)?sheetData(\s[^>]*?)?(/?)>', buffer)
+            if match is None:
+                if not data:
+                    return
+                continue
+            if match.group(3):  # <sheetData/>，没有数据
+                return
+            prefix = match.group(1) or b''
+            end_tag = b'</' + prefix + b'row>'
+            header = buffer[:match.end()]
+            yield header, prefix
+            buffer = buffer[match.end():]
+
+        if len(buffer) >= block_size or not data:
+            cut = buffer.rfind(end_tag)
+            if cut >= 0:
+                cut += len(end_tag)
+                yield buffer[:cut], None
+                buffer = buffer[cut:]
+        if not data:
+            return
+
+
+def read_xlsx(file_path: str, usecols: Union[Sequence[str], Callable[[str], bool], None] = None,
+              processes: Optional[int] = None, block_size: int = BLOCK_SIZE, dtype=None) -> pd.DataFrame:
+    """
+    并行读取工作簿的第一个工作表，得到与 pd.read_excel 相同形状的DataFrame
+
+    sheet XML 在解压时按 </row> 边界切分为多个片段，在多个进程中用流式解析器（有lxml时用lxml）
+    并行解析，共享字符串表和日期样式只在主进程加载一次并传给工作进程，最后按列拼接。
+    不是 .xlsx/.xlsm 文件（如 .xls）时退回 pd.read_excel。
+
+    Args:
+        file_path: Excel文件路径
+        usecols: 需要的列名列表，或对列名返回是否保留的函数；None表示全部
+        processes: 工作进程数，默认使用全部CPU核心
+        block_size: 每个解析任务的XML大小（字节）
+        dtype: 传object时保持原始Python值，不做类型推断
+
+    Returns:
+        pd.DataFrame: 第一行为列名，空行已跳过
+    """
+    if not zipfile.is_zipfile(file_path):
+        return pd.read_excel(file_path, usecols=usecols, dtype=dtype)
+
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_path, epoch = _first_sheet(archive)
+        tables = WorkbookTables(_load_shared_strings(archive), _load_date_styles(archive), epoch)
+
+        with archive.open(sheet_path) as stream:
+            blocks = _iter_row_blocks(stream, block_size)
+            first = next(blocks, None)
+            if first is None:
+                return pd.DataFrame()
+            header, prefix = first
+            footer = b'</' + prefix + b'sheetData></' + prefix + b'worksheet>'
+            documents = (header + block + footer for block, _ in blocks)
+
+            # 第一块在主进程中解析，由表头确定需要的列，再把其余块交给进程池
+            first_block = next(documents, None)
+            if first_block is None:
+                return pd.DataFrame()
+            parts = [_parse_block(first_block, None, tables)]
+            row_numbers, columns = parts[0]
+            if not row_numbers:
+                return pd.DataFrame()
+            header_row = {column: values[0] for column, values in columns.items() if values[0] is not None}
+            names = {column: str(name) for column, name in sorted(header_row.items())}
+            if usecols is not None:
+                keep = usecols if callable(usecols) else set(usecols).__contains__
+                names = {column: name for column, name in names.items() if keep(name)}
+            wanted = frozenset(names)
+
+            workers = processes or os.cpu_count() or 1
+            if workers > 1:
+                with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(tables,)) as pool:
+                    pending = []
+                    for document in documents:
+                        pending.append(pool.submit(_parse_block_in_worker, document, wanted))
+                        # 控制在途任务数量，避免整份XML同时驻留内存
+                        if len(pending) >= workers * 2:
+                            parts.append(pending.pop(0).result())
+                    parts.extend(future.result() for future in pending)
+            else:
+                parts.extend(_parse_block(document, wanted, tables) for document in documents)
+
+    # 去掉表头行后按列拼接
+    data = {}
+    for column, name in names.items():
+        values = []
+        for i, (part_rows, part_columns) in enumerate(parts):
+            column_values = part_columns.get(column)
+            if column_values is None:
+                column_values = [None] * len(part_rows)
+            values.extend(column_values[1:] if i == 0 else column_values)
+        data[name] = values
+
+    total_rows = sum(len(part_rows) for part_rows, _ in parts) - 1
+    logger.info(f"并行解析 {file_path}: {total_rows} 行, {len(parts)} 个片段")
+    if dtype is object:
+        return pd.DataFrame({name: pd.Series(values, dtype=object) for name, values in data.items()})
+    return pd.DataFrame(data)
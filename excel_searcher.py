@@ -1,11 +1,19 @@
+import os
+import re
+import warnings
 import pandas as pd
 import json
 import logging
 import argparse
 from typing import Dict, List, Union, Any
-import multiprocessing as mp
-from functools import partial
 import numpy as np
+from email_relationship_analyzer.xlsx_reader import read_xlsx
+from fulltext_index import FullTextIndex
+from query_language import QueryPlanner, parse_query
+from search_cache import SearchCache, file_sha256
+from thread_index import ThreadIndex, SUBJECT_COLUMN, ADDRESS_COLUMNS, relationship_keys
+from workbook_store import (save_columns, load_columns, save_fulltext_index, load_fulltext_index,
+                            save_thread_index, load_thread_index)
 
 # 设置日志
 logging.basicConfig(
@@ -14,87 +22,213 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def _search_chunk(chunk_data: pd.DataFrame, search_terms: List[str], columns: List[str], start_idx: int) -> List[Dict[str, Any]]:
-    """在数据块中搜索
+try:
+    import pyarrow  # noqa: F401
+    # 正文等长文本列使用Arrow字符串，数据存放在连续缓冲区中，不再是逐个Python字符串对象
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:  # pyarrow是可选依赖，没有时使用pandas自带的字符串类型
+    STRING_DTYPE = pd.StringDtype('python')
+
+# 全文检索默认使用的正文列
+FULLTEXT_COLUMN = '邮件文本正文'
+
+# 不同值数量不超过行数的该比例时（发件人、收件人域名等重复值多的列）存为category
+CATEGORY_RATIO = 0.5
+
+def _to_compact(series: pd.Series) -> pd.Series:
+    """将一列转换为紧凑表示，取值与原来的 astype(str) 相同（缺失值为'nan'）
     
     Args:
-        chunk_data (pd.DataFrame): 数据块
-        search_terms (List[str]): 搜索关键词列表
-        columns (List[str]): 列名列表
-        start_idx (int): 起始行号
+        series (pd.Series): 原始列
         
     Returns:
-        List[Dict]: 搜索结果列表
+        pd.Series: category列或字符串列
     """
-    results = []
-    for idx, row in chunk_data.iterrows():
-        matched_terms = {}
-        for term in search_terms:
-            matched_cols = []
-            for col in columns:
-                if term in str(row[col]).lower():
-                    matched_cols.append(col)
-            if matched_cols:
-                matched_terms[term] = matched_cols
-        
-        if matched_terms:
-            row_dict = row.to_dict()
-            results.append({
-                "row_index": start_idx + idx + 2,  # Excel行号从1开始，标题占用第1行
-                "matched_terms": matched_terms,
-                "data": row_dict
-            })
-    return results
+    text = series.astype(object).map(str, na_action='ignore').fillna('nan')
+    if text.nunique() <= CATEGORY_RATIO * len(text):
+        return text.astype('category')
+    return text.astype(STRING_DTYPE)
 
-def _column_search_chunk(chunk_data: pd.DataFrame, column_name: str, search_terms: List[str], start_idx: int) -> List[Dict[str, Any]]:
-    """在数据块的指定列中搜索
+class _TextAccessor:
+    """按行位置读取单个文本，供短语验证使用，避免把整列转换为Python列表"""
     
-    Args:
-        chunk_data (pd.DataFrame): 数据块
-        column_name (str): 列名
-        search_terms (List[str]): 搜索关键词列表
-        start_idx (int): 起始行号
+    def __init__(self, series: pd.Series):
+        self.series = series
         
-    Returns:
-        List[Dict]: 搜索结果列表
-    """
-    results = []
-    for term in search_terms:
-        matches = chunk_data[chunk_data[column_name].str.contains(term, case=False, na=False)]
-        for idx, row in matches.iterrows():
-            results.append({
-                "row_index": start_idx + idx + 2,
-                "matched_term": term,
-                "data": row.to_dict()
-            })
-    return results
+    def __getitem__(self, position: int) -> str:
+        return str(self.series.iloc[position])
 
 class ExcelSearcher:
-    def __init__(self, excel_file: str):
+    def __init__(self, excel_file: str, cache: SearchCache = None, workbook_hash: str = None,
+                 artifact_dir: str = None):
         """初始化Excel搜索器
         
         Args:
             excel_file (str): Excel文件路径
+            cache (SearchCache): 搜索结果缓存（可在多个搜索器之间共享），为None时不缓存
+            workbook_hash (str): 工作簿内容的SHA-256，用于缓存键；为None且启用缓存时由文件计算
+            artifact_dir (str): 存放解析结果的目录（见 workbook_store），其中已有列式缓存时直接读取而不解析，
+                否则解析后写入；全文索引同样在构建后写入该目录
+        """
+        self.cache = cache
+        if workbook_hash is None and cache is not None:
+            workbook_hash = file_sha256(excel_file)
+        self.workbook_hash = workbook_hash
+        self.artifact_dir = artifact_dir
+        
+        self.df = load_columns(artifact_dir) if artifact_dir else None
+        if self.df is not None:
+            logger.info(f"从列式缓存加载 {excel_file}，跳过解析")
+        else:
+            df = read_xlsx(excel_file)
+            # 逐列转换为紧凑的字符串表示，避免整表 astype(str) 生成大量Python字符串对象
+            self.df = pd.DataFrame({column: _to_compact(df.pop(column)) for column in list(df.columns)})
+            self._save_artifact(save_columns, self.df, artifact_dir)
+        # 全文索引按列在第一次全文检索时构建，之后同一工作簿复用
+        self.fulltext_indexes: Dict[str, FullTextIndex] = {}
+        # 会话索引在第一次查看会话时构建（上传时由服务预先构建）
+        self.thread_index: ThreadIndex = None
+        self._column_bytes: Dict[str, float] = {}
+        logger.info(f"已加载 {len(self.df)} 行，占用内存 {self.memory_usage()['total_bytes'] / 1024 / 1024:.1f}MB")
+        
+    def term_mask(self, column_name: str, term: str, prefix: bool = False,
+                  positions: np.ndarray = None, regex: bool = False) -> np.ndarray:
+        """返回指定列中包含关键词（不区分大小写）的行的布尔数组
+        
+        category列只在不同的取值上匹配一次，再按编码映射回每一行；
+        字符串列直接使用向量化的子串匹配（Arrow字符串上由pyarrow计算）。
+        该列已有全文索引时，先用索引排除一定不包含关键词的行，只对剩下的行做子串匹配。
+        
+        Args:
+            column_name (str): 列名
+            term (str): 小写的关键词
+            prefix (bool): 为True时要求单元格以关键词开头
+            positions (np.ndarray): 只计算这些行位置，默认为全部行
+            regex (bool): 为True时关键词是正则表达式（按列搜索的语义），不使用全文索引
+            
+        Returns:
+            np.ndarray: 与positions（或全部行）等长的布尔数组
+            
+        Raises:
+            ValueError: 正则表达式无效
+        """
+        if regex:
+            try:
+                return self._regex_mask(self.df[column_name], term, positions)
+            except (re.error, ValueError, TypeError, NotImplementedError) as e:
+                raise ValueError(f"无效的正则表达式 '{term}': {e}") from e
+            
+        series = self.df[column_name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            if prefix:
+                hits = categories.str.lower().str.startswith(term)
+            else:
+                hits = categories.str.contains(term, case=False, regex=False)
+            codes = series.cat.codes.to_numpy()
+            return np.asarray(hits, dtype=bool)[codes if positions is None else codes[positions]]
+            
+        mask = None
+        candidates = self._index_candidates(column_name, term, prefix)
+        if candidates is not None:
+            if positions is None:
+                mask = np.zeros(len(series), dtype=bool)
+                mask[candidates] = True
+                positions = candidates
+            else:
+                mask = np.isin(positions, candidates)
+                positions = positions[mask]
+        if positions is not None:
+            series = series.iloc[positions]
+        if prefix:
+            hits = series.str.lower().str.startswith(term).to_numpy(dtype=bool, na_value=False)
+        else:
+            hits = series.str.contains(term, case=False, regex=False, na=False).to_numpy(dtype=bool)
+        if mask is None:
+            return hits
+        mask[mask] = hits
+        return mask
+        
+    @staticmethod
+    def _regex_mask(series: pd.Series, pattern: str, positions: np.ndarray = None) -> np.ndarray:
+        """正则表达式匹配（不区分大小写），category列同样只在不同的取值上匹配一次"""
+        with warnings.catch_warnings():
+            # 带分组的表达式只用于判断是否匹配，不需要提示改用str.extract
+            warnings.filterwarnings('ignore', 'This pattern is interpreted as a regular expression')
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                hits = np.asarray(series.cat.categories.str.contains(pattern, case=False, regex=True), dtype=bool)
+                codes = series.cat.codes.to_numpy()
+                return hits[codes if positions is None else codes[positions]]
+            if positions is not None:
+                series = series.iloc[positions]
+            return series.str.contains(pattern, case=False, regex=True, na=False).to_numpy(dtype=bool)
+        
+    def _cached(self, key: tuple, compute):
+        """以 (工作簿哈希,) + key 为键查找结果缓存，未启用缓存时直接计算"""
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute((self.workbook_hash,) + key, compute)
+        
+    def _term_positions(self, column_name: str, term: str, regex: bool = False) -> np.ndarray:
+        """指定列中包含关键词（regex为True时匹配正则表达式）的全部行位置（经过结果缓存）"""
+        return self._cached(
+            (column_name, 'regex' if regex else 'contains', term),
+            lambda: np.flatnonzero(self.term_mask(column_name, term, regex=regex)).astype(np.int32)
+        )
+        
+    def _index_candidates(self, column_name: str, term: str, prefix: bool) -> Union[np.ndarray, None]:
+        """已构建的全文索引给出的候选行（一定包含关键词的行都在其中），无法使用索引时返回None"""
+        index = self.fulltext_indexes.get(column_name)
+        if index is None or prefix:
+            return None
+        return index.substring_candidates(term)
+        
+    def term_cost(self, column_name: str, term: str, prefix: bool = False) -> float:
+        """估算在全部行上计算term_mask需要扫描的字节数，供查询计划排序使用"""
+        series = self.df[column_name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # 只扫描不同的取值，再按编码映射回每一行
+            return float(series.cat.categories.memory_usage(deep=True)) + len(series)
+        if column_name not in self._column_bytes:
+            self._column_bytes[column_name] = float(series.memory_usage(deep=True, index=False))
+        candidates = self._index_candidates(column_name, term, prefix)
+        if candidates is not None:
+            return self._column_bytes[column_name] * len(candidates) / max(len(series), 1)
+        return self._column_bytes[column_name]
+        
+    def get_rows(self, positions: np.ndarray) -> List[Dict[str, Any]]:
+        """按行位置取出整行数据"""
+        return self.df.iloc[positions].to_dict('records')
+        
+    def get_row(self, position: int) -> Dict[str, Any]:
+        """获取指定位置（从0开始）的一行数据
+        
+        Args:
+            position (int): 行位置
+            
+        Returns:
+            Dict: 列名 -> 字符串值
         """
-        self.df = pd.read_excel(excel_file)
-        # 将所有数据转换为字符串，便于搜索
-        self.df = self.df.astype(str)
-        # 获取CPU核心数，留一个核心给系统
-        self.num_processes = max(1, mp.cpu_count() - 1)
+        return self.get_rows([position])[0]
         
-    def _split_dataframe(self) -> List[pd.DataFrame]:
-        """将DataFrame分割成多个块
+    def memory_usage(self) -> Dict[str, Any]:
+        """统计DataFrame占用的内存
         
         Returns:
-            List[pd.DataFrame]: DataFrame块列表
+            Dict: 总字节数，以及每列的类型和字节数
         """
-        chunk_size = len(self.df) // self.num_processes
-        if chunk_size == 0:
-            return [self.df]
-        return np.array_split(self.df, self.num_processes)
+        usage = self.df.memory_usage(deep=True, index=False)
+        return {
+            'total_bytes': int(usage.sum()),
+            'rows': len(self.df),
+            'columns': {
+                column: {'dtype': str(self.df[column].dtype), 'bytes': int(usage[column])}
+                for column in self.df.columns
+            }
+        }
         
     def global_search(self, search_terms: List[str]) -> List[Dict[str, Any]]:
-        """全局搜索（并行处理）
+        """全局搜索
         
         Args:
             search_terms (List[str]): 要搜索的文本列表
@@ -107,32 +241,163 @@ class ExcelSearcher:
         if not search_terms:
             return []
             
-        # 分割数据
-        chunks = self._split_dataframe()
         columns = list(self.df.columns)
+        # 每个关键词一个 (列数 x 行数) 的匹配矩阵，由各列缓存的匹配行位置填充
+        term_matrices = {}
+        for term in search_terms:
+            matrix = np.zeros((len(columns), len(self.df)), dtype=bool)
+            for i, column in enumerate(columns):
+                matrix[i, self._term_positions(column, term)] = True
+            term_matrices[term] = matrix
+        positions = np.flatnonzero(np.logical_or.reduce([matrix.any(axis=0) for matrix in term_matrices.values()]))
         
-        # 创建进程池
-        with mp.Pool(processes=self.num_processes) as pool:
-            # 为每个块创建搜索任务
-            search_tasks = []
-            start_idx = 0
-            for chunk in chunks:
-                search_func = partial(_search_chunk, 
-                                   search_terms=search_terms,
-                                   columns=columns,
-                                   start_idx=start_idx)
-                search_tasks.append(pool.apply_async(search_func, (chunk,)))
-                start_idx += len(chunk)
-            
-            # 收集所有结果
-            results = []
-            for task in search_tasks:
-                results.extend(task.get())
-            
+        results = []
+        for position, row_dict in zip(positions.tolist(), self.get_rows(positions)):
+            matched_terms = {}
+            for term, matrix in term_matrices.items():
+                matched_cols = [columns[i] for i in np.flatnonzero(matrix[:, position])]
+                if matched_cols:
+                    matched_terms[term] = matched_cols
+            results.append({
+                "row_index": position + 2,  # Excel行号从1开始，标题占用第1行
+                "matched_terms": matched_terms,
+                "data": row_dict
+            })
         return results
 
+    def get_fulltext_index(self, column_name: str) -> FullTextIndex:
+        """获取（必要时构建）指定列的全文索引"""
+        if column_name not in self.df.columns:
+            raise ValueError(f"列名 '{column_name}' 不存在")
+        if column_name not in self.fulltext_indexes:
+            index = load_fulltext_index(self.artifact_dir, column_name) if self.artifact_dir else None
+            if index is None:
+                index = FullTextIndex.build(self.df[column_name].tolist())
+                self._save_artifact(save_fulltext_index, index, self.artifact_dir, column_name)
+            self.fulltext_indexes[column_name] = index
+        return self.fulltext_indexes[column_name]
+        
+    def get_thread_index(self) -> ThreadIndex:
+        """获取（必要时构建）按标准化主题划分的会话索引"""
+        if SUBJECT_COLUMN not in self.df.columns:
+            raise ValueError(f"列名 '{SUBJECT_COLUMN}' 不存在")
+        if self.thread_index is None:
+            index = load_thread_index(self.artifact_dir) if self.artifact_dir else None
+            if index is None:
+                index = ThreadIndex.build(self.df[SUBJECT_COLUMN])
+                self._save_artifact(save_thread_index, index, self.artifact_dir)
+            self.thread_index = index
+        return self.thread_index
+        
+    def conversation(self, row_index: int) -> Dict[str, Any]:
+        """获取一行所在的整个会话：标准化主题相同的原始邮件和全部回复
+        
+        Args:
+            row_index (int): Excel行号（与搜索结果中的row_index相同）
+            
+        Returns:
+            Dict: 会话的标准化主题、该行参与的关系键，以及会话中按行号排列的每一行
+                （行号、是否为回复、参与的关系键和数据）
+                
+        Raises:
+            IndexError: 行号超出范围
+        """
+        position = row_index - 2
+        if not 0 <= position < len(self.df):
+            raise IndexError(f"行号 {row_index} 超出范围")
+        index = self.get_thread_index()
+        positions = index.thread_positions(position)
+        
+        rows = self.df.iloc[positions]
+        if all(column in self.df.columns for column in ADDRESS_COLUMNS):
+            keys = relationship_keys(rows.set_axis(positions, axis=0))
+        else:
+            keys = {}
+        return {
+            "row_index": row_index,
+            "subject": index.subject_of(position),
+            "relationship_keys": keys.get(position, []),
+            "rows": [
+                {
+                    "row_index": thread_position + 2,
+                    "is_reply": bool(index.reply_flags[thread_position]),
+                    "relationship_keys": keys.get(thread_position, []),
+                    "data": row_dict
+                }
+                for thread_position, row_dict in zip(positions.tolist(), rows.to_dict('records'))
+            ]
+        }
+        
+    def _save_artifact(self, save, *args):
+        """写入解析结果目录；目录已被清理（工作簿被淘汰）或写入失败时只记录日志，不影响搜索"""
+        if not self.artifact_dir or not os.path.isdir(self.artifact_dir):
+            return
+        try:
+            save(*args)
+        except OSError as e:
+            logger.warning(f"保存到 {self.artifact_dir} 失败: {e}")
+        
+    def fulltext_hits(self, query: str, column_name: str = None, top_k: int = 20):
+        """全文检索的 (行位置数组, 得分数组)，按得分从高到低排列（经过结果缓存）"""
+        column_name = column_name or FULLTEXT_COLUMN
+        
+        def compute():
+            hits = self.get_fulltext_index(column_name).search(query, top_k, texts=_TextAccessor(self.df[column_name]))
+            return (np.array([position for position, _ in hits], dtype=np.int32),
+                    np.array([score for _, score in hits], dtype=np.float64))
+            
+        return self._cached((column_name, 'fulltext', ' '.join(query.split()), top_k), compute)
+        
+    def fulltext_search(self, query: str, column_name: str = None, top_k: int = 20) -> List[Dict[str, Any]]:
+        """全文检索（BM25排序，支持双引号短语）
+        
+        Args:
+            query (str): 查询，例如 丁腈手套 "nitrile gloves"
+            column_name (str): 检索的列，默认 邮件文本正文
+            top_k (int): 返回的结果数量
+            
+        Returns:
+            List[Dict]: 按相关度从高到低排列的结果，每个结果包含行号、得分和数据
+        """
+        positions, scores = self.fulltext_hits(query, column_name, top_k)
+        return [
+            {
+                "row_index": position + 2,
+                "score": round(score, 4),
+                "data": row_dict
+            }
+            for position, score, row_dict in zip(positions.tolist(), scores.tolist(), self.get_rows(positions))
+        ]
+        
+    def _query_positions(self, query: str) -> np.ndarray:
+        """查询语句匹配的行位置（经过结果缓存）"""
+        # 以语法树为缓存键：词之间多余的空白不影响结果，短语内的空白则是匹配内容的一部分
+        tree = parse_query(query, self.get_columns())
+        return self._cached((None, 'query', tree), lambda: QueryPlanner(self).run_tree(tree))
+        
+    def query_search(self, query: str) -> List[Dict[str, Any]]:
+        """按查询语句搜索，语法见 query_language.parse_query
+        
+        Args:
+            query (str): 查询语句，例如 发件人:@intco.com AND (报价 OR quote)
+            
+        Returns:
+            List[Dict]: 搜索结果列表，每个结果包含行号和匹配数据
+            
+        Raises:
+            QuerySyntaxError: 查询语法错误
+        """
+        positions = self._query_positions(query)
+        return [
+            {
+                "row_index": position + 2,
+                "data": row_dict
+            }
+            for position, row_dict in zip(positions.tolist(), self.get_rows(positions))
+        ]
+        
     def column_search(self, column_name: str, search_terms: List[str]) -> List[Dict[str, Any]]:
-        """在指定列中搜索（并行处理）
+        """在指定列中搜索，搜索内容按正则表达式匹配（不区分大小写）；全局搜索则按字面子串匹配
         
         Args:
             column_name (str): 列名
@@ -140,6 +405,9 @@ class ExcelSearcher:
             
         Returns:
             List[Dict]: 搜索结果列表，每个结果包含行号和匹配数据
+            
+        Raises:
+            ValueError: 列名不存在或正则表达式无效
         """
         if column_name not in self.df.columns:
             raise ValueError(f"列名 '{column_name}' 不存在")
@@ -149,37 +417,82 @@ class ExcelSearcher:
         if not search_terms:
             return []
             
-        # 分割数据
-        chunks = self._split_dataframe()
-        
-        # 创建进程池
-        with mp.Pool(processes=self.num_processes) as pool:
-            # 为每个块创建搜索任务
-            search_tasks = []
-            start_idx = 0
-            for chunk in chunks:
-                search_func = partial(_column_search_chunk,
-                                   column_name=column_name,
-                                   search_terms=search_terms,
-                                   start_idx=start_idx)
-                search_tasks.append(pool.apply_async(search_func, (chunk,)))
-                start_idx += len(chunk)
-            
-            # 收集所有结果
-            all_results = []
-            for task in search_tasks:
-                all_results.extend(task.get())
-        
-        # 去重（同一行可能匹配多个关键词）
+        # 按关键词顺序收集匹配的行，同一行可能匹配多个关键词，只保留第一次
         unique_results = []
         seen_rows = set()
-        for result in all_results:
-            if result["row_index"] not in seen_rows:
-                seen_rows.add(result["row_index"])
-                unique_results.append(result)
+        for term in search_terms:
+            positions = [p for p in self._term_positions(column_name, term, regex=True).tolist() if p not in seen_rows]
+            seen_rows.update(positions)
+            for position, row_dict in zip(positions, self.get_rows(positions)):
+                unique_results.append({
+                    "row_index": position + 2,
+                    "matched_term": term,
+                    "data": row_dict
+                })
                 
         return unique_results
 
+    def find_positions(self, search_terms: List[str], column_name: str = '', mode: str = 'keyword',
+                       top_k: int = 20) -> np.ndarray:
+        """只返回匹配行的位置，行的顺序与对应搜索方法返回结果的顺序一致，供导出等按位置读取行的场景使用
+        
+        Args:
+            search_terms (List[str]): 搜索内容
+            column_name (str): 列名，留空为全局搜索（全文检索时默认 邮件文本正文）
+            mode (str): keyword（关键词）、query（查询语句，多个搜索项之间为AND）或 fulltext（全文检索）
+            top_k (int): 全文检索返回的数量
+            
+        Returns:
+            np.ndarray: 行位置（从0开始）
+        """
+        if mode == 'fulltext':
+            return self.fulltext_hits(' '.join(search_terms), column_name or None, top_k)[0]
+        if mode == 'query':
+            return self._query_positions(' '.join(f'({term})' for term in search_terms))
+            
+        search_terms = [term.strip().lower() for term in search_terms if term.strip()]
+        if not search_terms:
+            return np.empty(0, dtype=np.int32)
+        if column_name:
+            if column_name not in self.df.columns:
+                raise ValueError(f"列名 '{column_name}' 不存在")
+            # 按关键词顺序、每行只保留第一次出现，与column_search一致
+            return pd.unique(np.concatenate([
+                self._term_positions(column_name, term, regex=True) for term in search_terms
+            ]))
+        return np.unique(np.concatenate([
+            self._term_positions(column, term) for term in search_terms for column in self.df.columns
+        ]))
+        
+    def iter_row_batches(self, positions: np.ndarray, columns: List[str] = None, batch_size: int = 1000):
+        """按位置分批取出行，每批是只含所需列的DataFrame，避免一次性生成全部结果
+        
+        Args:
+            positions (np.ndarray): 行位置
+            columns (List[str]): 需要的列，默认全部列
+            batch_size (int): 每批的行数
+            
+        Returns:
+            Iterator[pd.DataFrame]: 索引为Excel行号的数据块
+            
+        Raises:
+            ValueError: 列名不存在（在开始取数据之前检查）
+        """
+        columns = list(self.df.columns) if columns is None else list(columns)
+        missing = [column for column in columns if column not in self.df.columns]
+        if missing:
+            raise ValueError(f"列名 {missing} 不存在")
+        projected = self.df[columns]
+        
+        def batches():
+            for start in range(0, len(positions), batch_size):
+                batch_positions = positions[start:start + batch_size]
+                batch = projected.iloc[batch_positions]
+                batch.index = np.asarray(batch_positions) + 2
+                yield batch
+                
+        return batches()
+            
     def save_results(self, results: List[Dict[str, Any]], output_file: str):
         """保存搜索结果到JSON文件
         
@@ -203,6 +516,7 @@ def main():
     parser.add_argument('excel_file', help='Excel文件路径')
     parser.add_argument('search_text', help='要搜索的文本')
     parser.add_argument('--column', help='要搜索的列名（可选）')
+    parser.add_argument('--query', action='store_true', help='将搜索文本作为查询语句解析（AND / OR / NOT、列名:值、前缀*、"短语"）')
     parser.add_argument('--output', default='search_results.json', help='输出JSON文件路径（默认：search_results.json）')
     
     args = parser.parse_args()
@@ -210,7 +524,10 @@ def main():
     try:
         searcher = ExcelSearcher(args.excel_file)
         
-        if args.column:
+        if args.query:
+            print(f"按查询语句搜索 '{args.search_text}'...")
+            results = searcher.query_search(args.search_text)
+        elif args.column:
             print(f"在列 '{args.column}' 中搜索 '{args.search_text}'...")
             results = searcher.column_search(args.column, args.search_text)
         else:
@@ -0,0 +1,333 @@
+import os
+import json
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from email_relationship_analyzer.address_parser import parse_addresses
+from email_relationship_analyzer.membership import MessageIdSet
+from excel_searcher import ExcelSearcher, FULLTEXT_COLUMN
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID_COLUMN = '邮件消息标识'
+SEND_TIME_COLUMN = '发送时间'
+ADDRESS_COLUMNS = ('发件人', '收件人')
+# ExcelSearcher中缺失值的字符串表示
+MISSING_VALUE = 'nan'
+
+SUMMARY_FILE = 'summary.json'
+MESSAGE_IDS_FILE = 'message_ids.npy'
+DOMAINS_FILE = 'domains.npy'
+
+
+def _address_domains(raw: str) -> set:
+    """单元格中各地址的域名（小写），摘要和按域名过滤行都用它，保证两者一致"""
+    return {address.rsplit('@', 1)[1] for address in parse_addresses(raw) if '@' in address}
+
+
+def _distinct_values(series: pd.Series) -> np.ndarray:
+    """列中不同的非缺失值（category列直接取类别）"""
+    values = series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype) else series.unique()
+    values = np.asarray(values, dtype=object)
+    return values[values != MISSING_VALUE]
+
+
+class WorkbookSummary:
+    """一个工作簿的摘要，用于在联合搜索时整体跳过不可能有结果的文件
+
+    message_ids / domains 为哈希成员过滤器（MessageIdSet，False表示一定不存在），
+    min_time / max_time 为发送时间的范围。
+    """
+
+    def __init__(self, rows: int, message_ids: MessageIdSet, domains: MessageIdSet,
+                 min_time: Optional[pd.Timestamp], max_time: Optional[pd.Timestamp]):
+        self.rows = rows
+        self.message_ids = message_ids
+        self.domains = domains
+        self.min_time = min_time
+        self.max_time = max_time
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> 'WorkbookSummary':
+        """由ExcelSearcher的DataFrame构建摘要"""
+        message_ids = MessageIdSet.from_values(
+            _distinct_values(df[MESSAGE_ID_COLUMN]) if MESSAGE_ID_COLUMN in df.columns else []
+        )
+        domains = set()
+        for column in ADDRESS_COLUMNS:
+            if column in df.columns:
+                for raw in _distinct_values(df[column]):
+                    domains.update(_address_domains(raw))
+
+        min_time = max_time = None
+        if SEND_TIME_COLUMN in df.columns:
+            times = pd.to_datetime(pd.Series(_distinct_values(df[SEND_TIME_COLUMN])), format='mixed', errors='coerce')
+            if times.notna().any():
+                min_time, max_time = times.min(), times.max()
+        return cls(len(df), message_ids, MessageIdSet.from_values(sorted(domains)), min_time, max_time)
+
+    def save(self, directory: str):
+        self.message_ids.save(os.path.join(directory, MESSAGE_IDS_FILE))
+        self.domains.save(os.path.join(directory, DOMAINS_FILE))
+        with open(os.path.join(directory, SUMMARY_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional['WorkbookSummary']:
+        """读取save保存的摘要，不存在时返回None"""
+        summary_path = os.path.join(directory, SUMMARY_FILE)
+        if not os.path.exists(summary_path):
+            return None
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(
+            data['rows'],
+            MessageIdSet.load(os.path.join(directory, MESSAGE_IDS_FILE)),
+            MessageIdSet.load(os.path.join(directory, DOMAINS_FILE)),
+            pd.Timestamp(data['min_time']) if data['min_time'] else None,
+            pd.Timestamp(data['max_time']) if data['max_time'] else None
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'message_ids': len(self.message_ids),
+            'domains': len(self.domains),
+            'min_time': str(self.min_time) if self.min_time is not None else None,
+            'max_time': str(self.max_time) if self.max_time is not None else None
+        }
+
+    def may_match(self, message_id: str = None, domain: str = None,
+                  start: pd.Timestamp = None, end: pd.Timestamp = None) -> bool:
+        """工作簿中是否可能有满足条件的行，返回False时可以跳过整个文件"""
+        if message_id is not None and message_id not in self.message_ids:
+            return False
+        if domain is not None and domain not in self.domains:
+            return False
+        if (start is not None or end is not None) and self.min_time is None:
+            # 没有可解析的发送时间，不可能满足时间条件
+            return False
+        if start is not None and self.max_time < start:
+            return False
+        if end is not None and self.min_time > end:
+            return False
+        return True
+
+
+class FederatedSearcher:
+    """在多个工作簿（例如每个邮箱每月一个导出文件）上同时搜索
+
+    每个工作簿一个ExcelSearcher，搜索在线程池中并行执行（匹配计算主要在pyarrow/NumPy中完成），
+    结果合并后附带来源文件名。按邮件消息标识、域名或发送时间范围搜索时，先用各文件的摘要跳过不可能匹配的文件。
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        Args:
+            max_workers (int): 并行搜索的线程数，默认为CPU核数
+        """
+        self.workbooks: Dict[str, Dict[str, Any]] = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                           thread_name_prefix='federated')
+        self._lock = threading.Lock()
+
+    def add(self, key: str, name: str, searcher: ExcelSearcher):
+        """
+        注册一个工作簿
+
+        Args:
+            key (str): 工作簿的唯一标识（通常是内容的SHA-256），重复注册时替换
+            name (str): 显示用的文件名
+            searcher (ExcelSearcher): 已加载的搜索器；有解析结果目录时摘要也保存在其中
+        """
+        summary = WorkbookSummary.load(searcher.artifact_dir) if searcher.artifact_dir else None
+        if summary is None:
+            summary = WorkbookSummary.build(searcher.df)
+            if searcher.artifact_dir and os.path.isdir(searcher.artifact_dir):
+                summary.save(searcher.artifact_dir)
+        with self._lock:
+            self.workbooks[key] = {'name': name, 'searcher': searcher, 'summary': summary}
+        logger.info(f"联合搜索已加入 {name}: {summary.to_dict()}")
+
+    def add_file(self, excel_file: str, name: str = None, **searcher_kwargs) -> str:
+        """
+        加载并注册一个Excel文件
+
+        Args:
+            excel_file (str): Excel文件路径
+            name (str): 显示用的文件名，默认为文件名
+            searcher_kwargs: 传给ExcelSearcher的参数（cache、workbook_hash、artifact_dir）
+
+        Returns:
+            str: 工作簿的标识
+        """
+        searcher = ExcelSearcher(excel_file, **searcher_kwargs)
+        key = searcher.workbook_hash or os.path.abspath(excel_file)
+        self.add(key, name or os.path.basename(excel_file), searcher)
+        return key
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            return self.workbooks.pop(key, None) is not None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """已注册的工作簿及其摘要"""
+        with self._lock:
+            return [
+                {'key': key, 'name': entry['name'], **entry['summary'].to_dict()}
+                for key, entry in self.workbooks.items()
+            ]
+
+    def _candidates(self, **conditions) -> List[tuple]:
+        with self._lock:
+            entries = list(self.workbooks.items())
+        candidates = [(key, entry) for key, entry in entries if entry['summary'].may_match(**conditions)]
+        if len(candidates) < len(entries):
+            logger.info(f"根据摘要跳过了 {len(entries) - len(candidates)}/{len(entries)} 个工作簿")
+        return candidates
+
+    @staticmethod
+    def _row_filter(searcher: ExcelSearcher, positions: np.ndarray, domain: str = None,
+                    start: pd.Timestamp = None, end: pd.Timestamp = None) -> np.ndarray:
+        """在单个工作簿的匹配行上应用域名和时间条件
+        
+        域名按解析后的地址精确比较（与摘要相同），a.com 不会匹配 a.com.cn，a.co 也不会匹配 a.com。
+        """
+        if domain is not None and len(positions):
+            keep = np.zeros(len(positions), dtype=bool)
+            for column in ADDRESS_COLUMNS:
+                if column in searcher.df.columns:
+                    # 每个不同的单元格只解析一次；末尾的False对应factorize给缺失值的编码-1
+                    codes, values = pd.factorize(searcher.df[column].iloc[positions])
+                    hits = np.array([domain in _address_domains(value) for value in values] + [False], dtype=bool)
+                    keep |= hits[codes]
+            positions = positions[keep]
+        if (start is not None or end is not None) and len(positions):
+            if SEND_TIME_COLUMN not in searcher.df.columns:
+                return positions[:0]
+            times = pd.to_datetime(searcher.df[SEND_TIME_COLUMN].iloc[positions].astype(object), format='mixed',
+                                   errors='coerce')
+            keep = times.notna().to_numpy().copy()
+            if start is not None:
+                keep &= (times >= start).to_numpy()
+            if end is not None:
+                keep &= (times <= end).to_numpy()
+            positions = positions[keep]
+        return positions
+
+    def search(self, search_terms: List[str], column_name: str = '', mode: str = 'keyword', top_k: int = 20,
+               domain: str = None, start: str = None, end: str = None) -> List[Dict[str, Any]]:
+        """
+        在全部（未被摘要排除的）工作簿中并行搜索
+
+        Args:
+            search_terms, column_name, mode, top_k: 同 ExcelSearcher.find_positions
+            domain (str): 只保留发件人或收件人包含该域名的行
+            start, end (str): 只保留发送时间在该范围内的行
+
+        Returns:
+            List[Dict]: 每个结果包含来源工作簿、行号和数据；全文检索时按得分排序并取前top_k个
+                （得分在各文件内分别计算，跨文件比较只是近似）
+        """
+        domain = domain.lower().lstrip('@') if domain else None
+        start = pd.Timestamp(start) if start else None
+        end = pd.Timestamp(end) if end else None
+
+        # 各月、各邮箱的导出列可能不同，没有所搜索列的工作簿不参与
+        required_column = column_name or (FULLTEXT_COLUMN if mode == 'fulltext' else None)
+        
+        def search_one(key, entry):
+            searcher = entry['searcher']
+            if required_column and required_column not in searcher.df.columns:
+                return key, entry, np.empty(0, dtype=np.int64), np.empty(0) if mode == 'fulltext' else None
+            if mode == 'fulltext':
+                # 域名和时间条件在取前k个之后才应用，过滤后不足top_k且可能还有更多命中时扩大候选数量重新检索
+                k = top_k
+                while True:
+                    positions, scores = searcher.fulltext_hits(' '.join(search_terms), column_name or None, k)
+                    kept = self._row_filter(searcher, positions, domain, start, end)
+                    if len(kept) >= top_k or len(positions) < k:
+                        break
+                    k *= 4
+                keep = np.isin(positions, kept)
+                positions, scores = positions[keep][:top_k], scores[keep][:top_k]
+            else:
+                positions = self._row_filter(searcher, searcher.find_positions(search_terms, column_name, mode),
+                                             domain, start, end)
+                scores = None
+            return key, entry, positions, scores
+
+        futures = [self.executor.submit(search_one, key, entry)
+                   for key, entry in self._candidates(domain=domain, start=start, end=end)]
+        hits = []
+        for future in futures:
+            key, entry, positions, scores = future.result()
+            rows = entry['searcher'].get_rows(positions)
+            for i, (position, row_dict) in enumerate(zip(positions.tolist(), rows)):
+                result = {'workbook': key, 'source': entry['name'], 'row_index': position + 2, 'data': row_dict}
+                if scores is not None:
+                    result['score'] = round(float(scores[i]), 4)
+                hits.append(result)
+
+        if mode == 'fulltext':
+            hits.sort(key=lambda hit: -hit['score'])
+            hits = hits[:top_k]
+        return hits
+
+    def find_message(self, message_id: str) -> List[Dict[str, Any]]:
+        """
+        按邮件消息标识精确查找，只在成员过滤器显示可能包含该标识的工作簿中比较
+
+        Returns:
+            List[Dict]: 每个结果包含来源工作簿、行号和数据
+        """
+        def lookup(key, entry):
+            searcher = entry['searcher']
+            column = searcher.df[MESSAGE_ID_COLUMN]
+            return key, entry, np.flatnonzero((column == message_id).to_numpy(dtype=bool, na_value=False))
+
+        futures = [self.executor.submit(lookup, key, entry)
+                   for key, entry in self._candidates(message_id=message_id)]
+        results = []
+        for future in futures:
+            key, entry, positions = future.result()
+            for position, row_dict in zip(positions.tolist(), entry['searcher'].get_rows(positions)):
+                results.append({'workbook': key, 'source': entry['name'], 'row_index': position + 2, 'data': row_dict})
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在多个Excel文件中联合搜索')
+    parser.add_argument('excel_files', nargs='+', help='Excel文件路径')
+    parser.add_argument('--search', nargs='*', default=[], help='搜索内容')
+    parser.add_argument('--column', default='', help='要搜索的列名（可选）')
+    parser.add_argument('--mode', default='keyword', choices=['keyword', 'query', 'fulltext'], help='搜索方式')
+    parser.add_argument('--domain', help='只保留发件人或收件人包含该域名的行')
+    parser.add_argument('--start', help='发送时间的开始')
+    parser.add_argument('--end', help='发送时间的结束')
+    parser.add_argument('--message-id', help='按邮件消息标识精确查找')
+    parser.add_argument('--output', default='search_results.json', help='输出JSON文件路径')
+    args = parser.parse_args()
+
+    federation = FederatedSearcher()
+    for excel_file in args.excel_files:
+        federation.add_file(excel_file)
+
+    if args.message_id:
+        results = federation.find_message(args.message_id)
+    else:
+        results = federation.search(args.search, args.column, args.mode, domain=args.domain,
+                                    start=args.start, end=args.end)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"找到 {len(results)} 条匹配结果，已保存到：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
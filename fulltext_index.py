@@ -0,0 +1,267 @@
+import re
+import math
+import time
+import logging
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字（汉字、假名、谚文）连续片段按二元组切分，其他文字按单词切分
+_CJK_RANGES = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN_RE = re.compile(f'[{_CJK_RANGES}]+|[^\\W{_CJK_RANGES}]+')
+_CJK_RE = re.compile(f'[{_CJK_RANGES}]')
+_QUERY_RE = re.compile(r'"([^"]+)"|(\S+)')
+# ASCII和中日统一汉字在NFKC规范化前后不变、也不会与相邻字符组合，只有这类子串能用索引求候选
+_STABLE_RE = re.compile('[\x00-\x7f㐀-䶿一-鿿]*')
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为词元
+
+    先做NFKC规范化（全角字母数字转半角）并统一小写；中日韩文字的连续片段切分为重叠的二元组
+    （单个字时保留单字），拉丁等文字按单词切分。
+
+    Args:
+        text (str): 原始文本
+
+    Returns:
+        List[str]: 按出现顺序排列的词元，相邻词元的位置相邻，可用于短语匹配
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    tokens = []
+    for piece in _TOKEN_RE.findall(text):
+        if _CJK_RE.match(piece):
+            if len(piece) == 1:
+                tokens.append(piece)
+            else:
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+    return tokens
+
+
+def _contains_sequence(tokens: List[str], phrase: List[str]) -> bool:
+    """判断词元序列中是否连续出现短语的全部词元"""
+    first, length = phrase[0], len(phrase)
+    for i in range(len(tokens) - length + 1):
+        if tokens[i] == first and tokens[i:i + length] == phrase:
+            return True
+    return False
+
+
+def _phrase_pattern(phrase: str) -> 're.Pattern':
+    """
+    短语在规范化文本中的正则，作为逐个切分词元验证前的快速筛选
+
+    相邻片段之间必须隔着非单词字符（中日韩片段与其他文字片段直接相连时可以没有间隔）。
+    这是词元连续出现的必要条件，匹配后仍需用 _contains_sequence 确认。
+    """
+    pieces = _TOKEN_RE.findall(unicodedata.normalize('NFKC', phrase).casefold())
+    pattern = re.escape(pieces[0])
+    for previous, piece in zip(pieces, pieces[1:]):
+        same_script = bool(_CJK_RE.match(previous)) == bool(_CJK_RE.match(piece))
+        pattern += (r'\W+' if same_script else r'\W*') + re.escape(piece)
+    return re.compile(pattern)
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    解析全文检索查询
+
+    双引号中的内容为短语（词元必须连续出现），其余为普通词。
+
+    Returns:
+        tuple: (全部词元, 短语词元列表)
+    """
+    terms, phrases = [], []
+    for phrase, word in _QUERY_RE.findall(query):
+        tokens = tokenize(phrase or word)
+        if not tokens:
+            continue
+        terms.extend(tokens)
+        if phrase:
+            phrases.append(tokens)
+    return terms, phrases
+
+
+def _phrase_matches(text: str, phrases: List[List[str]], patterns: List['re.Pattern']) -> bool:
+    """文本是否连续包含全部短语（先用正则筛选，再切分词元确认）"""
+    normalized = unicodedata.normalize('NFKC', text).casefold()
+    if not all(pattern.search(normalized) for pattern in patterns):
+        return False
+    tokens = tokenize(text)
+    return all(_contains_sequence(tokens, phrase) for phrase in phrases)
+
+
+class FullTextIndex:
+    """基于倒排索引的全文检索，按BM25排序
+
+    每个词元的倒排表以CSR形式存放：postings_docs[indptr[t]:indptr[t + 1]] 为包含词元t的文档，
+    postings_tf 为对应的词频。短语不保存位置信息，而是先用倒排表求交集得到候选，
+    再对候选文档重新切分词元做连续性验证。
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], indptr: np.ndarray, postings_docs: np.ndarray,
+                 postings_tf: np.ndarray, doc_lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> 'FullTextIndex':
+        """
+        由文本序列构建索引，文档ID为文本在序列中的位置
+
+        Args:
+            texts: 文本序列，非字符串视为空文档
+        """
+        started = time.time()
+        vocabulary: Dict[str, int] = {}
+        term_ids = array('i')
+        doc_ids = array('i')
+        doc_lengths = array('i')
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text) if isinstance(text, str) else []
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_id = vocabulary.get(token)
+                if term_id is None:
+                    term_id = vocabulary[token] = len(vocabulary)
+                term_ids.append(term_id)
+            doc_ids.extend([doc_id] * len(tokens))
+
+        num_docs = len(doc_lengths)
+        terms = np.frombuffer(term_ids, dtype=np.int32).astype(np.int64)
+        docs = np.frombuffer(doc_ids, dtype=np.int32).astype(np.int64)
+        # 按 (词元, 文档) 计数得到词频，np.unique的结果已按词元、文档排序
+        pairs, tf = np.unique(terms * max(num_docs, 1) + docs, return_counts=True)
+        pair_terms = pairs // max(num_docs, 1)
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_terms, minlength=len(vocabulary)), out=indptr[1:])
+
+        index = cls(
+            vocabulary,
+            indptr,
+            (pairs % max(num_docs, 1)).astype(np.int32),
+            tf.astype(np.int32),
+            np.frombuffer(doc_lengths, dtype=np.int32).copy()
+        )
+        logger.info(f"全文索引构建完成: {num_docs} 个文档, {len(vocabulary)} 个词元, "
+                    f"{len(pairs)} 条倒排记录, 耗时 {time.time() - started:.2f}秒")
+        return index
+
+    def _postings(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        term_id = self.vocabulary.get(token)
+        if term_id is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.postings_docs[start:end], self.postings_tf[start:end]
+
+    def _scores(self, terms: List[str]) -> np.ndarray:
+        """对查询词元累加BM25得分"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        length_norm = K1 * (1 - B + B * self.doc_lengths / max(self.avg_length, 1e-9))
+        for token in set(terms):
+            docs, tf = self._postings(token)
+            if len(docs) == 0:
+                continue
+            idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (K1 + 1) / (tf + length_norm[docs])
+        return scores
+
+    def _docs_with_all(self, tokens: List[str]) -> np.ndarray:
+        """包含全部词元的文档（从最短的倒排表开始求交集）"""
+        postings = sorted((self._postings(token)[0] for token in set(tokens)), key=len)
+        docs = postings[0]
+        for other in postings[1:]:
+            if len(docs) == 0:
+                break
+            docs = np.intersect1d(docs, other, assume_unique=True)
+        return docs
+
+    def substring_candidates(self, text: str) -> Optional[np.ndarray]:
+        """
+        包含子串text（不区分大小写）的文档的超集，用于在子串匹配前缩小扫描范围
+
+        子串中的中日韩片段的每个二元组、以及两侧都有其他字符的完整单词，必然是包含该子串的文档的词元；
+        位于子串两端的单词可能只是文档中某个单词的一部分，不能使用。
+
+        Args:
+            text (str): 子串
+
+        Returns:
+            np.ndarray: 有序的候选文档ID；子串中没有可用的词元时返回None，表示需要全量扫描
+        """
+        text = text.casefold()
+        if not _STABLE_RE.fullmatch(text):
+            return None
+        required = []
+        for match in _TOKEN_RE.finditer(text):
+            piece = match.group()
+            if _CJK_RE.match(piece):
+                required.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+            elif match.start() > 0 and match.end() < len(text):
+                required.append(piece)
+        if not required:
+            return None
+        return self._docs_with_all(required)
+
+    def search(self, query: str, top_k: int = 20, texts: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """
+        检索并返回得分最高的文档
+
+        普通词之间为OR关系，按BM25得分排序；查询中有短语时，结果必须包含全部短语，
+        短语的连续性用texts中的原文验证（不传texts时只要求短语的词元都出现）。
+
+        Args:
+            query (str): 查询，例如 丁腈手套 "nitrile gloves"
+            top_k (int): 返回数量
+            texts: 构建索引时使用的文本，按文档ID索引
+
+        Returns:
+            List[Tuple[int, float]]: (文档ID, 得分)，按得分从高到低排列
+        """
+        terms, phrases = parse_query(query)
+        if not terms or self.num_docs == 0:
+            return []
+
+        scores = self._scores(terms)
+        if phrases:
+            # 候选按得分从高到低逐个验证短语，凑够top_k个即停止，不必验证全部候选
+            candidates = self._docs_with_all([token for phrase in phrases for token in phrase])
+            ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+            patterns = [_phrase_pattern(phrase) for phrase, _ in _QUERY_RE.findall(query) if phrase and tokenize(phrase)]
+            hits = []
+            for doc in ranked.tolist():
+                if texts is None or _phrase_matches(texts[doc], phrases, patterns):
+                    hits.append((doc, float(scores[doc])))
+                    if len(hits) >= top_k:
+                        break
+            return hits
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return []
+        candidate_scores = scores[candidates]
+        k = min(top_k, len(candidates))
+        # argpartition 取出前k个，再只对这k个排序
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+        return [(int(candidates[i]), float(candidate_scores[i])) for i in top]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.postings_docs.nbytes + self.postings_tf.nbytes + self.doc_lengths.nbytes
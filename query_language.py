@@ -0,0 +1,224 @@
+import re
+import logging
+from collections import namedtuple
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 查询语法树的节点
+# Term: field为None时在所有列中匹配；prefix为True时要求单元格以value开头，否则为子串匹配
+Term = namedtuple('Term', ['field', 'value', 'prefix'])
+And = namedtuple('And', ['children'])
+Or = namedtuple('Or', ['children'])
+Not = namedtuple('Not', ['child'])
+
+# 执行计划的节点：node为语法树节点（叶子为已确定列名的Term），cost为估算的扫描字节数
+PlanNode = namedtuple('PlanNode', ['node', 'cost', 'children'])
+
+# 括号、带引号的短语（可以带字段前缀）、普通词
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|((?:[^\s()"]+:)?"[^"]*")|([^\s()"]+))')
+KEYWORDS = {'AND', 'OR', 'NOT'}
+
+
+class QuerySyntaxError(ValueError):
+    """查询语法错误"""
+
+
+def _lex(query: str) -> List[str]:
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN_RE.match(query, position)
+        if match is None or match.end() == position:
+            raise QuerySyntaxError(f"无法解析的查询片段: {query[position:]}")
+        tokens.append(next(group for group in match.groups() if group is not None))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """递归下降解析器，优先级 NOT > AND > OR，相邻的词之间默认为AND"""
+
+    def __init__(self, tokens: List[str], fields: List[str]):
+        self.tokens = tokens
+        self.fields = set(fields)
+        self.position = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> str:
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("查询为空")
+        node = self._or()
+        if self._peek() is not None:
+            raise QuerySyntaxError(f"多余的 '{self._peek()}'")
+        return node
+
+    def _or(self):
+        children = [self._and()]
+        while self._peek() == 'OR':
+            self._next()
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _and(self):
+        children = [self._not()]
+        while self._peek() not in (None, 'OR', ')'):
+            if self._peek() == 'AND':
+                self._next()
+            children.append(self._not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _not(self):
+        if self._peek() == 'NOT':
+            self._next()
+            return Not(self._not())
+        return self._atom()
+
+    def _atom(self):
+        token = self._next()
+        if token is None:
+            raise QuerySyntaxError("查询不完整")
+        if token == '(':
+            node = self._or()
+            if self._next() != ')':
+                raise QuerySyntaxError("缺少 ')'")
+            return node
+        if token == ')' or token in KEYWORDS:
+            raise QuerySyntaxError(f"'{token}' 的位置不正确")
+        return self._term(token)
+
+    def _term(self, token: str) -> Term:
+        field = None
+        # 只有冒号前是已知列名时才视为字段限定，否则冒号是搜索内容的一部分（例如网址）
+        name, sep, rest = token.partition(':')
+        if sep and name in self.fields:
+            field, token = name, rest
+        if token.startswith('"') and token.endswith('"') and len(token) >= 2:
+            value, prefix = token[1:-1], False
+        elif token.endswith('*') and len(token) > 1:
+            value, prefix = token[:-1], True
+        else:
+            value, prefix = token, False
+        if not value.strip():
+            raise QuerySyntaxError(f"搜索内容为空: {token}")
+        return Term(field, value.lower(), prefix)
+
+
+def parse_query(query: str, fields: List[str]):
+    """
+    解析查询语句
+
+    语法:
+        词                  在任意列中做子串匹配（不区分大小写）
+        "带 空格 的短语"      按字面子串匹配，可包含空格和关键字
+        前缀*               单元格以该前缀开头
+        列名:值             只在该列中匹配，值同样可以是短语或前缀，例如 发件人:@intco.com
+        AND / OR / NOT、括号  组合条件，相邻的条件默认为AND
+
+    Args:
+        query (str): 查询语句，例如 发件人:@intco.com AND (报价 OR quote) NOT 邮件名称:"Re:"
+        fields (List[str]): 可用的列名
+
+    Returns:
+        语法树（Term / And / Or / Not）
+
+    Raises:
+        QuerySyntaxError: 语法错误
+    """
+    return _Parser(_lex(query), fields).parse()
+
+
+class QueryPlanner:
+    """将语法树编译为执行计划并在ExcelSearcher上执行
+
+    未限定字段的词展开为在所有列上的OR。AND、OR的子条件按估算代价从小到大排列：
+    AND中后面的条件只在前面条件保留下来的行上计算，OR中后面的条件只在尚未匹配的行上计算，
+    因此category列、有全文索引可用的条件等代价小的过滤先执行，长文本列只扫描剩下的少量行。
+    """
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.columns = searcher.get_columns()
+
+    def compile(self, node) -> PlanNode:
+        """生成按代价排序的执行计划"""
+        if isinstance(node, Term):
+            if node.field is None:
+                return self.compile(Or(tuple(Term(column, node.value, node.prefix) for column in self.columns)))
+            return PlanNode(node, self.searcher.term_cost(node.field, node.value, node.prefix), ())
+        if isinstance(node, Not):
+            child = self.compile(node.child)
+            return PlanNode(node, child.cost, (child,))
+        children = sorted((self.compile(child) for child in node.children), key=lambda plan: plan.cost)
+        return PlanNode(node, sum(child.cost for child in children), tuple(children))
+
+    def execute(self, plan: PlanNode, positions: np.ndarray) -> np.ndarray:
+        """
+        返回positions中满足计划的行位置
+
+        Args:
+            plan: compile生成的执行计划
+            positions: 有序的候选行位置
+
+        Returns:
+            np.ndarray: 满足条件的行位置（有序）
+        """
+        node = plan.node
+        if len(positions) == 0:
+            return positions
+        if isinstance(node, Term):
+            return positions[self.searcher.term_mask(node.field, node.value, node.prefix, positions)]
+        if isinstance(node, Not):
+            matched = self.execute(plan.children[0], positions)
+            return positions[~np.isin(positions, matched, assume_unique=True)]
+        if isinstance(node, And):
+            for child in plan.children:
+                positions = self.execute(child, positions)
+                if len(positions) == 0:
+                    break
+            return positions
+        # OR：每个子条件只在尚未匹配的行上计算
+        remaining = positions
+        matched = []
+        for child in plan.children:
+            hits = self.execute(child, remaining)
+            if len(hits):
+                matched.append(hits)
+                remaining = remaining[~np.isin(remaining, hits, assume_unique=True)]
+            if len(remaining) == 0:
+                break
+        return np.sort(np.concatenate(matched)) if matched else positions[:0]
+
+    def explain(self, plan: PlanNode, depth: int = 0) -> str:
+        """执行计划的文本表示，每行一个节点"""
+        node = plan.node
+        if isinstance(node, Term):
+            op = '前缀' if node.prefix else '包含'
+            label = f"{node.field} {op} '{node.value}'"
+        else:
+            label = type(node).__name__.upper()
+        lines = [f"{'  ' * depth}{label} (代价 {plan.cost:,.0f})"]
+        lines.extend(self.explain(child, depth + 1) for child in plan.children)
+        return '\n'.join(lines)
+
+    def run(self, query: str) -> np.ndarray:
+        """解析、编译并执行查询，返回匹配的行位置"""
+        return self.run_tree(parse_query(query, self.columns))
+
+    def run_tree(self, tree) -> np.ndarray:
+        """编译并执行已解析的语法树，返回匹配的行位置"""
+        plan = self.compile(tree)
+        # 计划的文本表示只在输出DEBUG日志时才生成，不占用每次查询的时间
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("查询计划:\n%s", self.explain(plan))
+        return self.execute(plan, np.arange(len(self.searcher.df)))
@@ -1,7 +1,10 @@
 import json
 import logging
 from excel_searcher import ExcelSearcher
-from typing import Dict, List, Any
+from email_relationship_analyzer.relationship_store import RelationshipStore
+from email_relationship_analyzer.membership import MessageIdSet
+from email_relationship_analyzer.address_parser import parse_addresses, split_address
+from typing import Dict, List, Any, Iterator, Optional, Tuple
 from tqdm import tqdm
 
 # 设置日志
@@ -12,15 +15,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class RelationshipValidator:
-    def __init__(self, excel_file: str, relationships_file: str):
+    def __init__(self, excel_file: str, relationships_file: str, id_filter_file: Optional[str] = None):
         """初始化验证器
         
         Args:
             excel_file (str): Excel文件路径
-            relationships_file (str): relationships.json文件路径
+            relationships_file (str): relationships.json文件路径，或 --db 生成的SQLite数据库（.db）
+            id_filter_file (str): 可选的邮件消息标识成员过滤器（membership.py build 生成的 .npy），
+                一定不存在的标识直接记为问题案例，不再做全表搜索
         """
         self.excel_searcher = ExcelSearcher(excel_file)
         self.relationships_file = relationships_file
+        self.id_filter = MessageIdSet.load(id_filter_file) if id_filter_file else None
         self.bad_cases = []
         
     def load_relationships(self) -> Dict[str, Any]:
@@ -31,10 +37,25 @@ class RelationshipValidator:
         """
         with open(self.relationships_file, 'r', encoding='utf-8') as f:
             return json.load(f)
+    
+    def iter_relationships(self) -> Iterator[Tuple[str, List[List[str]]]]:
+        """按count从大到小逐个产出 (关系键, items)
+        
+        数据库文件直接按索引顺序读取，不需要把全部关系加载到内存。
+        """
+        if self.relationships_file.endswith('.db'):
+            with RelationshipStore(self.relationships_file) as store:
+                yield from store.iter_relationships()
+            return
+        for key, value in self.load_relationships().items():
+            yield key, value['items']
             
     def validate_relationship_item(self, item: List[str], search_results: List[Dict[str, Any]]) -> bool:
         """验证单个relationship item是否符合规则
         
+        分析器的关系键和用户名来自解析后的小写地址，这里同样解析发件人和收件人单元格，
+        按地址集合比较，而不是在原始单元格中做区分大小写的子串查找。
+        
         Args:
             item (List[str]): relationship item [sender, subject, recipient, message_id]
             search_results (List[Dict]): 搜索结果
@@ -48,17 +69,18 @@ class RelationshipValidator:
         # 在搜索结果中查找匹配的行
         for result in search_results:
             data = result['data']
+            addresses = set(parse_addresses(data['发件人'])) | set(parse_addresses(data['收件人']))
             
             # 检查发件人
-            if sender not in data['发件人'] and sender not in data['收件人']:
+            if sender.lower() not in addresses:
                 continue
                 
             # 检查邮件名称
             if subject not in data['邮件名称']:
                 continue
                 
-            # 检查收件人
-            if recipient not in data['收件人'] and recipient not in data['发件人']:
+            # 检查收件人（关系中记录的是用户名）
+            if recipient.lower() not in {split_address(address)[0] for address in addresses}:
                 continue
                 
             # 所有规则都满足
@@ -87,6 +109,14 @@ class RelationshipValidator:
         message_ids = list(message_ids)
         row_ids = list(row_ids)
         
+        # 先用成员过滤器排除一定不存在的邮件消息标识，它们在下面会被记为找不到
+        if self.id_filter is not None and message_ids:
+            present = self.id_filter.contains(message_ids)
+            skipped = len(message_ids) - int(present.sum())
+            message_ids = [message_id for message_id, found in zip(message_ids, present) if found]
+            if skipped:
+                logger.info(f"成员过滤器排除了 {skipped} 个不存在的邮件消息标识")
+        
         # 使用ExcelSearcher搜索所有message_ids
         logger.info(f"开始搜索 {len(message_ids)} 个邮件消息标识和 {len(row_ids)} 个行号标识...")
         
@@ -102,7 +132,7 @@ class RelationshipValidator:
                 row_num = int(row_id.replace('ROW_', ''))
                 # 由于Excel是从1开始计数，而DataFrame是从0开始，所以需要调整行号
                 if 0 <= row_num < len(self.excel_searcher.df):
-                    row_data = self.excel_searcher.df.iloc[row_num].to_dict()
+                    row_data = self.excel_searcher.get_row(row_num)
                     search_results.append({
                         'row_index': row_num + 2,  # 加2是因为Excel有标题行，且从1开始计数
                         'data': row_data
@@ -158,19 +188,19 @@ def main():
     
     parser = argparse.ArgumentParser(description='验证relationships结果')
     parser.add_argument('excel_file', help='Excel文件路径')
-    parser.add_argument('relationships_file', help='relationships.json文件路径')
+    parser.add_argument('relationships_file', help='relationships.json文件或SQLite数据库（.db）路径')
     parser.add_argument('limit', help='限制验证的item数量')
+    parser.add_argument('--id-filter', help='邮件消息标识成员过滤器（.npy），用于跳过一定不存在的标识')
     
     args = parser.parse_args()
     limit = int(args.limit)
     cnt = 0
-    validator = RelationshipValidator(args.excel_file, args.relationships_file)
-    relationships = validator.load_relationships()
-    for key, value in relationships.items():
+    validator = RelationshipValidator(args.excel_file, args.relationships_file, args.id_filter)
+    for key, items in validator.iter_relationships():
         cnt += 1
         if cnt > limit:
             break
-        validator.validate(key, value['items'])
+        validator.validate(key, items)
     # 保存验证结果
     validator.save_bad_cases()
         
@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+import logging
+from typing import Iterable, Iterator, List
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+logger = logging.getLogger(__name__)
+
+# 导出格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# 导出文件第一列为Excel行号，便于回到原工作簿中定位
+ROW_INDEX_COLUMN = '行号'
+
+
+def iter_csv(columns: List[str], batches: Iterable[pd.DataFrame]) -> Iterator[str]:
+    """
+    逐批生成CSV文本
+
+    开头带UTF-8 BOM，Excel打开时中文不会乱码。
+
+    Args:
+        columns: 导出的列（不含行号）
+        batches: ExcelSearcher.iter_row_batches 产出的数据块
+
+    Yields:
+        str: CSV文本片段
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow([ROW_INDEX_COLUMN] + list(columns))
+    yield '\ufeff' + buffer.getvalue()
+    for batch in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows((index,) + row for index, row in zip(batch.index.tolist(), batch.itertuples(index=False, name=None)))
+        yield buffer.getvalue()
+
+
+def iter_ndjson(columns: List[str], batches: Iterable[pd.DataFrame]) -> Iterator[str]:
+    """
+    逐批生成NDJSON文本，每行一个JSON对象
+
+    Args:
+        columns: 导出的列（不含行号）
+        batches: ExcelSearcher.iter_row_batches 产出的数据块
+
+    Yields:
+        str: 若干行JSON文本
+    """
+    columns = [ROW_INDEX_COLUMN] + list(columns)
+    for batch in batches:
+        yield ''.join(
+            json.dumps(dict(zip(columns, (index,) + row)), ensure_ascii=False) + '\n'
+            for index, row in zip(batch.index.tolist(), batch.itertuples(index=False, name=None))
+        )
+
+
+def _clean_cell(value):
+    """去掉openpyxl不允许写入的控制字符"""
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def write_xlsx(columns: List[str], batches: Iterable[pd.DataFrame], output_file: str) -> int:
+    """
+    用openpyxl的只写模式逐行写出xlsx文件，内存占用与结果行数无关
+
+    Args:
+        columns: 导出的列（不含行号）
+        batches: ExcelSearcher.iter_row_batches 产出的数据块
+        output_file (str): 输出文件路径
+
+    Returns:
+        int: 写出的行数
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('搜索结果')
+    sheet.append([ROW_INDEX_COLUMN] + list(columns))
+    rows = 0
+    for batch in batches:
+        for index, row in zip(batch.index.tolist(), batch.itertuples(index=False, name=None)):
+            sheet.append([index] + [_clean_cell(value) for value in row])
+            rows += 1
+    workbook.save(output_file)
+    logger.info(f"已导出 {rows} 行到: {output_file}")
+    return rows
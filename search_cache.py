@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认内存上限
+DEFAULT_BUDGET_BYTES = 64 * 1024 * 1024
+
+CacheValue = Union[np.ndarray, Tuple[np.ndarray, ...]]
+
+
+def file_sha256(file_path: str) -> str:
+    """计算文件内容的SHA-256，作为缓存键中的工作簿版本"""
+    with open(file_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _value_bytes(value: CacheValue) -> int:
+    if isinstance(value, tuple):
+        return sum(array.nbytes for array in value)
+    return value.nbytes
+
+
+class SearchCache:
+    """搜索结果的LRU缓存
+
+    键为 (工作簿哈希, 列名, 规范化后的搜索内容, ...)，值为匹配行的位置数组（全文检索时附带得分数组），
+    不缓存整行字典，结果中的行数据每次按位置重新取出。
+    总字节数超过上限时淘汰最久未使用的条目；同一个实例可以被多个线程共享。
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES):
+        """
+        Args:
+            budget_bytes (int): 缓存值占用内存的上限（字节）
+        """
+        self.budget_bytes = budget_bytes
+        self._entries: 'OrderedDict[Hashable, CacheValue]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[CacheValue]:
+        """查找缓存，命中时将条目移到最近使用的位置"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: CacheValue):
+        """写入缓存，单个值超过上限时不缓存"""
+        size = _value_bytes(value)
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= _value_bytes(old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= _value_bytes(evicted)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute) -> CacheValue:
+        """命中时返回缓存值，否则调用compute()计算并写入"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, keep_workbooks: Iterable[str] = ()) -> int:
+        """
+        删除缓存条目
+
+        Args:
+            keep_workbooks: 保留这些工作簿哈希的条目（重新上传同一个工作簿时缓存仍然有效），为空时全部删除
+
+        Returns:
+            int: 删除的条目数
+        """
+        keep_workbooks = set(keep_workbooks)
+        with self._lock:
+            stale = [key for key in self._entries if key[0] not in keep_workbooks]
+            for key in stale:
+                self._bytes -= _value_bytes(self._entries.pop(key))
+        if stale:
+            logger.info(f"搜索缓存已失效 {len(stale)} 条")
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中、未命中次数和内存占用"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'budget_bytes': self.budget_bytes
+            }
@@ -0,0 +1,148 @@
+import os
+import sys
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 分析器包内的模块以扁平方式互相导入（from config import ...），需要把包目录加入导入路径
+_ANALYZER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email_relationship_analyzer')
+if _ANALYZER_DIR not in sys.path:
+    sys.path.append(_ANALYZER_DIR)
+
+from utils import normalize_subject, is_reply  # noqa: E402
+from ingest import prepare_chunk, iter_subject_groups  # noqa: E402
+from timeline import OriginalTimeline  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# 会话按该列的标准化主题划分
+SUBJECT_COLUMN = '邮件名称'
+# 计算关系键需要的列
+ADDRESS_COLUMNS = ['发件人', '收件人']
+
+
+class ThreadIndex:
+    """标准化主题 -> 行位置的会话索引
+
+    codes 保存每一行的主题编号（标准化后为空的主题为-1），positions 是按主题编号排序后的行位置，
+    第i个主题的全部行为 positions[indptr[i]:indptr[i + 1]]，由行位置找到所在会话只需几次数组访问。
+    """
+
+    def __init__(self, subjects: List[str], codes: np.ndarray, reply_flags: np.ndarray):
+        """
+        Args:
+            subjects (List[str]): 主题编号 -> 标准化后的主题
+            codes (np.ndarray): 每一行的主题编号
+            reply_flags (np.ndarray): 每一行是否为回复邮件
+        """
+        self.subjects = subjects
+        self.codes = codes
+        self.reply_flags = reply_flags
+        self._ids = {subject: subject_id for subject_id, subject in enumerate(subjects)}
+
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        counts = np.bincount(codes[codes >= 0], minlength=len(subjects))
+        # 编号为-1的行排在最前面，不属于任何会话
+        self.positions = order[len(codes) - int(counts.sum()):]
+        self.indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    @classmethod
+    def build(cls, titles: pd.Series) -> 'ThreadIndex':
+        """
+        由邮件名称列构建索引，每个不同的标题只标准化一次
+
+        Args:
+            titles (pd.Series): 邮件名称列（缺失值为'nan'）
+
+        Returns:
+            ThreadIndex: 会话索引
+        """
+        title_codes, titles = pd.factorize(titles)
+        normalized = [normalize_subject(title) if title != 'nan' else '' for title in titles]
+        reply_lookup = np.array([title != 'nan' and is_reply(title) for title in titles], dtype=bool)
+
+        subject_codes, subjects = pd.factorize(pd.Series(normalized, dtype=object))
+        subject_codes = subject_codes.astype(np.int32)
+        subjects = list(subjects)
+        # 空主题与分析器一样不参与分组
+        if '' in subjects:
+            empty = subjects.index('')
+            subject_codes[subject_codes == empty] = -1
+            subject_codes[subject_codes > empty] -= 1
+            del subjects[empty]
+
+        index = cls(subjects, subject_codes[title_codes], reply_lookup[title_codes])
+        logger.info(f"会话索引已构建: {len(index.subjects)} 个主题")
+        return index
+
+    def subject_of(self, position: int) -> Optional[str]:
+        """行所在会话的标准化主题，空主题时返回None"""
+        code = int(self.codes[position])
+        return self.subjects[code] if code >= 0 else None
+
+    def thread_positions(self, position: int) -> np.ndarray:
+        """与该行标准化主题相同的全部行位置（按行顺序），空主题时只有该行本身"""
+        code = int(self.codes[position])
+        if code < 0:
+            return np.array([position], dtype=np.int32)
+        return self.positions[self.indptr[code]:self.indptr[code + 1]]
+
+    def subject_positions(self, subject: str) -> np.ndarray:
+        """标准化主题对应的全部行位置，主题不存在时为空数组"""
+        code = self._ids.get(subject)
+        if code is None:
+            return np.empty(0, dtype=np.int32)
+        return self.positions[self.indptr[code]:self.indptr[code + 1]]
+
+
+def _recipient_keys(sender: str, subject: str, record) -> List[str]:
+    """发件人与各收件人域名的关系键，跳过格式不正确或无法提取域名、用户名的收件人（与分析器一致）"""
+    return [
+        f"{sender}#{subject}#{recipient_domain}"
+        for recipient, username, recipient_domain in record.recipient_parts
+        if '@' in recipient and recipient_domain and username
+    ]
+
+
+def relationship_keys(rows: pd.DataFrame) -> Dict[int, List[str]]:
+    """
+    按分析器的规则计算同一会话中每一行参与的关系键
+
+    原始邮件与其每个收件人域名构成关系；回复邮件归到发送时间之前、收件人包含回复者的最近一封原始邮件，
+    关系键同时记在回复和这封原始邮件上；会话中没有原始邮件时，回复按独立关系处理。
+
+    Args:
+        rows (pd.DataFrame): 同一标准化主题的全部行，索引为行位置，包含 邮件名称、发件人、收件人（可选 发送时间）列
+
+    Returns:
+        Dict[int, List[str]]: 行位置 -> 关系键列表
+    """
+    # 缺失值在搜索器中保存为'nan'，还原为缺失值后再交给分析器的预处理
+    rows = rows.astype(object).where(rows.astype(object) != 'nan', None)
+    rows = rows.assign(**{'邮件消息标识': rows.index})
+    keys = {position: {} for position in rows.index.tolist()}
+
+    for subject, originals, replies in iter_subject_groups(prepare_chunk(rows)):
+        if not subject:  # 空主题不产生关系
+            continue
+        for original in originals:
+            keys[original.message_id].update(dict.fromkeys(_recipient_keys(original.sender, subject, original)))
+
+        timeline = OriginalTimeline(originals)
+        for reply in replies:
+            if '@' not in (reply.sender or ''):
+                continue
+            if not originals:
+                keys[reply.message_id].update(dict.fromkeys(_recipient_keys(reply.sender, subject, reply)))
+                continue
+            if not reply.sender_domain or not reply.sender_username:
+                continue
+            original = timeline.find(reply.sender, reply.send_ts)
+            if original is not None:
+                key = f"{original.sender}#{subject}#{reply.sender_domain}"
+                keys[reply.message_id][key] = None
+                keys[original.message_id][key] = None
+
+    return {position: list(row_keys) for position, row_keys in keys.items()}
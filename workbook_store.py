@@ -0,0 +1,223 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from typing import BinaryIO, Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from fulltext_index import FullTextIndex
+from thread_index import ThreadIndex
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+    # Parquet保留category和Arrow字符串列的类型，读取时不需要再转换
+    COLUMNS_FILE = 'columns.parquet'
+except ImportError:  # 没有pyarrow时用pickle保存
+    COLUMNS_FILE = 'columns.pkl'
+
+# 默认保留的工作簿数量，超过时删除最久未使用的
+DEFAULT_KEEP = 5
+# 接收上传时每次读取的字节数
+READ_SIZE = 1024 * 1024
+
+
+def save_columns(df: pd.DataFrame, directory: str):
+    """保存搜索器解析后的列（列式缓存）"""
+    path = os.path.join(directory, COLUMNS_FILE)
+    tmp_path = path + '.tmp'
+    if COLUMNS_FILE.endswith('.parquet'):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_columns(directory: str) -> Optional[pd.DataFrame]:
+    """读取列式缓存，不存在时返回None"""
+    path = os.path.join(directory, COLUMNS_FILE)
+    if not os.path.exists(path):
+        return None
+    if COLUMNS_FILE.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _index_path(directory: str, column_name: str) -> str:
+    # 列名可能包含文件名中不允许的字符，用哈希作为文件名
+    digest = hashlib.sha1(column_name.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(directory, f'fulltext-{digest}.npz')
+
+
+def save_fulltext_index(index: FullTextIndex, directory: str, column_name: str):
+    """保存某一列的全文索引"""
+    tokens = [None] * len(index.vocabulary)
+    for token, term_id in index.vocabulary.items():
+        tokens[term_id] = token
+    path = _index_path(directory, column_name)
+    # np.savez会自动补上.npz后缀，临时文件名也以.npz结尾
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(
+        tmp_path,
+        column=np.frombuffer(column_name.encode('utf-8'), dtype=np.uint8),
+        vocabulary=np.frombuffer(json.dumps(tokens, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        indptr=index.indptr,
+        postings_docs=index.postings_docs,
+        postings_tf=index.postings_tf,
+        doc_lengths=index.doc_lengths
+    )
+    os.replace(tmp_path, path)
+
+
+def load_fulltext_index(directory: str, column_name: str) -> Optional[FullTextIndex]:
+    """读取某一列的全文索引，不存在时返回None"""
+    path = _index_path(directory, column_name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        tokens = json.loads(data['vocabulary'].tobytes().decode('utf-8'))
+        return FullTextIndex(
+            {token: term_id for term_id, token in enumerate(tokens)},
+            data['indptr'],
+            data['postings_docs'],
+            data['postings_tf'],
+            data['doc_lengths']
+        )
+
+
+def save_thread_index(index: ThreadIndex, directory: str):
+    """保存会话索引（行位置排序结果在读取时重新计算）"""
+    path = os.path.join(directory, 'threads.npz')
+    tmp_path = os.path.join(directory, 'threads.tmp.npz')
+    np.savez(
+        tmp_path,
+        subjects=np.frombuffer(json.dumps(index.subjects, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        codes=index.codes,
+        reply_flags=index.reply_flags
+    )
+    os.replace(tmp_path, path)
+
+
+def load_thread_index(directory: str) -> Optional[ThreadIndex]:
+    """读取会话索引，不存在时返回None"""
+    path = os.path.join(directory, 'threads.npz')
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return ThreadIndex(
+            json.loads(data['subjects'].tobytes().decode('utf-8')),
+            data['codes'],
+            data['reply_flags']
+        )
+
+
+class WorkbookStore:
+    """按内容哈希存放上传的工作簿及其解析结果
+
+    每个工作簿一个目录 <root>/<sha256>/，其中保存原文件、解析后的列式缓存、各列的全文索引和会话索引。
+    再次上传同一个工作簿时直接读取缓存，不再解析。
+    """
+
+    def __init__(self, root_dir: str, keep: int = DEFAULT_KEEP, in_use: Callable[[], Iterable[str]] = None):
+        """
+        Args:
+            root_dir (str): 存放目录
+            keep (int): 保留的工作簿数量，正在使用的工作簿超过该数量时也全部保留
+            in_use: 返回正在使用的工作簿哈希（当前搜索的、联合搜索中的、分析任务正在读取的），淘汰时跳过
+        """
+        self.root_dir = root_dir
+        self.keep = keep
+        self.in_use = in_use
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def workbook_dir(self, sha256: str) -> str:
+        return os.path.join(self.root_dir, sha256)
+
+    def find(self, sha256: str) -> Optional[str]:
+        """返回已存放的工作簿文件路径，不存在时返回None"""
+        directory = self.workbook_dir(sha256)
+        if not os.path.isdir(directory):
+            return None
+        for name in os.listdir(directory):
+            if name.startswith('workbook.'):
+                return os.path.join(directory, name)
+        return None
+
+    def is_parsed(self, sha256: str) -> bool:
+        """是否已有列式缓存（再次加载时可以跳过解析）"""
+        return os.path.exists(os.path.join(self.workbook_dir(sha256), COLUMNS_FILE))
+
+    def add_file(self, file_path: str, sha256: str) -> str:
+        """
+        将已经计算过哈希的文件移入存放目录，同一内容已存在时删除传入的文件
+
+        Args:
+            file_path (str): 上传得到的文件
+            sha256 (str): 文件内容的SHA-256
+
+        Returns:
+            str: 存放后的文件路径
+        """
+        with self._lock:
+            existing = self.find(sha256)
+            if existing is not None:
+                os.remove(file_path)
+                self.touch(sha256)
+                logger.info(f"工作簿 {sha256[:12]} 已存在，跳过保存")
+                return existing
+            directory = self.workbook_dir(sha256)
+            os.makedirs(directory, exist_ok=True)
+            target = os.path.join(directory, 'workbook' + os.path.splitext(file_path)[1].lower())
+            shutil.move(file_path, target)
+            self._prune(keep=sha256)
+            return target
+
+    def add_stream(self, stream: BinaryIO, extension: str) -> tuple:
+        """
+        边接收边计算哈希，写入临时文件后再移入存放目录
+
+        Args:
+            stream: 上传文件的流
+            extension (str): 文件扩展名，例如 .xlsx
+
+        Returns:
+            tuple: (存放后的文件路径, SHA-256)
+        """
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.root_dir, f'.incoming-{threading.get_ident()}{extension.lower()}')
+        with open(tmp_path, 'wb') as f:
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+        sha256 = digest.hexdigest()
+        return self.add_file(tmp_path, sha256), sha256
+
+    def touch(self, sha256: str):
+        """记录最近一次使用时间，用于淘汰"""
+        directory = self.workbook_dir(sha256)
+        if os.path.isdir(directory):
+            os.utime(directory)
+
+    def _prune(self, keep: str):
+        """只保留最近使用的若干个工作簿，刚加入的和正在使用的工作簿不删除"""
+        protected = {keep}
+        if self.in_use is not None:
+            protected.update(self.in_use())
+        entries = [
+            name for name in os.listdir(self.root_dir)
+            if not name.startswith('.') and os.path.isdir(os.path.join(self.root_dir, name))
+        ]
+        idle = [name for name in entries if name not in protected]
+        idle.sort(key=lambda name: os.path.getmtime(os.path.join(self.root_dir, name)), reverse=True)
+        for name in idle[max(self.keep - (len(entries) - len(idle)), 0):]:
+            shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+            logger.info(f"已删除最久未使用的工作簿: {name[:12]}")